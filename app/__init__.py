@@ -4,13 +4,27 @@ from flask import Flask, session, request, g
 from .extensions import login_manager
 import config
 from datetime import timedelta 
+import time
 
 # ¡NUEVO! Importamos los servicios
+_inicio_import = time.perf_counter()
 from . import services
+_tiempo_import_services = time.perf_counter() - _inicio_import
 
 
 
 def create_app():
+    # Desglose del tiempo de arranque (se imprime al final)
+    tiempos = {'imports': _tiempo_import_services}
+    inicio = time.perf_counter()
+    marca = inicio
+
+    def medir(etapa):
+        nonlocal marca
+        ahora = time.perf_counter()
+        tiempos[etapa] = tiempos.get(etapa, 0.0) + ahora - marca
+        marca = ahora
+
     app = Flask(__name__, instance_relative_config=False)
     app.config['SECRET_KEY'] = config.SECRET_KEY
     
@@ -58,11 +72,24 @@ def create_app():
         # desde el controlador al servicio.
         g.db_key = session.get('db_key')
 
+        # 4. Si otro worker refrescó el caché de sensores, tomar la versión nueva
+        services.sincronizar_cache_compartido()
+
+        # 5. Programador de precalentamiento de este proceso (arranca con el primer pedido)
+        services.warmup.asegurar_iniciado()
+
 
     with app.app_context():
         # --- ¡NUEVO! Construir los Caches al inicio ---
         # (Llamamos a la función que ahora vive en el servicio)
-        services.G_SENSOR_CACHE = services.build_global_cache()
+        # Solo se importan los repositorios (y drivers) de las BDs configuradas
+        medir('flask')
+        drivers = services.cargar_repositorios_configurados()
+        medir('drivers')
+        # Con 'gunicorn --preload' se arma una vez en el master y los workers lo heredan;
+        # sin --preload, el primer worker lo arma y los demás cargan el snapshot compartido.
+        services.init_global_cache()
+        medir('cache')
 
         # Importar modelos (para que se registre el user_loader)
         from . import models
@@ -74,5 +101,10 @@ def create_app():
         # Registrar los blueprints
         app.register_blueprint(controllers.main_bp)
         app.register_blueprint(auth_controllers.auth_bp) 
+        medir('blueprints')
+
+        total = tiempos['imports'] + time.perf_counter() - inicio
+        detalle = ' | '.join(f"{etapa} {segundos:.2f}s" for etapa, segundos in tiempos.items())
+        print(f"⏱️ Arranque en {total:.2f}s ({detalle}) - drivers: {', '.join(drivers) or 'ninguno'}")
 
         return app
\ No newline at end of file
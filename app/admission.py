@@ -0,0 +1,133 @@
+# app/admission.py
+# Control de admisión para los endpoints "pesados" (reportes y gráficos).
+#
+# - Tope GLOBAL de ejecuciones simultáneas (protege workers y BD).
+# - Tope POR USUARIO (uno no puede acaparar todo): si lo supera -> 429 inmediato.
+#   Cuentan las que están corriendo y las que esperan: uno solo no puede llenar la cola.
+# - Cola de espera ACOTADA: si el tope global está lleno se espera un rato;
+#   si la cola también está llena, o se vence la espera -> 503 inmediato.
+
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+from functools import wraps
+from flask import jsonify, flash, redirect, url_for
+from flask_login import current_user
+import config
+
+ADMISSION_MAX_GLOBAL = getattr(config, 'ADMISSION_MAX_GLOBAL', 8)
+ADMISSION_MAX_POR_USUARIO = getattr(config, 'ADMISSION_MAX_POR_USUARIO', 2)
+ADMISSION_MAX_EN_ESPERA = getattr(config, 'ADMISSION_MAX_EN_ESPERA', 16)
+ADMISSION_ESPERA_MAX_SEGUNDOS = getattr(config, 'ADMISSION_ESPERA_MAX_SEGUNDOS', 10)
+
+
+class Rechazado(Exception):
+    """La petición no fue admitida. 'status' es 429 (usuario) o 503 (servidor saturado)."""
+    def __init__(self, status, mensaje):
+        super().__init__(mensaje)
+        self.status = status
+        self.mensaje = mensaje
+
+
+class ControlDeAdmision:
+
+    def __init__(self, max_global, max_por_usuario, max_en_espera, espera_max_segundos):
+        self.max_global = max_global
+        self.max_por_usuario = max_por_usuario
+        self.max_en_espera = max_en_espera
+        self.espera_max_segundos = espera_max_segundos
+        self.cond = threading.Condition()
+        self.activos = 0
+        self.en_espera = 0
+        self.por_usuario = {}
+        self.stats = {'admitidos': 0, 'rechazados_429': 0, 'rechazados_503': 0}
+
+    def _soltar_usuario(self, usuario):
+        self.por_usuario[usuario] -= 1
+        if not self.por_usuario[usuario]: del self.por_usuario[usuario]
+
+    @contextmanager
+    def admitir(self, usuario):
+        with self.cond:
+            # 'por_usuario' cuenta las activas y las que esperan
+            if self.por_usuario.get(usuario, 0) >= self.max_por_usuario:
+                self.stats['rechazados_429'] += 1
+                raise Rechazado(429, 'Ya tiene otras consultas pesadas en curso. Espere a que terminen e intente de nuevo.')
+
+            if self.activos >= self.max_global and self.en_espera >= self.max_en_espera:
+                self.stats['rechazados_503'] += 1
+                raise Rechazado(503, 'El servidor está ocupado. Intente de nuevo en unos minutos.')
+            self.por_usuario[usuario] = self.por_usuario.get(usuario, 0) + 1
+
+            if self.activos >= self.max_global:
+                self.en_espera += 1
+                limite = time.monotonic() + self.espera_max_segundos
+                try:
+                    while self.activos >= self.max_global:
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            self.stats['rechazados_503'] += 1
+                            raise Rechazado(503, 'El servidor está ocupado. Intente de nuevo en unos minutos.')
+                        self.cond.wait(restante)
+                except BaseException:
+                    self._soltar_usuario(usuario)
+                    raise
+                finally:
+                    self.en_espera -= 1
+
+            self.activos += 1
+            self.stats['admitidos'] += 1
+
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.activos -= 1
+                self._soltar_usuario(usuario)
+                self.cond.notify()
+
+    def get_stats(self):
+        with self.cond:
+            return dict(self.stats, activos=self.activos, en_espera=self.en_espera)
+
+
+control_pesados = ControlDeAdmision(
+    ADMISSION_MAX_GLOBAL, ADMISSION_MAX_POR_USUARIO, ADMISSION_MAX_EN_ESPERA, ADMISSION_ESPERA_MAX_SEGUNDOS
+)
+
+
+def endpoint_pesado(respuesta='json', redirigir_a='main.report_page'):
+    """
+    Decorador para rutas pesadas. Si la petición es rechazada:
+    - respuesta='json': devuelve {'error': ...} con 429/503 (rutas AJAX).
+    - respuesta='flash': muestra el mensaje y redirige (formularios).
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            usuario = current_user.get_id() if current_user.is_authenticated else 'anonimo'
+            cupo = ExitStack()
+            try:
+                cupo.enter_context(control_pesados.admitir(usuario))
+                try:
+                    resultado = vista(*args, **kwargs)
+                except BaseException:
+                    cupo.close()
+                    raise
+                if getattr(resultado, 'is_streamed', False):
+                    # Respuesta en streaming: el trabajo sigue después de volver de la vista,
+                    # el cupo se libera cuando termina de enviarse (o el cliente corta)
+                    resultado.call_on_close(cupo.close)
+                else:
+                    cupo.close()
+                return resultado
+            except Rechazado as r:
+                if respuesta == 'flash':
+                    flash(r.mensaje, 'warning')
+                    return redirect(url_for(redirigir_a))
+                response = jsonify({'error': r.mensaje})
+                response.status_code = r.status
+                response.headers['Retry-After'] = str(ADMISSION_ESPERA_MAX_SEGUNDOS)
+                return response
+        return envoltura
+    return decorador
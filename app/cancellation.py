@@ -0,0 +1,198 @@
+# app/cancellation.py
+# Cancelación de consultas en curso.
+#
+# Cada petición pesada abre un "alcance" (AlcanceCancelable). Los repositorios
+# registran ahí cómo cortar la consulta que están ejecutando:
+#   - psycopg2: connection.cancel()
+#   - pyodbc:   cursor.cancel()
+# El alcance se cancela cuando:
+#   - el mismo usuario pide otra vez el mismo gráfico/reporte (la vieja queda obsoleta), o
+#   - el navegador avisa que se fue (sendBeacon a /api/cancel-request al cerrar la pestaña).
+# En las respuestas en streaming (CSV, ZIP) el trabajo sigue después de volver de la vista:
+# el alcance acompaña al generador y se cierra cuando termina el envío.
+
+import contextvars
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from flask import request
+from flask_login import current_user
+
+_alcance_actual = contextvars.ContextVar('alcance_cancelable', default=None)
+
+_activos = {}        # (usuario, clave) -> alcance
+_por_token = {}      # token -> alcance
+_registro_lock = threading.Lock()
+
+_stats = {'reemplazada': 0, 'cliente_desconectado': 0, 'consultas_interrumpidas': 0}
+_stats_lock = threading.Lock()
+
+
+class ConsultaCancelada(Exception):
+    """La consulta se cortó porque su petición fue cancelada."""
+
+
+class AlcanceCancelable:
+
+    def __init__(self, usuario, clave, token):
+        self.usuario = usuario
+        self.clave = clave
+        self.token = token
+        self.cancelado = False
+        self.motivo = None
+        self.lock = threading.Lock()
+        self.en_curso = {}   # marca -> función que corta la consulta
+        self.contexto = None
+
+    def cancelar(self, motivo):
+        with self.lock:
+            if self.cancelado: return
+            self.cancelado = True
+            self.motivo = motivo
+            cortes = list(self.en_curso.values())
+        with _stats_lock:
+            _stats[motivo] = _stats.get(motivo, 0) + 1
+            _stats['consultas_interrumpidas'] += len(cortes)
+        for cortar in cortes:
+            try:
+                cortar()
+            except Exception as e:
+                print(f"⚠️ No se pudo cancelar una consulta: {e}")
+
+
+def iniciar(usuario, clave, token=None):
+    """Abre un alcance para la petición actual y cancela el anterior del mismo (usuario, clave)."""
+    alcance = AlcanceCancelable(usuario, clave, token)
+    with _registro_lock:
+        anterior = _activos.get((usuario, clave))
+        _activos[(usuario, clave)] = alcance
+        if token: _por_token[token] = alcance
+    if anterior:
+        anterior.cancelar('reemplazada')
+    alcance.contexto = _alcance_actual.set(alcance)
+    return alcance
+
+
+def finalizar(alcance):
+    _alcance_actual.reset(alcance.contexto)
+    _desregistrar(alcance)
+
+
+def _desregistrar(alcance):
+    with _registro_lock:
+        if _activos.get((alcance.usuario, alcance.clave)) is alcance:
+            del _activos[(alcance.usuario, alcance.clave)]
+        if alcance.token and _por_token.get(alcance.token) is alcance:
+            del _por_token[alcance.token]
+
+
+def cancelar_por_token(usuario, token):
+    """Cancelación explícita desde el navegador. Solo puede cancelar sus propias peticiones."""
+    with _registro_lock:
+        alcance = _por_token.get(token)
+    if alcance and alcance.usuario == usuario:
+        alcance.cancelar('cliente_desconectado')
+        return True
+    return False
+
+
+def verificar():
+    """Corta temprano si la petición ya fue cancelada (antes de lanzar otra consulta)."""
+    alcance = _alcance_actual.get()
+    if alcance and alcance.cancelado:
+        raise ConsultaCancelada(f"Consulta cancelada ({alcance.motivo}).")
+
+
+@contextmanager
+def registrar(cortar):
+    """
+    Envuelve la ejecución de una consulta. 'cortar' es connection.cancel (psycopg2)
+    o cursor.cancel (pyodbc). Sin alcance activo (p. ej. al armar el caché) no hace nada.
+    """
+    alcance = _alcance_actual.get()
+    if alcance is None:
+        yield
+        return
+    verificar()
+    marca = object()
+    with alcance.lock:
+        alcance.en_curso[marca] = cortar
+    try:
+        yield
+    except Exception as e:
+        if alcance.cancelado:
+            raise ConsultaCancelada(f"Consulta cancelada ({alcance.motivo}).") from e
+        raise
+    finally:
+        with alcance.lock:
+            alcance.en_curso.pop(marca, None)
+
+
+def en_contexto(fn):
+    """Para hilos auxiliares (ThreadPoolExecutor): corre 'fn' con el alcance de la petición."""
+    contexto = contextvars.copy_context()
+    return lambda *args, **kwargs: contexto.copy().run(fn, *args, **kwargs)
+
+
+def en_stream(iterable, alcance):
+    """
+    Recorre 'iterable' (el cuerpo de una respuesta en streaming) con 'alcance' activo en
+    cada paso, así sus consultas (y los hilos que lance) siguen siendo cancelables.
+    Si se cancela, la descarga se corta sin error: ya no hay a quién mandársela.
+    """
+    iterador = iter(iterable)
+    try:
+        while True:
+            marca = _alcance_actual.set(alcance)
+            try:
+                trozo = next(iterador)
+            except (StopIteration, ConsultaCancelada):
+                return
+            finally:
+                _alcance_actual.reset(marca)
+            yield trozo
+    finally:
+        cerrar = getattr(iterable, 'close', None)
+        if cerrar is not None:
+            marca = _alcance_actual.set(alcance)
+            try:
+                cerrar()
+            finally:
+                _alcance_actual.reset(marca)
+
+
+def cancelable(clave_por_defecto):
+    """
+    Decorador de rutas: abre el alcance con la clave 'chart_key' (o la clave por defecto)
+    y el 'request_token' que manda el navegador.
+    Si la vista devuelve una respuesta en streaming, el alcance pasa al generador y sigue
+    registrado hasta que se cierra la respuesta (como el cupo de app/admission.py).
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            usuario = current_user.get_id() if current_user.is_authenticated else 'anonimo'
+            clave = request.values.get('chart_key') or clave_por_defecto
+            alcance = iniciar(usuario, clave, request.values.get('request_token'))
+            try:
+                resultado = vista(*args, **kwargs)
+            except BaseException:
+                finalizar(alcance)
+                raise
+            if getattr(resultado, 'is_streamed', False):
+                _alcance_actual.reset(alcance.contexto)
+                resultado.response = en_stream(resultado.response, alcance)
+                resultado.call_on_close(lambda: _desregistrar(alcance))
+            else:
+                finalizar(alcance)
+            return resultado
+        return envoltura
+    return decorador
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    with _registro_lock:
+        stats['peticiones_activas'] = len(_activos)
+    return stats
@@ -0,0 +1,168 @@
+# app/chart_pyramid.py
+# Pirámides min/max/promedio para los gráficos con zoom.
+#
+# Por cada (db_key, ema_id, sensor) se guarda la historia en varios niveles
+# (crudo, 10 min, hora, día, semana). Cada bucket guarda min, max, suma y cantidad,
+# así un bucket abierto se puede completar cuando llegan datos nuevos sin recalcular nada.
+# Para un rango y un ancho en píxeles se elige el nivel más fino que entra en pantalla:
+# el zoom/paneo cuesta lo mismo con un mes de historia que con diez años.
+# El nivel crudo guarda la historia entera: además de PIRAMIDE_MAX_ENTRADAS, la suma de los
+# bytes de todas las pirámides no pasa de PIRAMIDE_MAX_BYTES (se descartan las menos usadas).
+
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import config
+from . import resampling
+
+# (nombre, ancho de bucket) del más fino al más grueso; None = dato crudo
+NIVELES = [('crudo', None), ('10min', '10min'), ('hora', '1h'), ('dia', '1D'), ('semana', '1W')]
+
+PIRAMIDE_MAX_ENTRADAS = getattr(config, 'PIRAMIDE_MAX_ENTRADAS', 200)
+PIRAMIDE_MAX_BYTES = getattr(config, 'PIRAMIDE_MAX_BYTES', 128 * 1024 * 1024)
+PIRAMIDE_REFRESCO_SEGUNDOS = getattr(config, 'PIRAMIDE_REFRESCO_SEGUNDOS', 60)
+
+_piramides = OrderedDict()   # (db_key, ema_id, sensor_info) -> Piramide (LRU)
+_piramides_lock = threading.Lock()
+_stats = {'aciertos': 0, 'construcciones': 0, 'extensiones': 0, 'descartes': 0}
+
+
+class Nivel:
+    """Buckets de un nivel: inicio, min, max, suma y cantidad (arrays alineados)."""
+
+    def __init__(self):
+        self.t = np.array([], dtype='datetime64[ns]')
+        self.min = np.array([], dtype='float64')
+        self.max = np.array([], dtype='float64')
+        self.suma = np.array([], dtype='float64')
+        self.cantidad = np.array([], dtype='float64')
+
+    def agregar(self, t, mn, mx, suma, cantidad):
+        if len(t) == 0: return
+        # El primer bucket nuevo puede ser el último (todavía abierto) que ya teníamos
+        if len(self.t) and t[0] == self.t[-1]:
+            self.min[-1] = min(self.min[-1], mn[0])
+            self.max[-1] = max(self.max[-1], mx[0])
+            self.suma[-1] += suma[0]
+            self.cantidad[-1] += cantidad[0]
+            t, mn, mx, suma, cantidad = t[1:], mn[1:], mx[1:], suma[1:], cantidad[1:]
+        self.t = np.concatenate([self.t, t])
+        self.min = np.concatenate([self.min, mn])
+        self.max = np.concatenate([self.max, mx])
+        self.suma = np.concatenate([self.suma, suma])
+        self.cantidad = np.concatenate([self.cantidad, cantidad])
+
+    def nbytes(self):
+        return self.t.nbytes + self.min.nbytes + self.max.nbytes + self.suma.nbytes + self.cantidad.nbytes
+
+
+class Piramide:
+
+    def __init__(self):
+        self.niveles = {nombre: Nivel() for nombre, _ in NIVELES}
+        self.ultimo_ts = None
+        self.construida = False
+        self.actualizada = 0.0
+        self.lock = threading.Lock()
+
+    def extender(self, timestamps, valores):
+        """Suma a la pirámide los puntos posteriores al último que ya tiene (la serie viene ordenada)."""
+        if self.ultimo_ts is not None:
+            nuevos = timestamps > self.ultimo_ts
+            timestamps, valores = timestamps[nuevos], valores[nuevos]
+        self.actualizada = time.monotonic()
+        if len(timestamps) == 0: return 0
+
+        specs = {(ancho, f) for _, ancho in NIVELES if ancho for f in ('min', 'max', 'sum', 'count')}
+        agregados = resampling.resample(timestamps, valores, specs)
+        for nombre, ancho in NIVELES:
+            if ancho is None:
+                self.niveles[nombre].agregar(timestamps, valores, valores, valores, np.ones(len(valores)))
+            else:
+                t, mn = agregados[(ancho, 'min')]
+                self.niveles[nombre].agregar(
+                    t, mn, agregados[(ancho, 'max')][1], agregados[(ancho, 'sum')][1], agregados[(ancho, 'count')][1]
+                )
+        self.ultimo_ts = timestamps[-1]
+        return len(timestamps)
+
+    def puntos(self):
+        return len(self.niveles['crudo'].t)
+
+    def nbytes(self):
+        return sum(nivel.nbytes() for nivel in self.niveles.values())
+
+    def ventana(self, desde, hasta, max_puntos):
+        """
+        Nivel más fino cuyo rango [desde, hasta] entra en 'max_puntos' buckets.
+        Solo hace búsquedas binarias: no depende del largo de la historia.
+        """
+        for nombre, ancho in NIVELES:
+            nivel = self.niveles[nombre]
+            # Incluye el bucket que contiene 'desde' aunque haya empezado antes
+            i0 = np.searchsorted(nivel.t, desde, side='left' if ancho is None else 'right')
+            i0 = max(int(i0) - (0 if ancho is None else 1), 0)
+            i1 = int(np.searchsorted(nivel.t, hasta, side='right'))
+            if i1 - i0 <= max_puntos or nombre == NIVELES[-1][0]:
+                return nombre, nivel, i0, i1
+
+
+def obtener(clave, fecha_inicio_historia, fetch_serie):
+    """
+    Devuelve la pirámide de 'clave' lista para usar.
+    - La primera vez trae la historia completa desde 'fecha_inicio_historia' ('YYYY-MM-DD').
+    - Después, cada PIRAMIDE_REFRESCO_SEGUNDOS trae solo desde el último dato y la extiende.
+    'fetch_serie(fecha_inicio, fecha_fin)' devuelve (timestamps, valores) ordenados.
+    """
+    with _piramides_lock:
+        piramide = _piramides.get(clave)
+        if piramide is None:
+            piramide = _piramides[clave] = Piramide()
+            if len(_piramides) > PIRAMIDE_MAX_ENTRADAS:
+                _piramides.popitem(last=False)
+                _stats['descartes'] += 1
+        else:
+            _piramides.move_to_end(clave)
+
+    hoy = time.strftime('%Y-%m-%d')
+    with piramide.lock:
+        if not piramide.construida:
+            timestamps, valores = fetch_serie(fecha_inicio_historia, hoy)
+            piramide.extender(timestamps, valores)
+            piramide.construida = True
+            with _piramides_lock: _stats['construcciones'] += 1
+        elif time.monotonic() - piramide.actualizada > PIRAMIDE_REFRESCO_SEGUNDOS:
+            desde = str(piramide.ultimo_ts.astype('datetime64[D]')) if piramide.ultimo_ts is not None else fecha_inicio_historia
+            timestamps, valores = fetch_serie(desde, hoy)
+            piramide.extender(timestamps, valores)
+            with _piramides_lock: _stats['extensiones'] += 1
+        else:
+            with _piramides_lock: _stats['aciertos'] += 1
+            return piramide
+    _recortar(clave)
+    return piramide
+
+
+def _recortar(clave_en_uso):
+    """Descarta las pirámides menos usadas hasta que el total entre en PIRAMIDE_MAX_BYTES."""
+    with _piramides_lock:
+        total = sum(p.nbytes() for p in _piramides.values())
+        for clave in list(_piramides):
+            if total <= PIRAMIDE_MAX_BYTES: break
+            # La que se acaba de pedir se conserva aunque sola se pase del tope
+            if clave == clave_en_uso: continue
+            total -= _piramides.pop(clave).nbytes()
+            _stats['descartes'] += 1
+
+
+def a_milisegundos(t):
+    return t.astype('datetime64[ms]').astype('int64').tolist()
+
+
+def get_stats():
+    with _piramides_lock:
+        return dict(
+            _stats, entradas=len(_piramides), puntos=sum(p.puntos() for p in _piramides.values()),
+            bytes=sum(p.nbytes() for p in _piramides.values()), max_bytes=PIRAMIDE_MAX_BYTES,
+        )
@@ -0,0 +1,173 @@
+# app/circuit_breaker.py
+# Disyuntor por BD: si un servidor no responde, fallar en milisegundos en vez de
+# esperar el timeout de conexión en cada petición.
+#
+# Sin esto, con el SQL Server caído cada pedido cuyo session['db_key'] apunta ahí se
+# quedaba colgado en el connect de ODBC (y ocupaba un worker), para terminar mostrando
+# desplegables vacíos. Ahora:
+#   - 'cerrado':     normal. Cada falla de CONEXIÓN (no de SQL) suma; un éxito resetea.
+#   - 'abierto':     tras CIRCUIT_FALLOS_PARA_ABRIR fallas seguidas. Todo pedido a esa BD
+#                    lanza BaseDatosNoDisponible al instante (controllers: 503 / flash).
+#   - 'semiabierto': cada CIRCUIT_SEGUNDOS_ABIERTO un hilo de fondo prueba conectarse.
+#                    Si puede, el circuito se cierra; si no, vuelve a 'abierto'.
+# Los pedidos nunca hacen de prueba: solo el hilo de fondo paga el timeout.
+# Cada réplica (app/db_routing.py) tiene su propio disyuntor: una réplica caída no
+# corta el primario.
+
+import threading
+import time
+import config
+
+CIRCUIT_FALLOS_PARA_ABRIR = getattr(config, 'CIRCUIT_FALLOS_PARA_ABRIR', 3)
+CIRCUIT_SEGUNDOS_ABIERTO = getattr(config, 'CIRCUIT_SEGUNDOS_ABIERTO', 15)
+# Timeout de conexión (s) si la BD no define 'connect_timeout_seconds' en config.DATABASE_CONNECTIONS
+DB_CONNECT_TIMEOUT_SECONDS = getattr(config, 'DB_CONNECT_TIMEOUT_SECONDS', 5)
+
+# Errores de los drivers que indican que el servidor no está (los de SQL no cuentan).
+# psycopg2 reporta cancelaciones y statement_timeout como OperationalError: se excluyen.
+_ERRORES_DE_CONEXION = {'OperationalError', 'InterfaceError'}
+_ERRORES_DE_CONSULTA = {'QueryCanceledError', 'QueryCanceled'}
+# pyodbc también usa OperationalError para el timeout de consulta (HYT00) y la
+# cancelación (HY008): se decide por el SQLSTATE (error.args[0]). Cuentan como conexión
+# 08xxx (enlace), HYT01 (timeout de conexión), IMxxx (driver/DSN) y 28xxx (login).
+# Los SQLSTATE de PostgreSQL (pgcode) 57P01-57P03 son el servidor apagándose/arrancando.
+_SQLSTATE_DE_CONEXION = ('08', 'IM', '28', '57P')
+_SQLSTATE_DE_CONEXION_EXACTOS = {'HYT01'}
+
+_circuitos = {}   # (db_key, replica) -> _Circuito
+_lock = threading.Lock()
+
+
+class BaseDatosNoDisponible(Exception):
+    """La BD no responde (o su disyuntor está abierto)."""
+
+
+class _Circuito:
+    def __init__(self):
+        self.estado = 'cerrado'
+        self.fallos = 0
+        self.abierto_desde = None
+        self.ultimo_error = None
+        self.abrir_conexion = None   # última forma de conectarse (la usa la prueba de fondo)
+        self.stats = {'aperturas': 0, 'rechazos_rapidos': 0, 'pruebas': 0}
+
+
+def _circuito(db_key, replica):
+    with _lock:
+        return _circuitos.setdefault((db_key, replica), _Circuito())
+
+
+def _nombre(db_key, replica):
+    nombre = config.DATABASE_CONNECTIONS.get(db_key, {}).get('display_name', db_key)
+    return nombre if replica is None else f"{nombre} (réplica {replica})"
+
+
+def connect_timeout(db_config):
+    return int(db_config.get('connect_timeout_seconds', DB_CONNECT_TIMEOUT_SECONDS))
+
+
+def _sqlstate(error):
+    """SQLSTATE del error: pgcode en psycopg2, args[0] en pyodbc. None si no trae."""
+    if hasattr(error, 'pgcode'): return error.pgcode
+    estado = error.args[0] if error.args else None
+    return estado if isinstance(estado, str) and len(estado) == 5 else None
+
+
+def es_falla_de_conexion(error):
+    """True si 'error' indica que la BD no está (incluye BaseDatosNoDisponible)."""
+    if isinstance(error, BaseDatosNoDisponible): return True
+    nombres = {clase.__name__ for clase in type(error).__mro__}
+    if not nombres & _ERRORES_DE_CONEXION or nombres & _ERRORES_DE_CONSULTA: return False
+    estado = _sqlstate(error)
+    # Sin SQLSTATE: psycopg2 al perder el socket ("server closed the connection")
+    if estado is None: return True
+    return estado.startswith(_SQLSTATE_DE_CONEXION) or estado in _SQLSTATE_DE_CONEXION_EXACTOS
+
+
+def verificar(db_key, replica=None):
+    """Lanza BaseDatosNoDisponible si el disyuntor de esa BD no está cerrado."""
+    circuito = _circuito(db_key, replica)
+    if circuito.estado == 'cerrado': return
+    with _lock:
+        circuito.stats['rechazos_rapidos'] += 1
+    raise BaseDatosNoDisponible(f"La base de datos {_nombre(db_key, replica)} no está disponible. Intente de nuevo en unos minutos.")
+
+
+def registrar_fallo(db_key, replica, error):
+    circuito = _circuito(db_key, replica)
+    with _lock:
+        circuito.fallos += 1
+        circuito.ultimo_error = str(error)
+        if circuito.estado != 'cerrado' or circuito.fallos < CIRCUIT_FALLOS_PARA_ABRIR: return
+        circuito.estado = 'abierto'
+        circuito.abierto_desde = time.time()
+        circuito.stats['aperturas'] += 1
+    print(f"⚠️ Disyuntor abierto para {_nombre(db_key, replica)}: {error}")
+    threading.Thread(target=_probar_hasta_cerrar, args=(db_key, replica), name='disyuntor', daemon=True).start()
+
+
+def anotar_error(db_key, replica, error):
+    """
+    Suma 'error' al disyuntor si es una falla de conexión ocurrida a mitad de consulta.
+    app/db_pool.py lo hace solo; lo usan las conexiones directas (fuera del pool).
+    """
+    if isinstance(error, BaseDatosNoDisponible) or not es_falla_de_conexion(error): return False
+    registrar_fallo(db_key, replica, error)
+    return True
+
+
+def registrar_exito(db_key, replica=None):
+    circuito = _circuito(db_key, replica)
+    if circuito.fallos:
+        with _lock: circuito.fallos = 0
+
+
+def _probar_hasta_cerrar(db_key, replica):
+    circuito = _circuito(db_key, replica)
+    while True:
+        time.sleep(CIRCUIT_SEGUNDOS_ABIERTO)
+        with _lock:
+            circuito.estado = 'semiabierto'
+            circuito.stats['pruebas'] += 1
+        try:
+            circuito.abrir_conexion().close()
+        except Exception as e:
+            with _lock:
+                circuito.estado = 'abierto'
+                circuito.ultimo_error = str(e)
+            continue
+        with _lock:
+            circuito.estado = 'cerrado'
+            circuito.fallos = 0
+            circuito.abierto_desde = None
+        print(f"✅ Disyuntor cerrado: {_nombre(db_key, replica)} responde otra vez")
+        return
+
+
+def conectar(db_key, replica, abrir_conexion):
+    """
+    abrir_conexion() protegida por el disyuntor: falla al instante si está abierto y
+    cuenta las fallas de conexión (que se informan como BaseDatosNoDisponible).
+    """
+    verificar(db_key, replica)
+    circuito = _circuito(db_key, replica)
+    circuito.abrir_conexion = abrir_conexion
+    try:
+        conn = abrir_conexion()
+    except Exception as e:
+        if not es_falla_de_conexion(e): raise
+        registrar_fallo(db_key, replica, e)
+        raise BaseDatosNoDisponible(f"No se pudo conectar con la base de datos {_nombre(db_key, replica)}.") from e
+    registrar_exito(db_key, replica)
+    return conn
+
+
+def get_stats():
+    with _lock:
+        return {
+            _nombre(db_key, replica): dict(
+                c.stats, estado=c.estado, fallos_seguidos=c.fallos, ultimo_error=c.ultimo_error,
+                abierto_desde=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(c.abierto_desde)) if c.abierto_desde else None,
+            )
+            for (db_key, replica), c in _circuitos.items()
+        }
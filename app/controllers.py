@@ -2,49 +2,80 @@
 
 from flask import (
     render_template, request, make_response, jsonify, 
-    Blueprint, g, session, redirect, url_for, flash # <--- Agregamos 'flash'
+    Blueprint, g, session, redirect, url_for, flash, # <--- Agregamos 'flash'
+    Response, stream_with_context, send_file, abort
 )
 from flask_login import login_required, current_user 
 from datetime import datetime # Importante para fechas
 from . import services 
+from .admission import endpoint_pesado
+from .cancellation import cancelable, cancelar_por_token, ConsultaCancelada
+from .single_flight import EsperaAgotada
+from .circuit_breaker import BaseDatosNoDisponible
 import config
 
 main_bp = Blueprint('main', __name__)
 
+
+def _db_keys_from(values):
+    """
+    Lee la lista de BDs pedida ('db_key' repetido). Si hay más de una,
+    devuelve la lista (modo fan-out); si no, la BD de la sesión.
+    """
+    db_keys = [k for k in values if k in config.DATABASE_CONNECTIONS]
+    if len(db_keys) > 1: return db_keys
+    return db_keys[0] if db_keys else g.db_key
+
+
+def _o_aviso(obtener, *args):
+    """Datos para armar una página; si la BD no está disponible, lo avisa (flash) y sigue vacía."""
+    try:
+        return obtener(*args)
+    except BaseDatosNoDisponible as e:
+        flash(str(e), 'danger')
+        return []
+
+@main_bp.errorhandler(BaseDatosNoDisponible)
+def base_no_disponible(e):
+    # Lo que no maneja cada ruta (las de páginas y formularios lo hacen con flash)
+    return jsonify({'error': str(e)}), 503
+
 @main_bp.route('/')
 @login_required 
 def index():
-    ema_locations = services.get_ema_locations_service(g.db_key)
+    ema_locations = _o_aviso(services.get_ema_locations_service, g.db_key)
     owm_api_key = config.OWM_API_KEY
     return render_template('index.html', ema_locations=ema_locations, owm_api_key=owm_api_key)
 
 @main_bp.route('/reportes', methods=['GET']) 
 @login_required 
 def report_page():
-    emas_display_list = services.get_ema_list_service(g.db_key)
+    emas_display_list = _o_aviso(services.get_ema_list_service, g.db_key)
     return render_template('reportes.html', emas_list=emas_display_list)
 
 @main_bp.route('/graficos', methods=['GET'])
 @login_required
 def chart_dashboard_page():
-    emas_display_list = services.get_ema_list_service(g.db_key)
+    emas_display_list = _o_aviso(services.get_ema_list_service, g.db_key)
     default_ema_id = 1
     if not emas_display_list: default_ema_id = 0
     elif not any(e[0] == 1 for e in emas_display_list): default_ema_id = emas_display_list[0][0]
     dashboard_data = {}
     if default_ema_id != 0:
-        dashboard_data = services.get_dashboard_data_service(g.db_key, default_ema_id)
+        dashboard_data = _o_aviso(services.get_dashboard_data_service, g.db_key, default_ema_id) or {}
     return render_template('graficos.html', emas_list=emas_display_list, selected_ema_id=default_ema_id, dashboard_data=dashboard_data)
 
 @main_bp.route('/graficos-personalizados', methods=['GET'])
 @login_required
 def custom_chart_page():
-    emas_display_list = services.get_ema_list_service(g.db_key)
+    emas_display_list = _o_aviso(services.get_ema_list_service, g.db_key)
     return render_template('graficos_personalizados.html', emas_list=emas_display_list)
 
 # --- RUTA DE DESCARGA (CON ALERTA EN PANTALLA) ---
 @main_bp.route('/download-report', methods=['POST']) 
 @login_required 
+@cancelable('download-report')
+@endpoint_pesado(respuesta='flash')
 def download_report():
     try:
         # Validación de usuario restringido
@@ -59,29 +90,126 @@ def download_report():
                 # Recargamos la página de reportes
                 return redirect(url_for('main.report_page'))
 
-        excel_data, nombre_archivo = services.generate_report_service(g.db_key, request.form)
+        db_key = _db_keys_from(request.form.getlist('db_key'))
+
+        # Preflight: según el tamaño estimado, Excel, CSV en streaming, segundo plano o rechazo
+        estimacion = services.estimar_reporte_service(db_key, request.form)
+        if estimacion['entrega'] == 'rechazar':
+            flash(estimacion['mensaje'], 'danger')
+            return redirect(url_for('main.report_page'))
+        if estimacion['entrega'] == 'csv':
+            csv_stream, nombre_archivo = services.generate_report_csv_service(db_key, request.form)
+            response = Response(stream_with_context(csv_stream), mimetype='text/csv')
+            response.headers['Content-Disposition'] = f'attachment; filename={nombre_archivo}'
+            return response
+        if estimacion['entrega'] == 'trabajo':
+            from .report_jobs import DemasiadosTrabajos
+            try:
+                services.generate_report_job_service(db_key, request.form, current_user.get_id(), estimacion['filas'])
+            except DemasiadosTrabajos as e:
+                flash(str(e), 'warning')
+                return redirect(url_for('main.report_page'))
+            flash(f"El reporte es muy grande (≈{estimacion['megabytes']} MB): se está generando en segundo plano. "
+                  "Puede descargarlo más abajo cuando termine.", 'info')
+            return redirect(url_for('main.report_page'))
+
+        excel_data, nombre_archivo = services.generate_report_service(db_key, request.form)
         
         response = make_response(excel_data)
         response.headers['Content-Disposition'] = f'attachment; filename={nombre_archivo}'
         response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
         return response
 
+    except ConsultaCancelada:
+        # El usuario se fue o pidió otro reporte: no hay a quién mostrarle nada
+        return '', 204
+    except BaseDatosNoDisponible as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('main.report_page'))
     except Exception as e:
         print(f"ERROR DOWNLOAD: {e}")
         flash(f"Ocurrió un error al generar el reporte: {str(e)}", 'danger')
         return redirect(url_for('main.report_page'))
 
+@main_bp.route('/api/report-estimate', methods=['GET'])
+@login_required
+def estimate_report():
+    # Lo muestra el formulario de reportes antes de enviar (filas, MB y cómo se va a entregar)
+    if not all([request.args.get('ema_id'), request.args.get('fecha_inicio'), request.args.get('fecha_fin')]):
+        return jsonify({'error': 'Faltan parámetros'}), 400
+    db_key = _db_keys_from(request.args.getlist('db_key'))
+    try:
+        return jsonify(services.estimar_reporte_service(db_key, request.args))
+    except BaseDatosNoDisponible as e:
+        return jsonify({'error': str(e)}), 503
+
+@main_bp.route('/api/report-jobs', methods=['GET'])
+@login_required
+def list_report_jobs():
+    from . import report_jobs
+    trabajos = report_jobs.listar(current_user.get_id())
+    return jsonify([
+        dict(t, descarga=url_for('main.download_report_job', trabajo_id=t['id']) if t['estado'] == 'listo' else None)
+        for t in trabajos
+    ])
+
+@main_bp.route('/report-jobs/<trabajo_id>/descargar', methods=['GET'])
+@login_required
+def download_report_job(trabajo_id):
+    from . import report_jobs
+    trabajo = report_jobs.obtener(trabajo_id)
+    # Solo el dueño (o un administrador) puede bajarlo
+    if trabajo is None or (trabajo['usuario'] != current_user.get_id() and getattr(current_user, 'role', 'admin') != 'admin'):
+        abort(404)
+    if trabajo['estado'] != 'listo':
+        flash('El reporte todavía no está listo.', 'warning')
+        return redirect(url_for('main.report_page'))
+    return send_file(report_jobs.ruta_archivo(trabajo), mimetype='application/zip',
+                     as_attachment=True, download_name=trabajo['archivo'])
+
+# --- PAQUETE DE REPORTES (un Excel por estación, en un ZIP) ---
+@main_bp.route('/download-report-bundle', methods=['POST'])
+@login_required
+@cancelable('download-report-bundle')
+@endpoint_pesado(respuesta='flash')
+def download_report_bundle():
+    try:
+        f_inicio = datetime.strptime(request.form.get('fecha_inicio'), '%Y-%m-%d')
+        f_fin = datetime.strptime(request.form.get('fecha_fin'), '%Y-%m-%d')
+        if getattr(current_user, 'role', 'admin') == 'restricted' and (f_fin - f_inicio).days > 31:
+            flash('Error: Su usuario está limitado a descargar reportes de máximo 31 días.', 'danger')
+            return redirect(url_for('main.report_page'))
+
+        zip_stream, nombre_archivo = services.generate_report_bundle_service(g.db_key, request.form)
+        # Se envía a medida que cada estación termina (el cupo de admisión se libera al final)
+        response = Response(stream_with_context(zip_stream), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename={nombre_archivo}'
+        return response
+    except ConsultaCancelada:
+        return '', 204
+    except BaseDatosNoDisponible as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('main.report_page'))
+    except Exception as e:
+        print(f"ERROR BUNDLE: {e}")
+        flash(f"Ocurrió un error al generar el paquete de reportes: {str(e)}", 'danger')
+        return redirect(url_for('main.report_page'))
+
 @main_bp.route('/get-sensors/<ema_id>')
 @login_required 
 def get_sensors_for_ema(ema_id):
     try:
         sensores = services.get_sensors_for_ema_service(g.db_key, ema_id)
         return jsonify(sensores)
+    except BaseDatosNoDisponible as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @main_bp.route('/api/get-chart-data', methods=['GET'])
 @login_required
+@cancelable('chart')
+@endpoint_pesado(respuesta='json')
 def get_chart_data():
     try:
         ema_id = request.args.get('ema_id')
@@ -100,8 +228,91 @@ def get_chart_data():
             if delta.days > 31:
                 return jsonify({'error': 'Su usuario está limitado a visualizar máximo 31 días.'}), 403
         
-        charts_data = services.get_chart_data_service(g.db_key, ema_id, sensor_info_list, fecha_inicio, fecha_fin, combine_flag)
+        db_key = _db_keys_from(request.args.getlist('db_key'))
+        ema_ids = request.args.getlist('ema_id')
+
+        # Refresco incremental: 'since' (uno por sensor) = última etiqueta que tiene el cliente
+        since_list = request.args.getlist('since')
+        if since_list:
+            if isinstance(db_key, list) or len(ema_ids) > 1 or ema_id == 'todas' or combine_flag:
+                return jsonify({'error': "El refresco incremental es solo para gráficos separados de una EMA."}), 400
+            if len(since_list) != len(sensor_info_list):
+                return jsonify({'error': "Se necesita un 'since' por sensor."}), 400
+            return jsonify(services.get_chart_updates_service(db_key, ema_id, sensor_info_list, since_list, fecha_fin))
+
+        if len(ema_ids) > 1 and not isinstance(db_key, list):
+            # Comparación de varias EMAs (un dataset por EMA en el mismo gráfico)
+            if 'todas' in ema_ids: return jsonify({'error': "No se puede comparar 'todas' con otras EMAs."}), 400
+            ema_id = ema_ids
+        elif isinstance(db_key, list):
+            # Fan-out: 'ema_id@<db>' / 'sensor_info@<db>' permiten IDs distintos por BD
+            ema_id = {k: request.args.get(f'ema_id@{k}', ema_id) for k in db_key}
+            sensor_info_list = {k: request.args.getlist(f'sensor_info@{k}') or sensor_info_list for k in db_key}
+
+        charts_data = services.get_chart_data_service(db_key, ema_id, sensor_info_list, fecha_inicio, fecha_fin, combine_flag)
         return jsonify(charts_data)
+    except ConsultaCancelada as e:
+        return jsonify({'error': str(e)}), 409
+    except (EsperaAgotada, BaseDatosNoDisponible) as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@main_bp.route('/api/chart-tiles', methods=['GET'])
+@login_required
+@cancelable('chart-tiles')
+@endpoint_pesado(respuesta='json')
+def get_chart_tiles():
+    # Zoom/paneo: un tramo de la pirámide min/max para el rango visible (epoch en ms)
+    try:
+        ema_id = request.args.get('ema_id', type=int)
+        sensor_info = request.args.get('sensor_info')
+        desde_ms = request.args.get('desde', type=int)
+        hasta_ms = request.args.get('hasta', type=int)
+        ancho_px = request.args.get('ancho_px', 800, type=int)
+
+        if ema_id is None or not sensor_info or desde_ms is None or hasta_ms is None or hasta_ms <= desde_ms:
+            return jsonify({'error': 'Faltan parámetros'}), 400
+
+        if getattr(current_user, 'role', 'admin') == 'restricted' and (hasta_ms - desde_ms) > 31 * 86400 * 1000:
+            return jsonify({'error': 'Su usuario está limitado a visualizar máximo 31 días.'}), 403
+
+        db_key = request.args.get('db_key')
+        if db_key not in config.DATABASE_CONNECTIONS: db_key = g.db_key
+
+        tramo = services.get_chart_tile_service(db_key, ema_id, sensor_info, desde_ms, hasta_ms, min(ancho_px, 4000))
+        return jsonify(tramo)
+    except ConsultaCancelada as e:
+        return jsonify({'error': str(e)}), 409
+    except BaseDatosNoDisponible as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@main_bp.route('/api/rainfall-analytics', methods=['GET'])
+@login_required
+@cancelable('rainfall-analytics')
+@endpoint_pesado(respuesta='json')
+def get_rainfall_analytics():
+    # Evento de tormenta: acumulados móviles e intensidades máximas de todas las estaciones pedidas
+    try:
+        fecha_inicio = request.args.get('fecha_inicio')
+        fecha_fin = request.args.get('fecha_fin')
+        ema_ids = request.args.getlist('ema_id', type=int)
+        if not all([fecha_inicio, fecha_fin]): return jsonify({'error': 'Faltan parámetros'}), 400
+
+        f_inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d')
+        f_fin = datetime.strptime(fecha_fin, '%Y-%m-%d')
+        if getattr(current_user, 'role', 'admin') == 'restricted' and (f_fin - f_inicio).days > 31:
+            return jsonify({'error': 'Su usuario está limitado a visualizar máximo 31 días.'}), 403
+
+        estaciones = services.get_rainfall_analytics_service(g.db_key, ema_ids, fecha_inicio, fecha_fin)
+        from .rainfall import VENTANAS
+        return jsonify({'ventanas': list(VENTANAS), 'estaciones': estaciones})
+    except ConsultaCancelada as e:
+        return jsonify({'error': str(e)}), 409
+    except BaseDatosNoDisponible as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -111,9 +322,58 @@ def get_dashboard_data(ema_id):
     try:
         dashboard_data = services.get_dashboard_data_service(g.db_key, ema_id)
         return jsonify(dashboard_data)
+    except (EsperaAgotada, BaseDatosNoDisponible) as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@main_bp.route('/api/dashboard-stream/<int:ema_id>')
+@login_required
+def stream_dashboard_data(ema_id):
+    # Server-Sent Events: un poller por estación, compartido entre todos los que la miran
+    eventos = services.stream_dashboard_service(g.db_key, ema_id)
+    response = Response(stream_with_context(eventos), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@main_bp.route('/api/cancel-request', methods=['POST'])
+@login_required
+def cancel_request():
+    # Lo llama el navegador (sendBeacon) al cerrar la pestaña con una consulta en curso
+    token = request.values.get('request_token')
+    cancelada = cancelar_por_token(current_user.get_id(), token) if token else False
+    return jsonify({'cancelada': cancelada})
+
+@main_bp.route('/api/metrics')
+@login_required
+def get_metrics():
+    if getattr(current_user, 'role', 'admin') == 'restricted':
+        return jsonify({'error': 'No autorizado.'}), 403
+    return jsonify(services.get_metrics_service())
+
+@main_bp.route('/api/refresh-sensor-cache', methods=['POST'])
+@login_required
+def refresh_sensor_cache():
+    # Re-escanea los sensores de todas las BDs; los demás workers toman la versión nueva solos
+    if getattr(current_user, 'role', 'admin') == 'restricted':
+        return jsonify({'error': 'No autorizado.'}), 403
+    try:
+        version = services.refresh_global_cache_service()
+        return jsonify({'version': version})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@main_bp.route('/api/warmup', methods=['POST'])
+@login_required
+def run_warmup():
+    # Precalentar ya (p. ej. lo llama la carga de datos al terminar); 'job' elige un trabajo
+    if getattr(current_user, 'role', 'admin') == 'restricted':
+        return jsonify({'error': 'No autorizado.'}), 403
+    lanzados = services.warmup.ejecutar_ahora(request.values.get('job'))
+    if not lanzados: return jsonify({'error': 'No hay trabajos de precalentamiento con ese nombre.'}), 404
+    return jsonify({'lanzados': lanzados})
+
 @main_bp.route('/change-db/<string:db_key>')
 @login_required
 def change_db(db_key):
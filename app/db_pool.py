@@ -0,0 +1,195 @@
+# app/db_pool.py
+# Pool de conexiones por BD + registro de sentencias preparadas.
+#
+# Las consultas "calientes" (dashboard, popup del mapa, metadatos de sensores)
+# siempre tienen la misma forma. En vez de re-parsearlas y re-planificarlas en
+# cada llamada, se preparan UNA vez por conexión del pool:
+#   - PostgreSQL: PREPARE nombre AS ... / EXECUTE nombre (...)
+#   - SQL Server: un cursor por sentencia; pyodbc re-usa el statement preparado
+#     cuando se ejecuta el mismo SQL sobre el mismo cursor.
+#
+# Tope de conexiones: cada (BD, réplica) tiene un semáforo de DB_MAX_CONEXIONES préstamos
+# simultáneos por proceso. Como solo se abre una conexión nueva cuando no hay libres, el
+# semáforo acota también las conexiones abiertas, por más que se aniden los paralelismos
+# (fan-out por BD, tramos de tiempo, estaciones de 'todas'). Quien no consigue cupo en
+# DB_ESPERA_CONEXION_SECONDS recibe BaseDatosNoDisponible.
+
+import threading
+import time
+from contextlib import contextmanager
+from queue import LifoQueue, Empty, Full
+import config
+from . import circuit_breaker
+from .cancellation import ConsultaCancelada
+
+DB_POOL_SIZE = getattr(config, 'DB_POOL_SIZE', 5)
+DB_MAX_CONEXIONES = getattr(config, 'DB_MAX_CONEXIONES', 8)
+DB_ESPERA_CONEXION_SECONDS = getattr(config, 'DB_ESPERA_CONEXION_SECONDS', 30)
+
+_pools = {}
+_cupos = {}   # (db_key, replica) -> BoundedSemaphore de préstamos
+_pools_lock = threading.Lock()
+
+_stats = {}
+_esperas = {'agotadas': 0}
+_stats_lock = threading.Lock()
+
+
+class ConexionPooled:
+    """Una conexión del pool junto con lo que ya tiene preparado."""
+
+    def __init__(self, conn, driver):
+        self.conn = conn
+        self.driver = driver
+        self.preparadas = set()   # PostgreSQL: nombres ya preparados en esta sesión
+        self.cursores = {}        # SQL Server: cursor dedicado por sentencia
+
+    def cerrar(self):
+        try:
+            for cursor in self.cursores.values(): cursor.close()
+            self.conn.close()
+        except Exception:
+            pass
+
+
+def _get_pool(clave):
+    with _pools_lock:
+        if clave not in _pools:
+            _pools[clave] = LifoQueue(maxsize=DB_POOL_SIZE)
+            _cupos[clave] = threading.BoundedSemaphore(max(1, DB_MAX_CONEXIONES))
+        return _pools[clave], _cupos[clave]
+
+
+@contextmanager
+def conexion(db_key, factory, driver, replica=None):
+    """
+    Presta una conexión del pool de 'db_key' (la crea con 'factory' si no hay libres).
+    Cada réplica (app/db_routing.py) tiene su propio pool; replica=None es el primario.
+    Si el bloque falla, la conexión se descarta en vez de volver al pool.
+    Con el disyuntor de esa BD abierto (app/circuit_breaker.py) falla al instante.
+    Sin cupo libre (DB_MAX_CONEXIONES) espera hasta DB_ESPERA_CONEXION_SECONDS.
+    """
+    circuit_breaker.verificar(db_key, replica)
+    pool, cupo = _get_pool((db_key, replica))
+    if not cupo.acquire(timeout=DB_ESPERA_CONEXION_SECONDS):
+        with _stats_lock: _esperas['agotadas'] += 1
+        raise circuit_breaker.BaseDatosNoDisponible(
+            f"La base de datos {config.DATABASE_CONNECTIONS.get(db_key, {}).get('display_name', db_key)} "
+            "tiene todas sus conexiones ocupadas. Intente de nuevo en unos minutos."
+        )
+    try:
+        with _prestar(db_key, factory, driver, replica, pool) as pc:
+            yield pc
+    finally:
+        cupo.release()
+
+
+@contextmanager
+def _prestar(db_key, factory, driver, replica, pool):
+    pc = None
+    while pc is None:
+        try:
+            pc = pool.get_nowait()
+        except Empty:
+            break
+        # psycopg2 marca 'closed' cuando detectó que el servidor cortó la conexión
+        if getattr(pc.conn, 'closed', 0):
+            pc.cerrar(); pc = None
+
+    if pc is None:
+        conn = factory(db_key, replica)
+        if driver == 'psycopg2':
+            # Sin transacciones abiertas entre préstamos ("idle in transaction")
+            conn.autocommit = True
+        pc = ConexionPooled(conn, driver)
+
+    try:
+        yield pc
+    except ConsultaCancelada:
+        # La cancelación fue nuestra: la conexión sigue sana, se limpia y vuelve al pool
+        try:
+            pc.conn.rollback()
+            pool.put_nowait(pc)
+        except Exception:
+            pc.cerrar()
+        raise
+    except Exception as e:
+        pc.cerrar()
+        if circuit_breaker.anotar_error(db_key, replica, e):
+            # Se cayó el servidor: las demás conexiones del pool tampoco sirven
+            _vaciar(pool)
+        raise
+    else:
+        circuit_breaker.registrar_exito(db_key, replica)
+        try:
+            pool.put_nowait(pc)
+        except Full:
+            pc.cerrar()
+
+
+def _vaciar(pool):
+    while True:
+        try:
+            pool.get_nowait().cerrar()
+        except Empty:
+            return
+
+
+def _registrar_stat(nombre, segundos, preparo=False, error=False):
+    with _stats_lock:
+        st = _stats.setdefault(nombre, {'ejecuciones': 0, 'preparaciones': 0, 'errores': 0, 'tiempo_total_ms': 0.0, 'tiempo_max_ms': 0.0})
+        st['ejecuciones'] += 1
+        st['preparaciones'] += int(preparo)
+        st['errores'] += int(error)
+        ms = segundos * 1000
+        st['tiempo_total_ms'] += ms
+        st['tiempo_max_ms'] = max(st['tiempo_max_ms'], ms)
+
+
+def ejecutar_preparada(pc, nombre, sql, params=()):
+    """
+    Ejecuta la sentencia 'nombre' (preparándola si es la primera vez en esta conexión)
+    y devuelve el cursor listo para fetchone()/fetchall().
+    En PostgreSQL 'sql' usa $1, $2...; en SQL Server usa '?'.
+    """
+    inicio = time.perf_counter()
+    preparo = False
+    try:
+        if pc.driver == 'psycopg2':
+            cursor = pc.conn.cursor()
+            if nombre not in pc.preparadas:
+                cursor.execute(f"PREPARE {nombre} AS {sql}")
+                pc.preparadas.add(nombre)
+                preparo = True
+            if params:
+                cursor.execute(f"EXECUTE {nombre} ({', '.join(['%s'] * len(params))})", tuple(params))
+            else:
+                cursor.execute(f"EXECUTE {nombre}")
+        else:
+            cursor = pc.cursores.get(nombre)
+            if cursor is None:
+                cursor = pc.cursores[nombre] = pc.conn.cursor()
+                preparo = True
+            cursor.execute(sql, tuple(params))
+    except Exception:
+        _registrar_stat(nombre, time.perf_counter() - inicio, preparo, error=True)
+        raise
+    _registrar_stat(nombre, time.perf_counter() - inicio, preparo)
+    return cursor
+
+
+def get_statement_stats():
+    """Estadísticas por sentencia preparada (para /api/metrics)."""
+    with _stats_lock:
+        stats = {}
+        for nombre, st in _stats.items():
+            stats[nombre] = dict(st, tiempo_promedio_ms=round(st['tiempo_total_ms'] / st['ejecuciones'], 3) if st['ejecuciones'] else 0.0)
+        return stats
+
+
+def get_stats():
+    """Tope de conexiones y conexiones libres por pool (para /api/metrics)."""
+    with _pools_lock:
+        libres = {f"{db_key}" if replica is None else f"{db_key}#{replica}": pool.qsize() for (db_key, replica), pool in _pools.items()}
+    with _stats_lock:
+        return {'max_por_bd': DB_MAX_CONEXIONES, 'esperas_agotadas': _esperas['agotadas'], 'libres': libres}
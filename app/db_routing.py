@@ -0,0 +1,96 @@
+# app/db_routing.py
+# Ruteo de consultas entre el primario y las réplicas de lectura de cada BD.
+#
+# En config.DATABASE_CONNECTIONS cada BD puede declarar réplicas opcionales:
+#   'replicas': [{'host': 'replica1', 'port': 5432}, ...]   (el resto se hereda del primario)
+#   'replica_max_lag_seconds': 60
+#
+# Política:
+#   - 'latencia' (último valor, dashboard, popup): SIEMPRE al primario.
+#   - 'reporte': a una réplica solo si el rango es largo (REPLICA_LONG_RANGE_DAYS o más).
+#   - 'cache' y 'archivo' (armado de cachés, sincronizaciones): a una réplica.
+# Una réplica atrasada más que el umbral (o que no responde) se saltea y se usa el primario.
+
+import itertools
+import threading
+import time
+import config
+
+REPLICA_MAX_LAG_SECONDS = getattr(config, 'REPLICA_MAX_LAG_SECONDS', 60)
+REPLICA_LAG_CHECK_SECONDS = getattr(config, 'REPLICA_LAG_CHECK_SECONDS', 30)
+REPLICA_LONG_RANGE_DAYS = getattr(config, 'REPLICA_LONG_RANGE_DAYS', 7)
+
+CARGAS_EN_REPLICA = {'reporte', 'cache', 'archivo'}
+
+_lags = {}            # (db_key, replica) -> (lag_en_segundos o None, momento de la medición)
+_lags_lock = threading.Lock()
+_turnos = {}          # db_key -> itertools.count (round-robin entre réplicas sanas)
+_decisiones = {}      # (db_key, destino) -> cantidad
+
+
+def replicas_de(db_key):
+    return config.DATABASE_CONNECTIONS.get(db_key, {}).get('replicas') or []
+
+
+def config_endpoint(db_key, replica=None):
+    """Config de conexión del primario (replica=None) o de la réplica indicada."""
+    db_config = config.DATABASE_CONNECTIONS.get(db_key)
+    if not db_config: return None
+    endpoint = {k: v for k, v in db_config.items() if k != 'replicas'}
+    if replica is not None:
+        endpoint.update(replicas_de(db_key)[replica])
+    return endpoint
+
+
+def _lag(db_key, replica, medir_lag):
+    ahora = time.monotonic()
+    with _lags_lock:
+        cacheado = _lags.get((db_key, replica))
+        if cacheado and ahora - cacheado[1] < REPLICA_LAG_CHECK_SECONDS:
+            return cacheado[0]
+    try:
+        lag = medir_lag(db_key, replica)
+    except Exception as e:
+        print(f"⚠️ Réplica {replica} de {db_key} no responde: {e}")
+        lag = None
+    with _lags_lock:
+        _lags[(db_key, replica)] = (lag, ahora)
+    return lag
+
+
+def _contar(db_key, destino):
+    with _lags_lock:
+        _decisiones[(db_key, destino)] = _decisiones.get((db_key, destino), 0) + 1
+
+
+def elegir_replica(db_key, carga, medir_lag, dias=None):
+    """
+    Devuelve el índice de la réplica a usar, o None para el primario.
+    'medir_lag(db_key, replica)' es la función del repositorio que mide el atraso en segundos.
+    """
+    replicas = replicas_de(db_key)
+    if not replicas or carga not in CARGAS_EN_REPLICA or (carga == 'reporte' and (dias or 0) < REPLICA_LONG_RANGE_DAYS):
+        _contar(db_key, 'primario')
+        return None
+
+    max_lag = config.DATABASE_CONNECTIONS[db_key].get('replica_max_lag_seconds', REPLICA_MAX_LAG_SECONDS)
+    turno = next(_turnos.setdefault(db_key, itertools.count()))
+    for i in range(len(replicas)):
+        replica = (turno + i) % len(replicas)
+        lag = _lag(db_key, replica, medir_lag)
+        if lag is not None and lag <= max_lag:
+            _contar(db_key, f'replica{replica}')
+            return replica
+
+    # Todas atrasadas o caídas: vamos al primario
+    _contar(db_key, 'primario')
+    return None
+
+
+def get_stats():
+    """Atraso medido por réplica y decisiones de ruteo (para /api/metrics)."""
+    with _lags_lock:
+        return {
+            'lag_segundos': {f"{db_key}/replica{r}": lag for (db_key, r), (lag, _) in _lags.items()},
+            'decisiones': {f"{db_key}/{destino}": n for (db_key, destino), n in _decisiones.items()},
+        }
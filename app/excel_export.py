@@ -0,0 +1,24 @@
+# app/excel_export.py
+# Armado del Excel de reportes (común a todas las BDs).
+# Vive aparte de los repositorios para que exportar no obligue a cargar psycopg2/pyodbc,
+# y pandas/openpyxl se importan recién al generar el primer archivo.
+
+import io
+from .resampling import a_float64
+
+
+def create_excel_from_dataframe(df, errores=None):
+    import pandas as pd
+    output = io.BytesIO()
+    df_to_export = df.copy()
+    if 'ema_id' in df_to_export.columns: df_to_export = df_to_export.drop(columns=['ema_id'])
+    # Los reportes angostos traen 'valor' en float32: al Excel va el número tal como se ve
+    for col in df_to_export.columns[df_to_export.dtypes == 'float32']:
+        df_to_export[col] = a_float64(df_to_export[col])
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df_to_export.to_excel(writer, index=False, sheet_name='Datos')
+        # Fan-out: las BDs que fallaron quedan registradas en una hoja aparte
+        if errores:
+            df_errores = pd.DataFrame([{'base_datos': k, 'error': v} for k, v in errores.items()])
+            df_errores.to_excel(writer, index=False, sheet_name='Errores')
+    return output
@@ -0,0 +1,98 @@
+# app/live_stream.py
+# Pollers compartidos para el dashboard en vivo (Server-Sent Events).
+#
+# Un solo hilo por (db_key, ema_id) consulta la BD, sin importar cuántas
+# pestañas estén mirando esa estación. El hilo compara una "marca de agua"
+# (la última medición) y solo cuando avanza trae los datos del dashboard y
+# los reparte a todos los suscriptores. El formateo (y el filtro de batería
+# por rol) lo hace cada suscriptor en services.py.
+
+import threading
+import time
+from queue import Queue, Full, Empty
+import config
+
+LIVE_POLL_SECONDS = getattr(config, 'LIVE_POLL_SECONDS', 30)
+# Cola por suscriptor: si un cliente lento se atrasa, solo importa el último dato
+LIVE_QUEUE_SIZE = 5
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+class EstacionPoller(threading.Thread):
+    """Hilo que vigila una estación y reparte sus datos crudos a los suscriptores."""
+
+    def __init__(self, clave, fetch_marca_agua, fetch_datos):
+        super().__init__(name=f"poller-{clave[0]}-{clave[1]}", daemon=True)
+        self.clave = clave
+        self.fetch_marca_agua = fetch_marca_agua
+        self.fetch_datos = fetch_datos
+        self.suscriptores = set()
+        self.marca_agua = None
+        self.ultimo_dato = None
+        self.lock = threading.Lock()
+
+    def _publicar(self, datos):
+        with self.lock:
+            self.ultimo_dato = datos
+            colas = list(self.suscriptores)
+        for cola in colas:
+            try:
+                cola.put_nowait(datos)
+            except Full:
+                try: cola.get_nowait()
+                except Empty: pass
+                cola.put_nowait(datos)
+
+    def run(self):
+        db_key, ema_id = self.clave
+        while True:
+            with _pollers_lock:
+                if not self.suscriptores:
+                    # Nadie mira esta estación: el hilo termina
+                    _pollers.pop(self.clave, None)
+                    return
+            try:
+                marca = self.fetch_marca_agua(db_key, ema_id)
+                if self.ultimo_dato is None or marca != self.marca_agua:
+                    self.marca_agua = marca
+                    self._publicar(self.fetch_datos(db_key, ema_id))
+            except Exception as e:
+                print(f"⚠️ Poller {db_key}/{ema_id}: {e}")
+            time.sleep(LIVE_POLL_SECONDS)
+
+
+def suscribir(db_key, ema_id, fetch_marca_agua, fetch_datos):
+    """
+    Registra un suscriptor para (db_key, ema_id) y devuelve su cola.
+    Si ya hay datos publicados, el suscriptor los recibe de inmediato.
+    """
+    clave = (db_key, ema_id)
+    cola = Queue(maxsize=LIVE_QUEUE_SIZE)
+    with _pollers_lock:
+        poller = _pollers.get(clave)
+        nuevo = poller is None
+        if nuevo:
+            poller = _pollers[clave] = EstacionPoller(clave, fetch_marca_agua, fetch_datos)
+        with poller.lock:
+            poller.suscriptores.add(cola)
+            if poller.ultimo_dato is not None:
+                cola.put_nowait(poller.ultimo_dato)
+    if nuevo:
+        poller.start()
+    return cola
+
+
+def desuscribir(db_key, ema_id, cola):
+    with _pollers_lock:
+        poller = _pollers.get((db_key, ema_id))
+        if poller:
+            with poller.lock:
+                poller.suscriptores.discard(cola)
+
+
+def get_stream_stats():
+    """Estaciones vigiladas y suscriptores por estación (para /api/metrics)."""
+    with _pollers_lock:
+        return {f"{db_key}/{ema_id}": len(p.suscriptores) for (db_key, ema_id), p in _pollers.items()}
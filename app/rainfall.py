@@ -0,0 +1,119 @@
+# app/rainfall.py
+# Analítica de lluvia: acumulados en ventanas móviles (1h/3h/6h/24h/72h) e intensidades máximas.
+#
+# Todo vectorizado con NumPy:
+#   - la serie se pasa a incrementos (mm caídos entre una medición y la anterior),
+#   - una sola suma acumulada (cumsum) y un searchsorted por ventana dan el total
+#     de la ventana (t - w, t] que termina en cada medición.
+# Varias estaciones se calculan en UNA pasada: van concatenadas y ordenadas por
+# (grupo, tiempo) con una clave que separa los grupos más que la ventana más larga.
+#
+# Regla Areco (ver calcular_lluvia_acumulada): el pluviómetro es un contador acumulado.
+# El incremento es la diferencia con la medición anterior; si el contador baja, se reinició
+# y el incremento es el valor leído.
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import config
+
+VENTANAS = {'1h': 3600, '3h': 3 * 3600, '6h': 6 * 3600, '24h': 24 * 3600, '72h': 72 * 3600}
+# Margen a traer antes del inicio para que las primeras ventanas estén completas
+MARGEN_SEGUNDOS = max(VENTANAS.values())
+
+LLUVIA_CACHE_MAX_ENTRADAS = getattr(config, 'LLUVIA_CACHE_MAX_ENTRADAS', 64)
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {'aciertos': 0, 'calculos': 0}
+
+
+def incrementos(grupos, valores, contador_acumulado):
+    """
+    mm caídos en cada medición. 'contador_acumulado' es un bool por grupo
+    (pluviómetro tipo Areco); la primera medición de un contador no aporta.
+    """
+    es_contador = np.asarray(contador_acumulado, dtype=bool)[grupos]
+    inc = valores.copy()
+    if es_contador.any():
+        diferencia = np.diff(valores, prepend=np.nan)
+        inc = np.where(es_contador, np.where(diferencia < 0, valores, diferencia), valores)
+        nuevo_grupo = np.r_[True, grupos[1:] != grupos[:-1]]
+        inc[nuevo_grupo & es_contador] = 0.0
+    return inc
+
+
+def totales_moviles(grupos, timestamps, inc, ventanas=VENTANAS):
+    """
+    {ventana: total de la ventana (t - w, t] que termina en cada medición}.
+    'grupos' y 'timestamps' vienen ordenados por (grupo, tiempo).
+    """
+    if len(timestamps) == 0:
+        return {nombre: np.array([], dtype='float64') for nombre in ventanas}
+    segundos = timestamps.astype('datetime64[s]').astype('int64')
+    base = segundos - segundos.min()
+    # Clave compuesta: ninguna ventana cruza de un grupo al anterior
+    separacion = int(base.max()) + max(ventanas.values()) + 1
+    clave = grupos.astype('int64') * separacion + base
+    acumulado = np.r_[0.0, np.cumsum(inc)]
+    resultados = {}
+    for nombre, w in ventanas.items():
+        inicio = np.searchsorted(clave, clave - w, side='right')
+        resultados[nombre] = acumulado[1:] - acumulado[inicio]
+    return resultados
+
+
+def analizar_lote(grupos, timestamps, valores, contador_acumulado, desde, ventanas=VENTANAS):
+    """
+    Resumen por grupo (estación/sensor) en una sola pasada:
+    total del período y, por ventana, el máximo acumulado, cuándo terminó y su intensidad (mm/h).
+    Solo cuentan las mediciones desde 'desde' (las anteriores son margen para las ventanas).
+    """
+    n_grupos = len(contador_acumulado)
+    inc = incrementos(grupos, valores, contador_acumulado)
+    totales = totales_moviles(grupos, timestamps, inc, ventanas)
+
+    en_periodo = timestamps >= desde
+    grupos_p = grupos[en_periodo]
+    resumen = [{'total': 0.0, 'ventanas': {}} for _ in range(n_grupos)]
+    for g, total in enumerate(np.bincount(grupos_p, weights=inc[en_periodo], minlength=n_grupos)):
+        resumen[g]['total'] = round(float(total), 2)
+    if len(grupos_p) == 0:
+        return resumen
+
+    tiempos_p = timestamps[en_periodo]
+    for nombre, w in ventanas.items():
+        total_p = totales[nombre][en_periodo]
+        # Máximo por grupo: orden por (grupo, total) y el último de cada grupo
+        orden = np.lexsort((total_p, grupos_p))
+        ultimos = orden[np.r_[grupos_p[orden][1:] != grupos_p[orden][:-1], True]]
+        for i in ultimos:
+            maximo = float(total_p[i])
+            resumen[grupos_p[i]]['ventanas'][nombre] = {
+                'max': round(maximo, 2),
+                'fin': str(tiempos_p[i].astype('datetime64[s]')).replace('T', ' '),
+                'intensidad_max': round(maximo * 3600 / w, 2),
+            }
+    return resumen
+
+
+def obtener_cacheado(clave, calcular, cacheable):
+    """Resultados de períodos cerrados (que ya no reciben datos) se guardan en un LRU."""
+    if cacheable:
+        with _cache_lock:
+            if clave in _cache:
+                _cache.move_to_end(clave)
+                _stats['aciertos'] += 1
+                return _cache[clave]
+    resultado = calcular()
+    with _cache_lock:
+        _stats['calculos'] += 1
+        if cacheable:
+            _cache[clave] = resultado
+            if len(_cache) > LLUVIA_CACHE_MAX_ENTRADAS: _cache.popitem(last=False)
+    return resultado
+
+
+def get_stats():
+    with _cache_lock:
+        return dict(_stats, entradas=len(_cache))
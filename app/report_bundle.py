@@ -0,0 +1,158 @@
+# app/report_bundle.py
+# Paquete de reportes: un Excel por estación, todos dentro de un único ZIP.
+#
+# - Cada workbook se genera en un pool de PROCESOS (consulta + armado del Excel es CPU
+#   y GIL en buena parte: con hilos no escalaba). Los procesos se arrancan con 'spawn':
+#   hacer fork de un worker con hilos (pool de conexiones, pollers SSE) no es seguro.
+# - El ZIP se escribe en streaming a medida que terminan las estaciones (en el orden en
+#   que terminan). Hay como mucho BUNDLE_EN_VUELO workbooks pedidos o esperando a ser
+#   escritos: la memoria no crece con la cantidad de estaciones.
+# - Al final va 'manifiesto.csv' con el resultado de cada estación (ok / sin datos / error):
+#   una estación que falla no tira abajo el paquete.
+
+import csv
+import io
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import config
+from . import cancellation
+
+BUNDLE_MAX_PROCESOS = getattr(config, 'BUNDLE_MAX_PROCESOS', min(4, os.cpu_count() or 1))
+BUNDLE_EN_VUELO = getattr(config, 'BUNDLE_EN_VUELO', BUNDLE_MAX_PROCESOS * 2)
+
+_pool = None
+_pool_lock = threading.Lock()
+_stats = {'paquetes': 0, 'estaciones_ok': 0, 'estaciones_sin_datos': 0, 'estaciones_error': 0, 'cortados': 0}
+_stats_lock = threading.Lock()
+
+
+def _inicializar_proceso(repositorios):
+    # El proceso hijo arranca de cero: mismos drivers registrados que el padre
+    from . import services
+    services.REPOSITORIES_MAP.update(repositorios)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from . import services
+            _pool = ProcessPoolExecutor(
+                max_workers=BUNDLE_MAX_PROCESOS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_inicializar_proceso,
+                initargs=(dict(services.REPOSITORIES_MAP),),
+            )
+        return _pool
+
+
+def generar_workbook(db_key, ema_id, fecha_inicio, fecha_fin, sensor_info_list, process_type_list):
+    """(Corre en el proceso hijo) -> (filas, bytes del .xlsx) o (0, None) si no hay datos."""
+    from . import services, excel_export
+    df = services.fetch_report_df(db_key, ema_id, fecha_inicio, fecha_fin, sensor_info_list, process_type_list)
+    if df.empty: return 0, None
+    df = services.agregar_municipio(df, db_key)
+    return len(df), excel_export.create_excel_from_dataframe(df).getvalue()
+
+
+def nombre_archivo(ema_id, nombre_ema, fecha_inicio, fecha_fin):
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', str(nombre_ema or '')).strip('_')[:40]
+    return f"EMA_{int(ema_id):03d}{'_' + slug if slug else ''}_{fecha_inicio}_al_{fecha_fin}.xlsx"
+
+
+class _Salida(io.RawIOBase):
+    """Destino no 'seekable' del ZIP: junta lo escrito hasta que el generador lo entrega."""
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def vaciar(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+def _anotar(clave):
+    with _stats_lock: _stats[clave] += 1
+
+
+def generar_zip(db_key, estaciones, fecha_inicio, fecha_fin):
+    """
+    Generador con los bytes del ZIP. 'estaciones' es una lista de
+    (ema_id, nombre_ema, sensor_info_list, process_type_list).
+    """
+    _anotar('paquetes')
+    salida = _Salida()
+    manifiesto = []
+    pendientes = {}   # future -> (ema_id, nombre_ema)
+    cola = list(estaciones)
+    terminado = False
+    try:
+        with zipfile.ZipFile(salida, 'w') as zf:
+            pool = _get_pool()
+            while cola or pendientes:
+                # Reemplazado por otro pedido o el navegador se fue: no se lanzan más estaciones
+                cancellation.verificar()
+                while cola and len(pendientes) < BUNDLE_EN_VUELO:
+                    ema_id, nombre_ema, sensores, procesos = cola.pop(0)
+                    if not sensores:
+                        manifiesto.append((ema_id, nombre_ema, 'sin datos', 0, '', 'La estación no tiene sensores para los procesamientos pedidos.'))
+                        _anotar('estaciones_sin_datos')
+                        continue
+                    futuro = pool.submit(generar_workbook, db_key, ema_id, fecha_inicio, fecha_fin, sensores, procesos)
+                    pendientes[futuro] = (ema_id, nombre_ema)
+                if not pendientes: continue
+
+                listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    ema_id, nombre_ema = pendientes.pop(futuro)
+                    try:
+                        filas, contenido = futuro.result()
+                    except Exception as e:
+                        manifiesto.append((ema_id, nombre_ema, 'error', 0, '', str(e) or type(e).__name__))
+                        _anotar('estaciones_error')
+                        continue
+                    if contenido is None:
+                        manifiesto.append((ema_id, nombre_ema, 'sin datos', 0, '', ''))
+                        _anotar('estaciones_sin_datos')
+                        continue
+                    archivo = nombre_archivo(ema_id, nombre_ema, fecha_inicio, fecha_fin)
+                    # El .xlsx ya viene comprimido: se guarda tal cual
+                    zf.writestr(archivo, contenido, compress_type=zipfile.ZIP_STORED)
+                    manifiesto.append((ema_id, nombre_ema, 'ok', filas, archivo, ''))
+                    _anotar('estaciones_ok')
+                yield salida.vaciar()
+
+            texto = io.StringIO()
+            escritor = csv.writer(texto)
+            escritor.writerow(['ema_id', 'nombre_ema', 'estado', 'filas', 'archivo', 'error'])
+            escritor.writerows(sorted(manifiesto, key=lambda fila: int(fila[0])))
+            zf.writestr('manifiesto.csv', texto.getvalue().encode('utf-8-sig'), compress_type=zipfile.ZIP_DEFLATED)
+        terminado = True
+        yield salida.vaciar()
+    finally:
+        # El cliente cortó (o falló algo): lo que no empezó no se genera
+        for futuro in pendientes:
+            futuro.cancel()
+        if not terminado: _anotar('cortados')
+
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats, procesos=BUNDLE_MAX_PROCESOS)
@@ -0,0 +1,183 @@
+# app/report_jobs.py
+# Reportes en segundo plano: los que el preflight (services.estimar_reporte) considera
+# demasiado grandes para generarse mientras el usuario espera.
+#
+# - El reporte se escribe como CSV dentro de un ZIP en REPORT_JOBS_DIR, a medida que se
+#   genera (la memoria no crece con el tamaño del reporte).
+# - El estado de cada trabajo va en un .json al lado del archivo, reemplazado de forma
+#   atómica (os.replace): con varios workers de gunicorn, cualquiera puede informar el
+#   avance o entregar la descarga, no solo el que lo está generando.
+# - El avance llega por time_chunks.reportar_progreso (ETIQUETA_PARTES).
+# - Los trabajos vencen a las REPORT_JOBS_TTL_HORAS (se borran archivo y estado).
+# - Por defecto REPORT_JOBS_DIR es instance/reportes (directorio propio, 0700, como el
+#   snapshot de app/shared_cache.py) y los archivos se crean 0600: son datos de usuarios.
+
+import json
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import config
+from . import shared_cache, time_chunks
+
+REPORT_JOBS_DIR = getattr(config, 'REPORT_JOBS_DIR', os.path.join(shared_cache.DIRECTORIO_PROPIO, 'reportes'))
+REPORT_JOBS_MAX_WORKERS = getattr(config, 'REPORT_JOBS_MAX_WORKERS', 1)
+REPORT_JOBS_MAX_POR_USUARIO = getattr(config, 'REPORT_JOBS_MAX_POR_USUARIO', 2)
+REPORT_JOBS_TTL_HORAS = getattr(config, 'REPORT_JOBS_TTL_HORAS', 24)
+
+# Etiqueta con la que el generador avisa cada parte terminada (el resto de los avisos se ignora)
+ETIQUETA_PARTES = 'reporte'
+# El estado en disco se reescribe como mucho cada tantos segundos
+_INTERVALO_GUARDADO = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+_stats = {'encolados': 0, 'terminados': 0, 'errores': 0, 'rechazados': 0}
+_stats_lock = threading.Lock()
+
+
+class DemasiadosTrabajos(Exception):
+    pass
+
+
+def _ruta(trabajo_id, extension):
+    return os.path.join(REPORT_JOBS_DIR, f"{trabajo_id}.{extension}")
+
+
+def _abrir_privado(ruta, modo, **kwargs):
+    """Archivo nuevo (o truncado) solo para este usuario: 0600, sin importar el umask."""
+    return os.fdopen(os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), modo, **kwargs)
+
+
+def _guardar(estado):
+    temporal = _ruta(estado['id'], 'json.tmp')
+    with _abrir_privado(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump(estado, archivo)
+    os.replace(temporal, _ruta(estado['id'], 'json'))
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+
+
+def _leer(trabajo_id):
+    try:
+        with open(_ruta(trabajo_id, 'json'), encoding='utf-8') as archivo:
+            estado = json.load(archivo)
+    except (OSError, ValueError):
+        return None
+    # Se reinició el worker que lo generaba: no va a terminar nunca
+    if estado['estado'] in ('en_cola', 'corriendo') and not _proceso_vivo(estado['pid']):
+        estado.update(estado='error', error='El servidor se reinició mientras se generaba el reporte.')
+    return estado
+
+
+def _purgar():
+    """Borra los trabajos vencidos (archivo y estado)."""
+    if not os.path.isdir(REPORT_JOBS_DIR): return
+    limite = time.time() - REPORT_JOBS_TTL_HORAS * 3600
+    for nombre in os.listdir(REPORT_JOBS_DIR):
+        ruta = os.path.join(REPORT_JOBS_DIR, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite: os.remove(ruta)
+        except OSError:
+            pass
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, REPORT_JOBS_MAX_WORKERS), thread_name_prefix='reporte-fondo')
+        return _pool
+
+
+def listar(usuario=None):
+    """Trabajos (todos o de un usuario), el más nuevo primero."""
+    _purgar()
+    if not os.path.isdir(REPORT_JOBS_DIR): return []
+    trabajos = [_leer(n[:-5]) for n in os.listdir(REPORT_JOBS_DIR) if n.endswith('.json')]
+    return sorted(
+        (t for t in trabajos if t is not None and usuario in (None, t['usuario'])),
+        key=lambda t: t['creado'], reverse=True
+    )
+
+
+def obtener(trabajo_id):
+    if not trabajo_id or not all(c in '0123456789abcdef' for c in trabajo_id): return None
+    return _leer(trabajo_id)
+
+
+def ruta_archivo(estado):
+    return _ruta(estado['id'], 'zip')
+
+
+def encolar(usuario, descripcion, nombre_csv, generar, filas_estimadas=None):
+    """
+    Lanza generar() (iterable de bytes del CSV) en segundo plano. Devuelve el estado inicial.
+    Lanza DemasiadosTrabajos si el usuario ya tiene REPORT_JOBS_MAX_POR_USUARIO pendientes.
+    """
+    shared_cache.preparar_directorio_privado(REPORT_JOBS_DIR)
+    pendientes = [t for t in listar(usuario) if t['estado'] in ('en_cola', 'corriendo')]
+    if len(pendientes) >= REPORT_JOBS_MAX_POR_USUARIO:
+        with _stats_lock: _stats['rechazados'] += 1
+        raise DemasiadosTrabajos(
+            f"Ya tiene {len(pendientes)} reportes generándose en segundo plano. Espere a que terminen."
+        )
+    estado = {
+        'id': uuid.uuid4().hex, 'usuario': usuario, 'descripcion': descripcion,
+        'archivo': nombre_csv[:-4] + '.zip', 'estado': 'en_cola', 'progreso': 0.0,
+        'filas_estimadas': filas_estimadas, 'bytes': 0, 'error': None, 'pid': os.getpid(),
+        'creado': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'terminado': None,
+    }
+    _guardar(estado)
+    with _stats_lock: _stats['encolados'] += 1
+    _get_pool().submit(_correr, dict(estado), nombre_csv, generar)
+    return estado
+
+
+def _correr(estado, nombre_csv, generar):
+    ultimo_guardado = [0.0]
+
+    def avance(hechos, total, etiqueta):
+        if etiqueta != ETIQUETA_PARTES: return
+        estado['progreso'] = round(hechos / max(1, total), 3)
+        if time.monotonic() - ultimo_guardado[0] >= _INTERVALO_GUARDADO:
+            ultimo_guardado[0] = time.monotonic()
+            _guardar(estado)
+
+    estado['estado'] = 'corriendo'
+    _guardar(estado)
+    try:
+        with time_chunks.reportar_progreso(avance):
+            with _abrir_privado(ruta_archivo(estado), 'wb') as archivo, \
+                    zipfile.ZipFile(archivo, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                with zf.open(nombre_csv, 'w', force_zip64=True) as destino:
+                    for datos in generar():
+                        destino.write(datos)
+        estado.update(estado='listo', progreso=1.0, bytes=os.path.getsize(ruta_archivo(estado)))
+        with _stats_lock: _stats['terminados'] += 1
+    except Exception as e:
+        print(f"⚠️ Reporte en segundo plano {estado['id']}: {e}")
+        estado.update(estado='error', error=str(e) or type(e).__name__)
+        with _stats_lock: _stats['errores'] += 1
+        try:
+            os.remove(ruta_archivo(estado))
+        except OSError:
+            pass
+    estado['terminado'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    _guardar(estado)
+
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats, directorio=REPORT_JOBS_DIR)
@@ -2,10 +2,21 @@
 # (Corregido para evitar error de esquema 'master' y blindar la lista de sensores)
 
 import psycopg2
-import pandas as pd
 import io
+import heapq
+import json
+import threading
+import time
+import numpy as np
 import config 
 from datetime import datetime, timedelta
+from . import db_pool
+from . import cancellation
+from . import circuit_breaker
+from . import db_routing
+from . import time_chunks
+from .sensor_index import IndiceSensores
+from .excel_export import create_excel_from_dataframe  # (antes vivía acá)
 
 # --- Mapeo de traducciones ---
 PROCESS_TYPE_TRANSLATION = {
@@ -17,39 +28,216 @@ PROCESS_TYPE_TRANSLATION = {
     'max_hourly': 'Maximo por Hora'
 }
 
+# Timeout por consulta (ms) si la BD no define 'statement_timeout_ms' en config.DATABASE_CONNECTIONS
+DEFAULT_STATEMENT_TIMEOUT_MS = getattr(config, 'DEFAULT_STATEMENT_TIMEOUT_MS', 120000)
+
+# Hilos para el camino 'todas' (una consulta por estación)
+TODAS_MAX_WORKERS = getattr(config, 'TODAS_MAX_WORKERS', 4)
+
 # ==============================================================================
 # === CONEXIÓN A LA BD =========================================================
 # ==============================================================================
-def get_db_connection(db_key):
-    db_config = config.DATABASE_CONNECTIONS.get(db_key)
+def get_db_connection(db_key, replica=None):
+    db_config = db_routing.config_endpoint(db_key, replica)
     if not db_config or db_config['driver'] != 'psycopg2':
         raise ValueError(f"Configuración no válida para PG: {db_key}")
-    return psycopg2.connect(
+    # Tope por consulta: una consulta desbocada no puede acaparar la BD
+    timeout_ms = db_config.get('statement_timeout_ms', DEFAULT_STATEMENT_TIMEOUT_MS)
+    options = f"-c statement_timeout={int(timeout_ms)}" if timeout_ms else None
+    # Timeout de conexión corto y disyuntor por BD: un servidor caído falla rápido
+    return circuit_breaker.conectar(db_key, replica, lambda: psycopg2.connect(
         host=db_config['host'], port=db_config['port'], dbname=db_config['name'],
-        user=db_config['user'], password=db_config['pass']
-    )
+        user=db_config['user'], password=db_config['pass'], options=options,
+        connect_timeout=circuit_breaker.connect_timeout(db_config)
+    ))
+
+# --- Sentencias de forma fija: se preparan una vez por conexión del pool (app/db_pool.py) ---
+SQL_PREPARADAS = {
+    'pg_ultima_temperatura': "SELECT valor, tiempo_de_medicion FROM master.medicion_temperatura_atmosferica WHERE id_ema = $1 ORDER BY tiempo_de_medicion DESC LIMIT 1",
+    'pg_nivel_max_hoy': "SELECT MAX(valor) FROM master.medicion_limnigrafica WHERE id_ema = $1 AND tiempo_de_medicion >= CURRENT_DATE",
+    'pg_pluvio_sum_hoy': "SELECT SUM(valor) FROM master.medicion_pluviometrica WHERE id_ema = $1 AND tiempo_de_medicion >= CURRENT_DATE",
+    'pg_ultimo_viento_vel': "SELECT valor, tiempo_de_medicion FROM master.medicion_anemometrica WHERE id_ema = $1 ORDER BY tiempo_de_medicion DESC LIMIT 1",
+    'pg_ultimo_viento_dir': "SELECT valor, tiempo_de_medicion FROM master.medicion_direccion_viento WHERE id_ema = $1 ORDER BY tiempo_de_medicion DESC LIMIT 1",
+    'pg_marca_agua_dashboard': (
+        "SELECT GREATEST("
+        "(SELECT MAX(tiempo_de_medicion) FROM master.medicion_temperatura_atmosferica WHERE id_ema = $1), "
+        "(SELECT MAX(tiempo_de_medicion) FROM master.medicion_limnigrafica WHERE id_ema = $1), "
+        "(SELECT MAX(tiempo_de_medicion) FROM master.medicion_pluviometrica WHERE id_ema = $1), "
+        "(SELECT MAX(tiempo_de_medicion) FROM master.medicion_anemometrica WHERE id_ema = $1), "
+        "(SELECT MAX(tiempo_de_medicion) FROM master.medicion_direccion_viento WHERE id_ema = $1))"
+    ),
+    'pg_sensores_por_id': "SELECT id, nombre, descripcion FROM master.sensor WHERE id = ANY($1) ORDER BY LOWER(nombre) ASC, nombre ASC",
+    'pg_lista_emas': "SELECT id, nombre FROM master.estacion ORDER BY LENGTH(nombre) ASC, nombre ASC",
+    'pg_catalogo_estaciones': "SELECT id, nombre, descripcion_lugar, latitud, longitud FROM master.estacion",
+    'pg_ubicaciones_emas': "SELECT id, nombre, descripcion_lugar, latitud, longitud FROM master.estacion WHERE latitud IS NOT NULL AND longitud IS NOT NULL",
+}
+
+
+def _conexion_pooled(db_key, replica=None):
+    return db_pool.conexion(db_key, get_db_connection, 'psycopg2', replica=replica)
+
+
+# --- Ruteo a réplicas (app/db_routing.py) ---
+SQL_LAG_REPLICA = (
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END;"
+)
+
+
+def medir_lag_replica_repo(db_key, replica):
+    """
+    Segundos de atraso de la réplica respecto del primario (según el último WAL aplicado).
+    Conexión directa que se cierra al terminar: también se mide al armar el caché en el
+    master de --preload, y una conexión del pool quedaría heredada por todos los workers.
+    """
+    conn = get_db_connection(db_key, replica)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SQL_LAG_REPLICA)
+        lag = cursor.fetchone()[0]
+        cursor.close()
+        return float(lag or 0)
+    except Exception as e:
+        circuit_breaker.anotar_error(db_key, replica, e)
+        raise
+    finally:
+        conn.close()
+
+
+def _replica_para(db_key, carga, fecha_inicio_str=None, fecha_fin_str=None):
+    dias = None
+    if fecha_inicio_str and fecha_fin_str:
+        dias = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') - datetime.strptime(fecha_inicio_str, '%Y-%m-%d')).days + 1
+    return db_routing.elegir_replica(db_key, carga, medir_lag_replica_repo, dias=dias)
+
+
+def _ejecutar_preparada(pc, nombre, params=()):
+    return db_pool.ejecutar_preparada(pc, nombre, SQL_PREPARADAS[nombre], params)
+
 
 # ==============================================================================
 # === CACHE DE SENSORES ========================================================
 # ==============================================================================
-def build_active_sensor_cache(db_key):
+TABLAS_MEDICION = [
+    'medicion_anemometrica', 'medicion_barometrica', 'medicion_bateria', 'medicion_conductiva',
+    'medicion_direccion_viento', 'medicion_freatimetrica', 'medicion_humedad', 'medicion_limnigrafica',
+    'medicion_ph', 'medicion_piranometrica', 'medicion_pluviometrica', 'medicion_punto_rocio',
+    'medicion_temperatura_atmosferica', 'medicion_temperatura_del_curso', 'medicion_turbidimetrica',
+]
+
+# Primera fecha de un sensor en una EMA: una sentencia preparada por tabla, registradas al importar
+_SENTENCIAS_MIN_FECHA = {f"master.{tabla}": f"pg_min_fecha_master_{tabla}" for tabla in TABLAS_MEDICION}
+SQL_PREPARADAS.update({
+    nombre: f"SELECT MIN(tiempo_de_medicion) FROM {tabla} WHERE id_ema = $1 AND id_sensor = $2"
+    for tabla, nombre in _SENTENCIAS_MIN_FECHA.items()
+})
+
+
+def _min_fecha(pc, full_table_name, ema_id, sensor_id):
+    nombre = _SENTENCIAS_MIN_FECHA.get(full_table_name)
+    if nombre:
+        return _ejecutar_preparada(pc, nombre, (int(ema_id), int(sensor_id))).fetchone()[0]
+    # Tabla fuera de TABLAS_MEDICION (config.TABLE_KEYWORD_MAP): consulta común, sin preparar
+    cursor = pc.conn.cursor()
+    cursor.execute(f"SELECT MIN(tiempo_de_medicion) FROM {full_table_name} WHERE id_ema = %s AND id_sensor = %s", (int(ema_id), int(sensor_id)))
+    min_fecha = cursor.fetchone()[0]
+    cursor.close()
+    return min_fecha
+
+
+def _tabla_de_sensor(search_text):
+    for table, keywords in config.TABLE_KEYWORD_MAP.items():
+        if any(keyword in search_text for keyword in keywords):
+            return table
+    return None
+
+
+def build_sensor_index_repo(db_key):
+    """
+    Caché + índice de sensores (app/sensor_index.py) en un solo barrido:
+    por cada tabla de medición, los pares (ema, sensor) activos (DISTINCT, como siempre).
+    La primera fecha de cada sensor no se calcula acá (un MIN agrupado de las 15 tablas
+    cuesta más que el DISTINCT): queda pendiente y primeras_fechas_repo la completa
+    cuando se pide esa EMA.
+    """
     print(f"--- Construyendo cache para: {db_key} (PostgreSQL) ---")
-    QUERY = "SELECT DISTINCT id_ema, id_sensor FROM master.medicion_anemometrica UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_barometrica UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_bateria UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_conductiva UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_direccion_viento UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_freatimetrica UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_humedad UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_limnigrafica UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_ph UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_piranometrica UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_pluviometrica UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_punto_rocio UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_temperatura_atmosferica UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_temperatura_del_curso UNION SELECT DISTINCT id_ema, id_sensor FROM master.medicion_turbidimetrica;"
-    
-    temp_cache_db = {}
+    QUERY = " UNION ".join(f"SELECT DISTINCT id_ema, id_sensor FROM master.{tabla}" for tabla in TABLAS_MEDICION)
+    # El barrido completo de las tablas de medición va a una réplica si hay.
+    # Conexión directa, igual que la medición de atraso de la réplica (al arrancar no se deja
+    # nada en el pool antes del fork de los workers)
+    replica = _replica_para(db_key, 'cache')
+    conn = get_db_connection(db_key, replica)
     try:
-        conn = get_db_connection(db_key)
         cursor = conn.cursor()
         cursor.execute(QUERY)
-        results = cursor.fetchall()
+        filas = cursor.fetchall()
+        ids_activos = sorted({int(row[1]) for row in filas})
+        cursor.execute(
+            "SELECT id, nombre, descripcion FROM master.sensor WHERE id = ANY(%s) ORDER BY LOWER(nombre) ASC, nombre ASC;",
+            (ids_activos,)
+        )
+        catalogo = cursor.fetchall()
         cursor.close()
-        for row in results:
-            ema_id = int(row[0]); sensor_id = int(row[1])
-            if ema_id not in temp_cache_db: temp_cache_db[ema_id] = []
-            temp_cache_db[ema_id].append(sensor_id)
+    except Exception as e:
+        circuit_breaker.anotar_error(db_key, replica, e)
+        raise
+    finally:
         conn.close()
-        print(f"¡Cache para {db_key} construido con éxito!")
-        return temp_cache_db
+
+    indice = IndiceSensores()
+    ids_por_ema = {}
+    for ema_id, sensor_id in filas:
+        ids_por_ema.setdefault(int(ema_id), set()).add(int(sensor_id))
+    indice.sensores_por_ema = {ema_id: sorted(ids) for ema_id, ids in ids_por_ema.items()}
+
+    # Catálogo en el orden de la lista (nombre); solo quedan los sensores con tabla conocida
+    ordenados = []
+    for sensor_id, sensor_nombre, sensor_desc in catalogo:
+        search_text = (str(sensor_nombre) + " " + str(sensor_desc)).lower()
+        table_name = _tabla_de_sensor(search_text)
+        indice.agregar_sensor(int(sensor_id), sensor_nombre.title(), table_name, search_text, sensor_nombre)
+        if table_name: ordenados.append(indice.sensores[int(sensor_id)])
+
+    for ema_id, ids in ids_por_ema.items():
+        # fecha_inicio=None: pendiente (ver primeras_fechas_repo)
+        indice.por_ema[ema_id] = [dict(sensor, fecha_inicio=None) for sensor in ordenados if sensor['id'] in ids]
+
+    # 'todas': un sensor por nombre (id 0), sin fecha
+    vistos = set()
+    for sensor in ordenados:
+        clave = sensor['nombre'].lower()
+        if clave in vistos: continue
+        vistos.add(clave)
+        indice.todas.append(dict(sensor, id=0, fecha_inicio="N/A"))
+
+    print(f"¡Cache para {db_key} construido con éxito!")
+    return indice
+
+
+def primeras_fechas_repo(db_key, ema_id, sensores):
+    """
+    Primera medición de cada sensor de una EMA (un MIN por sensor, resuelto por el índice
+    de la tabla). 'sensores' son entradas del índice. Devuelve sensor_id -> 'YYYY-MM-DD' o "N/A".
+    """
+    fechas = {}
+    with _conexion_pooled(db_key) as pc:
+        for sensor in sensores:
+            full_table_name = sensor['table_name'] if "." in sensor['table_name'] else f"master.{sensor['table_name']}"
+            try:
+                min_fecha = _min_fecha(pc, full_table_name, ema_id, sensor['id'])
+            except Exception as e:
+                if circuit_breaker.es_falla_de_conexion(e): raise
+                print(f"Advertencia: No se pudo obtener fecha para sensor {sensor['id']} en {full_table_name}: {e}")
+                min_fecha = None
+            fechas[sensor['id']] = min_fecha.strftime('%Y-%m-%d') if min_fecha else "N/A"
+    return fechas
+
+
+def build_active_sensor_cache(db_key):
+    # Se refresca el caché de sensores: el catálogo de estaciones también
+    with _catalogos_lock: _catalogos.pop(db_key, None)
+    try:
+        return build_sensor_index_repo(db_key).sensores_por_ema
     except Exception as e:
         print(f"!!! ERROR CRÍTICO al construir el cache para {db_key}: {e}")
         return {}
@@ -78,66 +266,55 @@ def get_sensors_for_ema_repo(db_key, G_SENSOR_CACHE, ema_id):
     if not active_sensor_ids: return []
 
     try:
-        conn = get_db_connection(db_key)
-        cursor = conn.cursor()
-        
-        # Obtenemos los nombres de los sensores
-        SQL_QUERY = "SELECT id, nombre, descripcion FROM master.sensor WHERE id = ANY(%s) ORDER BY LOWER(nombre) ASC, nombre ASC;"
-        cursor.execute(SQL_QUERY, (list(active_sensor_ids),)) 
-        
-        sensores_unicos_por_nombre = {} 
-        rows = cursor.fetchall()
-        
-        for row in rows:
-            sensor_id, sensor_nombre, sensor_desc = row
-            table_name = None
-            search_text = (str(sensor_nombre) + " " + str(sensor_desc)).lower()
-            
-            # Mapear tabla
-            for table, keywords in config.TABLE_KEYWORD_MAP.items():
-                if any(keyword in search_text for keyword in keywords):
-                    table_name = table
-                    break
+        with _conexion_pooled(db_key) as pc:
+            # Obtenemos los nombres de los sensores
+            rows = _ejecutar_preparada(pc, 'pg_sensores_por_id', (sorted(active_sensor_ids),)).fetchall()
+            sensores_unicos_por_nombre = {} 
             
-            if table_name:
-                fecha_inicio_str = "N/A"
+            for row in rows:
+                sensor_id, sensor_nombre, sensor_desc = row
+                table_name = None
+                search_text = (str(sensor_nombre) + " " + str(sensor_desc)).lower()
                 
-                # --- NUEVO: Intentar buscar fecha, pero si falla NO romper todo ---
-                if ema_id != 'todas': 
-                    try:
-                        # Forzamos el esquema "master." si no viene en el nombre
-                        full_table_name = table_name
-                        if "." not in table_name:
-                            full_table_name = f"master.{table_name}"
-
-                        sql_min = f"SELECT MIN(tiempo_de_medicion) FROM {full_table_name} WHERE id_ema = %s AND id_sensor = %s"
-                        cursor.execute(sql_min, (int(ema_id), int(sensor_id)))
-                        min_date = cursor.fetchone()[0]
-                        if min_date:
-                            fecha_inicio_str = min_date.strftime('%Y-%m-%d')
-                    except Exception as e_date:
-                        # Solo imprimimos el error, pero permitimos que el sensor se agregue
-                        print(f"Advertencia: No se pudo obtener fecha para sensor {sensor_id} en {table_name}: {e_date}")
-                        conn.rollback()
-
-                sensor_data = {
-                    'id': sensor_id, 
-                    'nombre': sensor_nombre.title(), 
-                    'table_name': table_name, 
-                    'search_text': search_text,
-                    'fecha_inicio': fecha_inicio_str 
-                }
+                # Mapear tabla
+                for table, keywords in config.TABLE_KEYWORD_MAP.items():
+                    if any(keyword in search_text for keyword in keywords):
+                        table_name = table
+                        break
                 
-                if ema_id == 'todas':
-                    search_key = sensor_nombre.lower() 
-                    if search_key not in sensores_unicos_por_nombre:
-                        sensor_data['id'] = 0 
-                        sensores_unicos_por_nombre[search_key] = sensor_data
-                else:
-                    sensores_encontrados.append(sensor_data)
+                if table_name:
+                    fecha_inicio_str = "N/A"
+                    
+                    # --- NUEVO: Intentar buscar fecha, pero si falla NO romper todo ---
+                    if ema_id != 'todas': 
+                        try:
+                            # Forzamos el esquema "master." si no viene en el nombre
+                            full_table_name = table_name
+                            if "." not in table_name:
+                                full_table_name = f"master.{table_name}"
 
-        cursor.close()
-        conn.close()
+                            min_date = _min_fecha(pc, full_table_name, ema_id, sensor_id)
+                            if min_date:
+                                fecha_inicio_str = min_date.strftime('%Y-%m-%d')
+                        except Exception as e_date:
+                            # Solo imprimimos el error, pero permitimos que el sensor se agregue
+                            print(f"Advertencia: No se pudo obtener fecha para sensor {sensor_id} en {table_name}: {e_date}")
+
+                    sensor_data = {
+                        'id': sensor_id, 
+                        'nombre': sensor_nombre.title(), 
+                        'table_name': table_name, 
+                        'search_text': search_text,
+                        'fecha_inicio': fecha_inicio_str 
+                    }
+                    
+                    if ema_id == 'todas':
+                        search_key = sensor_nombre.lower() 
+                        if search_key not in sensores_unicos_por_nombre:
+                            sensor_data['id'] = 0 
+                            sensores_unicos_por_nombre[search_key] = sensor_data
+                    else:
+                        sensores_encontrados.append(sensor_data)
         
         if ema_id == 'todas':
             return list(sensores_unicos_por_nombre.values())
@@ -151,178 +328,514 @@ def get_sensors_for_ema_repo(db_key, G_SENSOR_CACHE, ema_id):
 # ==============================================================================
 # === REPOSITORIO DE REPORTES (PostgreSQL) =====================================
 # ==============================================================================
-def generate_report_repo(db_key, ema_id_form, fecha_inicio_str, fecha_fin_str, sensor_info_list, process_type_list):
+# --- Partes del reporte: (expresión de tiempo, expresión de valor, columna de tiempo, orden) ---
+# 'orden' replica el ORDER BY original: primero los crudos (tiempo_de_medicion),
+# después los diarios (dia) y por último los horarios (hora).
+TODAS_AGREGACIONES = {
+    'raw': ("t.tiempo_de_medicion", "t.valor", 'tiempo_de_medicion', 0),
+    'pluvio_sum': ("CAST(t.tiempo_de_medicion AS date)", "SUM(t.valor)", 'dia', 1),
+    'nivel_max': ("CAST(t.tiempo_de_medicion AS date)", "MAX(t.valor)", 'dia', 1),
+    'avg_hourly': ("date_trunc('hour', t.tiempo_de_medicion)", "ROUND(AVG(t.valor), 3)", 'hora', 2),
+    'sum_hourly': ("date_trunc('hour', t.tiempo_de_medicion)", "SUM(t.valor)", 'hora', 2),
+    'max_hourly': ("date_trunc('hour', t.tiempo_de_medicion)", "MAX(t.valor)", 'hora', 2),
+}
+
+# --- Reporte angosto ---
+# Las consultas traen solo (tiempo, valor): nombre, descripción y coordenadas de la EMA,
+# nombre del sensor y tipo de procesamiento ya no viajan en cada fila. Se agregan acá
+# desde un catálogo de estaciones cacheado, como categóricas (un código por fila).
+CATALOGO_TTL_SECONDS = getattr(config, 'CATALOGO_TTL_SECONDS', 600)
+_catalogos = {}   # db_key -> (vence, {ema_id: (nombre, descripcion, latitud, longitud)})
+_catalogos_lock = threading.Lock()
+
+
+def _a_float(valor):
+    return None if valor is None else float(valor)
+
+
+def _catalogo_estaciones(db_key, replica=None):
+    ahora = time.monotonic()
+    with _catalogos_lock:
+        entrada = _catalogos.get(db_key)
+        if entrada is not None and entrada[0] > ahora: return entrada[1]
+    with _conexion_pooled(db_key, replica) as pc:
+        filas = _ejecutar_preparada(pc, 'pg_catalogo_estaciones').fetchall()
+    catalogo = {int(f[0]): (f[1], f[2], _a_float(f[3]), _a_float(f[4])) for f in filas}
+    with _catalogos_lock:
+        _catalogos[db_key] = (ahora + CATALOGO_TTL_SECONDS, catalogo)
+    return catalogo
+
+
+def _sql_angosta(process_type, table_name, filtro, por_ema=False):
+    """
+    SELECT de una parte del reporte: [id_ema,] tiempo (siempre timestamp) y valor.
+    Los dos últimos parámetros son las fechas (así se pueden reemplazar por las de un tramo).
+    """
+    full_table_name = table_name if "." in table_name else f"master.{table_name}"
+    time_expr, value_expr, _, _ = TODAS_AGREGACIONES[process_type]
+    columnas = f"({time_expr})::timestamp AS tiempo, ({value_expr})::float8 AS valor"
+    claves = "1, 2" if por_ema else "1"
+    if por_ema: columnas = f"t.id_ema AS ema_id, {columnas}"
+    group_by = "" if process_type == 'raw' else f"GROUP BY {claves}"
+    return (
+        f"SELECT {columnas} FROM {full_table_name} t "
+        f"WHERE {filtro} AND t.tiempo_de_medicion >= %s AND t.tiempo_de_medicion < %s "
+        f"{group_by} ORDER BY {claves};"
+    )
+
+
+# --- Transporte por COPY ---
+# fetchall() arma una tupla de Python por fila (más un datetime y un float por valor):
+# con millones de filas crudas es lo que más CPU gasta. Con COPY (...) TO STDOUT la BD
+# manda el resultado como un solo flujo CSV, que pandas parsea en C directo a columnas
+# tipadas. Si COPY falla, esa consulta se repite una vez con fetchall(). Solo cuando la BD
+# dice que no lo soporta o no lo permite (p. ej. un pooler que no lo deja pasar) esa BD
+# deja de intentarlo hasta reiniciar; cualquier otro error no apaga COPY.
+REPORT_PG_COPY = getattr(config, 'REPORT_PG_COPY', True)
+_COPY_NO_SOPORTADO = (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InsufficientPrivilege)
+_sin_copy = set()   # db_key donde COPY no está disponible
+_sin_copy_lock = threading.Lock()
+
+
+def _columnas_vacias(por_ema):
+    ema_ids = np.array([], dtype='int32') if por_ema else None
+    return ema_ids, np.array([], dtype='datetime64[ns]'), np.array([], dtype='float64')
+
+
+def _leer_copy(cursor, sql, params, por_ema):
+    import pandas as pd
+    consulta = cursor.mogrify(sql.strip().rstrip(';'), params).decode(psycopg2.extensions.encodings[cursor.connection.encoding])
+    flujo = io.BytesIO()
+    cursor.copy_expert(f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv)", flujo)
+    if not flujo.tell(): return _columnas_vacias(por_ema)
+    flujo.seek(0)
+    nombres = ['ema_id', 'tiempo', 'valor'] if por_ema else ['tiempo', 'valor']
+    df = pd.read_csv(flujo, header=None, names=nombres, dtype={'ema_id': 'int32', 'tiempo': str, 'valor': 'float64'})
+    tiempos = pd.to_datetime(df['tiempo'], format='ISO8601')
+    if tiempos.dt.tz is not None: tiempos = tiempos.dt.tz_localize(None)
+    ema_ids = df['ema_id'].to_numpy() if por_ema else None
+    return ema_ids, tiempos.to_numpy('datetime64[ns]'), df['valor'].to_numpy()
+
+
+def _leer_fetchall(cursor, sql, params, por_ema):
+    cursor.execute(sql, params)
+    filas = cursor.fetchall()
+    if not filas: return _columnas_vacias(por_ema)
+    ema_ids = np.array([f[0] for f in filas], dtype='int32') if por_ema else None
+    tiempos = np.array([f[-2] for f in filas], dtype='datetime64[ns]')
+    valores = np.array([np.nan if f[-1] is None else float(f[-1]) for f in filas], dtype='float64')
+    return ema_ids, tiempos, valores
+
+
+def _leer_angosta(db_key, conn, sql, params, por_ema=False):
+    """
+    Ejecuta un SELECT ([id_ema,] tiempo, valor) y devuelve (ema_ids o None, tiempos, valores)
+    como arrays (datetime64[ns], float64), por COPY si se puede.
+    """
+    cursor = conn.cursor()
+    try:
+        with cancellation.registrar(conn.cancel):
+            if REPORT_PG_COPY and db_key not in _sin_copy:
+                try:
+                    return _leer_copy(cursor, sql, params, por_ema)
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    # Cancelación, timeout o conexión caída: repetir con fetchall() no ayuda
+                    raise
+                except _COPY_NO_SOPORTADO as e:
+                    with _sin_copy_lock:
+                        if db_key not in _sin_copy: print(f"⚠️ COPY no disponible en {db_key}, se usa fetchall(): {e}")
+                        _sin_copy.add(db_key)
+                    conn.rollback()
+                except (psycopg2.Error, ValueError) as e:
+                    # Falla puntual: se repite esta consulta con fetchall() y COPY sigue activo
+                    print(f"⚠️ COPY falló en {db_key}, se repite con fetchall(): {e}")
+                    conn.rollback()
+            return _leer_fetchall(cursor, sql, params, por_ema)
+    finally:
+        cursor.close()
+
+
+def _bloque(ema_id, sensor_name, process_type, tiempos, valores):
+    """Columnas de una parte -> bloque angosto (tiempos datetime64[ns], valores float32)."""
+    return (int(ema_id), sensor_name, process_type, tiempos, valores.astype('float32'))
+
+
+def _armar_reporte(bloques, catalogo):
+    """
+    Bloques angostos (ema_id, sensor, procesamiento, tiempos, valores), ya en el orden
+    final -> DataFrame con las columnas de siempre. Lo que se repite por bloque
+    (datos de la EMA, sensor, etiqueta) va como categórica; 'valor' en float32.
+    """
+    import pandas as pd
+    bloques = [b for b in bloques if len(b[3])]
+    if not bloques: return pd.DataFrame()
+    largos = [len(b[3]) for b in bloques]
+    grupo = np.repeat(np.arange(len(bloques)), largos)   # bloque de cada fila
+    estaciones = [catalogo.get(b[0], (None, None, None, None)) for b in bloques]
+
+    def categorica(por_bloque):
+        codigos, unicos = pd.factorize(pd.Series(por_bloque, dtype=object))
+        return pd.Categorical.from_codes(codigos[grupo], unicos)
+
+    tiempo = np.concatenate([b[3] for b in bloques])
+    columna = np.repeat([TODAS_AGREGACIONES[b[2]][2] for b in bloques], largos)
+    nat = np.datetime64('NaT', 'ns')
+    dia = pd.Series(np.where(columna == 'dia', tiempo, nat))
+    if (columna == 'dia').any(): dia = dia.dt.date
+    return pd.DataFrame({
+        'ema_id': np.repeat(np.array([b[0] for b in bloques], dtype='int32'), largos),
+        'nombre_ema': categorica([e[0] for e in estaciones]),
+        'descripcion_ema': categorica([e[1] for e in estaciones]),
+        'latitud': np.repeat(np.array([e[2] for e in estaciones], dtype='float64'), largos),
+        'longitud': np.repeat(np.array([e[3] for e in estaciones], dtype='float64'), largos),
+        'sensor_nombre': categorica([b[1] for b in bloques]),
+        'tiempo_de_medicion': np.where(columna == 'tiempo_de_medicion', tiempo, nat),
+        'dia': dia,
+        'hora': np.where(columna == 'hora', tiempo, nat),
+        'valor': np.concatenate([b[4] for b in bloques]),
+        'tipo_procesamiento': categorica([PROCESS_TYPE_TRANSLATION.get(b[2], b[2]) for b in bloques]),
+    })
+
+
+def _consultar_en_paralelo(db_key, tareas, max_workers=TODAS_MAX_WORKERS, replica=None, por_ema=False):
+    """
+    Ejecuta una lista de (sql, params) en paralelo (ejecutor compartido de app/time_chunks.py);
+    cada tarea toma una conexión del pool (así una caída a mitad de consulta llega al
+    disyuntor y las conexiones se re-usan).
+    Devuelve las columnas (_leer_angosta) de cada tarea en el mismo orden de 'tareas'.
+    """
+    def ejecutar(sql, params):
+        with _conexion_pooled(db_key, replica) as pc:
+            return _leer_angosta(db_key, pc.conn, sql, params, por_ema)
+
+    return time_chunks.en_paralelo(ejecutar, tareas, max_workers, 'todas')
+
+
+def _generate_report_todas(db_key, db_cache, FECHA_INICIO_SQL, FECHA_FIN_SQL, sensor_info_list, process_type_list, replica=None, indice=None):
+    """
+    Reporte de TODAS las EMAs sin JOIN ni ORDER BY global:
+    1. Resuelve los IDs de sensor por nombre contra el índice/caché (ema -> sensores activos).
+    2. Consulta cada estación (y cada tramo de tiempo, en rangos largos) por separado y en
+       paralelo: cada partición ya sale ordenada por tiempo.
+    3. Une las particiones con un k-way merge por (ema_id, sensor_nombre, tipo).
+    """
+    import pandas as pd
+    partes = [
+        (i, sensor_info.split('|'), process_type)
+        for i, (sensor_info, process_type) in enumerate(zip(sensor_info_list, process_type_list))
+        if process_type in TODAS_AGREGACIONES
+    ]
+    if not partes: return pd.DataFrame()
+
+    nombres = sorted({sensor_name.lower() for _, (_, _, sensor_name), _ in partes})
+
+    if indice is not None:
+        # Con el índice, la resolución por nombre es un lookup en memoria
+        ids_por_nombre = {nombre: indice.ids_para_nombre(nombre) for nombre in nombres}
+    else:
+        todos_los_ids = sorted({s for ids in db_cache.values() for s in ids})
+        with _conexion_pooled(db_key, replica) as pc:
+            cursor = pc.conn.cursor()
+            cursor.execute(
+                "SELECT id, LOWER(nombre) FROM master.sensor WHERE id = ANY(%s) AND LOWER(nombre) = ANY(%s);",
+                (todos_los_ids, nombres)
+            )
+            ids_por_nombre = {}
+            for sensor_id, nombre in cursor.fetchall():
+                ids_por_nombre.setdefault(nombre, set()).add(int(sensor_id))
+            cursor.close()
+    estaciones = _catalogo_estaciones(db_key, replica)
+
+    # Una tarea por (parte, estación, tramo de tiempo), recorriendo las EMAs en orden
+    tramos = time_chunks.partir(FECHA_INICIO_SQL, FECHA_FIN_SQL)
+    tareas, claves = [], []
+    for idx, (sensor_id, table_name, sensor_name), process_type in partes:
+        ids_nombre = ids_por_nombre.get(sensor_name.lower(), set())
+        sql = _sql_angosta(process_type, table_name, "t.id_ema = %s AND t.id_sensor = ANY(%s)")
+        for ema_id in sorted(db_cache):
+            ids_ema = sorted(ids_nombre.intersection(db_cache[ema_id]))
+            if not ids_ema or ema_id not in estaciones: continue
+            for desde, hasta in tramos:
+                tareas.append((sql, (ema_id, ids_ema, desde, hasta)))
+            claves.append((idx, ema_id, sensor_name, process_type))
+
+    columnas_por_tarea = _consultar_en_paralelo(db_key, tareas, replica=replica)
+    # Los tramos de una misma (parte, estación) son consecutivos y ya vienen ordenados: se concatenan
+    n = len(tramos)
+    resultados = [
+        (np.concatenate([c[1] for c in columnas_por_tarea[i * n:(i + 1) * n]]),
+         np.concatenate([c[2] for c in columnas_por_tarea[i * n:(i + 1) * n]]))
+        for i in range(len(claves))
+    ]
+
+    # Cada parte es un "run" ordenado por ema_id; el k-way merge los intercala sin re-ordenar filas
+    runs = {}
+    for (idx, ema_id, sensor_name, process_type), (tiempos, valores) in zip(claves, resultados):
+        if not len(tiempos): continue
+        orden = TODAS_AGREGACIONES[process_type][3]
+        runs.setdefault(idx, []).append(((ema_id, sensor_name, orden, idx), _bloque(ema_id, sensor_name, process_type, tiempos, valores)))
+
+    return _armar_reporte([b for _, b in heapq.merge(*runs.values(), key=lambda item: item[0])], estaciones)
+
+
+def _generate_report_por_partes(db_key, partes, FECHA_INICIO_SQL, FECHA_FIN_SQL, replica=None):
+    """
+    Sin caché de sensores (o una sola EMA): una consulta por parte, en paralelo ('todas'
+    resuelve el sensor por nombre en la BD). Cada una sale ordenada por (ema_id, tiempo):
+    se corta por EMA y los bloques se ordenan como el ORDER BY original (ema, sensor, tipo).
+    """
+    columnas_por_parte = _consultar_en_paralelo(db_key, [(sql, params) for _, sql, params, _ in partes], replica=replica, por_ema=True)
+    bloques = []
+    for (clave, _, _, (_, sensor_name, process_type)), (ema_ids, tiempos, valores) in zip(partes, columnas_por_parte):
+        cortes = np.flatnonzero(np.r_[True, ema_ids[1:] != ema_ids[:-1]]) if len(ema_ids) else []
+        for inicio, fin in zip(cortes, list(cortes[1:]) + [len(ema_ids)]):
+            ema_id = int(ema_ids[inicio])
+            bloques.append(((ema_id,) + clave, _bloque(ema_id, sensor_name, process_type, tiempos[inicio:fin], valores[inicio:fin])))
+    bloques.sort(key=lambda item: item[0])
+    return _armar_reporte([b for _, b in bloques], _catalogo_estaciones(db_key, replica))
+
+
+def generate_report_repo(db_key, ema_id_form, fecha_inicio_str, fecha_fin_str, sensor_info_list, process_type_list, G_SENSOR_CACHE=None, G_SENSOR_INDEX=None):
+    import pandas as pd
     
     fecha_fin_obj = datetime.strptime(fecha_fin_str, '%Y-%m-%d')
     fecha_fin_para_sql_obj = fecha_fin_obj + timedelta(days=1)
     FECHA_INICIO_SQL = fecha_inicio_str
     FECHA_FIN_SQL = fecha_fin_para_sql_obj.strftime('%Y-%m-%d')
+    # Rangos largos a una réplica (si hay y no está atrasada); los cortos quedan en el primario
+    replica = _replica_para(db_key, 'reporte', fecha_inicio_str, fecha_fin_str)
+
+    # 'todas' con caché disponible: consultas por estación en paralelo (sin JOIN ni ORDER BY global)
+    db_cache = (G_SENSOR_CACHE or {}).get(db_key)
+    if ema_id_form == 'todas' and db_cache:
+        indice = (G_SENSOR_INDEX or {}).get(db_key)
+        return _generate_report_todas(db_key, db_cache, FECHA_INICIO_SQL, FECHA_FIN_SQL, sensor_info_list, process_type_list, replica, indice)
     
-    all_queries = []
-    all_params = []
-    
+    partes = []
     for sensor_info, process_type in zip(sensor_info_list, process_type_list):
+        if process_type not in TODAS_AGREGACIONES: continue
         sensor_id, table_name, sensor_name = sensor_info.split('|')
-        
-        # Asegurar esquema master en la consulta del reporte también
-        full_table_name = table_name
-        if "." not in table_name:
-             full_table_name = f"master.{table_name}"
-        
-        base_select = "e.id AS ema_id, e.nombre AS nombre_ema, e.descripcion_lugar AS descripcion_ema, e.latitud, e.longitud, %s AS sensor_nombre"
-        group_by_ema_cols = "1, 2, 3, 4, 5, 6" 
-
-        time_cols, value_col, group_by_time_cols = "", "", ""
-
-        if process_type == 'raw':
-            time_cols = "t.tiempo_de_medicion, NULL::date AS dia, NULL::timestamp AS hora"
-            value_col = "t.valor"
-        elif process_type == 'pluvio_sum':
-            time_cols = "NULL::timestamp AS tiempo_de_medicion, CAST(t.tiempo_de_medicion AS date) AS dia, NULL::timestamp AS hora"
-            value_col = "SUM(t.valor) AS valor"
-            group_by_time_cols = "dia"
-        elif process_type == 'nivel_max':
-            time_cols = "NULL::timestamp AS tiempo_de_medicion, CAST(t.tiempo_de_medicion AS date) AS dia, NULL::timestamp AS hora"
-            value_col = "MAX(t.valor) AS valor"
-            group_by_time_cols = "dia"
-        elif process_type == 'avg_hourly':
-            time_cols = "NULL::timestamp AS tiempo_de_medicion, NULL::date AS dia, date_trunc('hour', t.tiempo_de_medicion) AS hora"
-            value_col = "ROUND(AVG(t.valor), 3) AS valor" 
-            group_by_time_cols = "hora"
-        elif process_type == 'sum_hourly':
-            time_cols = "NULL::timestamp AS tiempo_de_medicion, NULL::date AS dia, date_trunc('hour', t.tiempo_de_medicion) AS hora"
-            value_col = "SUM(t.valor) AS valor"
-            group_by_time_cols = "hora"
-        elif process_type == 'max_hourly':
-            time_cols = "NULL::timestamp AS tiempo_de_medicion, NULL::date AS dia, date_trunc('hour', t.tiempo_de_medicion) AS hora"
-            value_col = "MAX(t.valor) AS valor"
-            group_by_time_cols = "hora"
-
-        base_join = f"FROM {full_table_name} t JOIN master.estacion e ON t.id_ema = e.id"
-        
-        where_conditions = []
-        where_params = []
-        
+
         if ema_id_form == 'todas':
-            where_conditions.append("t.id_sensor IN (SELECT id FROM master.sensor WHERE LOWER(nombre) = LOWER(%s))")
-            where_params.append(sensor_name)
+            filtro = "t.id_sensor IN (SELECT id FROM master.sensor WHERE LOWER(nombre) = LOWER(%s))"
+            params = [sensor_name]
+            ema_id = None
         else:
-            where_conditions.append("t.id_ema = %s")
-            where_params.append(int(ema_id_form))
-            where_conditions.append("t.id_sensor = %s")
-            where_params.append(int(sensor_id))
-        
-        where_conditions.append("t.tiempo_de_medicion >= %s")
-        where_params.append(FECHA_INICIO_SQL)
-        where_conditions.append("t.tiempo_de_medicion < %s")
-        where_params.append(FECHA_FIN_SQL)
-        
-        base_where = "WHERE " + " AND ".join(where_conditions)
-        
-        group_by_suffix = ""
-        if process_type == 'raw':
-            group_by_suffix = "" 
-        else:
-            group_by_suffix = f"GROUP BY {group_by_ema_cols}, {group_by_time_cols}"
+            filtro = "t.id_ema = %s AND t.id_sensor = %s"
+            ema_id = int(ema_id_form)
+            params = [ema_id, int(sensor_id)]
+        sql = _sql_angosta(process_type, table_name, filtro, por_ema=True)
 
-        tipo_proceso_display = PROCESS_TYPE_TRANSLATION.get(process_type, process_type)
-        
-        query_part = f"(SELECT {base_select}, {time_cols}, {value_col}, %s AS tipo_procesamiento {base_join} {base_where} {group_by_suffix})"
-        
-        query_params = [sensor_name, tipo_proceso_display] + where_params
-        
-        all_queries.append(query_part)
-        all_params.extend(query_params)
+        # (clave de orden como el ORDER BY original, SQL angosto ordenado por tiempo, parámetros, qué es)
+        partes.append(((sensor_name, TODAS_AGREGACIONES[process_type][3], len(partes)), sql,
+                       params + [FECHA_INICIO_SQL, FECHA_FIN_SQL], (ema_id, sensor_name, process_type)))
     
-    if not all_queries: return pd.DataFrame() 
+    if not partes: return pd.DataFrame() 
 
-    SQL_QUERY = " \nUNION ALL\n ".join(all_queries)
-    SQL_QUERY += " ORDER BY ema_id ASC, sensor_nombre ASC, tiempo_de_medicion ASC, dia ASC, hora ASC;"
-    
-    conn = get_db_connection(db_key)
+    # Una sola EMA no llega acá desde la app (services.fetch_report_df la pasa por
+    # resampling); se resuelve con el mismo camino por partes, sin código propio.
     try:
-        df = pd.read_sql_query(SQL_QUERY, conn, params=all_params)
-        return df
+        return _generate_report_por_partes(db_key, partes, FECHA_INICIO_SQL, FECHA_FIN_SQL, replica)
+    except cancellation.ConsultaCancelada:
+        raise
     except Exception as e_pd_query:
         print(f"Error en consulta ({db_key}): {e_pd_query}")
         raise Exception("Error al consultar datos.") from e_pd_query
-    finally:
-        if conn: conn.close()
+
+def estimar_filas_repo(db_key, ema_id, sensor_info, fecha_inicio_str, fecha_fin_str):
+    """Filas crudas que estima el planificador (EXPLAIN: no ejecuta la consulta)."""
+    sensor_id, table_name, sensor_name = sensor_info.split('|')
+    FECHA_FIN_SQL = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    if ema_id == 'todas':
+        filtro = "t.id_sensor IN (SELECT id FROM master.sensor WHERE LOWER(nombre) = LOWER(%s))"
+        params = [sensor_name]
+    else:
+        filtro = "t.id_ema = %s AND t.id_sensor = %s"
+        params = [int(ema_id), int(sensor_id)]
+    with _conexion_pooled(db_key) as pc:
+        cursor = pc.conn.cursor()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + _sql_angosta('raw', table_name, filtro), params + [fecha_inicio_str, FECHA_FIN_SQL])
+        plan = cursor.fetchone()[0]
+        cursor.close()
+    if isinstance(plan, str): plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+# ==============================================================================
+# === SERIE CRUDA (para el motor de resampling) ================================
+# ==============================================================================
+def fetch_raw_series_repo(db_key, ema_id, sensor_info, fecha_inicio_str, fecha_fin_str):
+    """
+    Trae la serie cruda (tiempo_de_medicion, valor) de UN sensor en UNA EMA,
+    más los datos de la estación. Las agregaciones las calcula app/resampling.py.
+    """
+    sensor_id, table_name, sensor_name = sensor_info.split('|')
+    full_table_name = table_name if "." in table_name else f"master.{table_name}"
+    FECHA_FIN_SQL = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    replica = _replica_para(db_key, 'reporte', fecha_inicio_str, fecha_fin_str)
+
+    with _conexion_pooled(db_key, replica) as pc:
+        cursor = pc.conn.cursor()
+        cursor.execute("SELECT id, nombre, descripcion_lugar, latitud, longitud FROM master.estacion WHERE id = %s;", (int(ema_id),))
+        estacion = cursor.fetchone() or (int(ema_id), None, None, None, None)
+        cursor.close()
+
+    def consultar(desde, hasta):
+        with _conexion_pooled(db_key, replica) as pc:
+            return _leer_angosta(
+                db_key, pc.conn,
+                f"SELECT tiempo_de_medicion::timestamp AS tiempo, valor::float8 AS valor FROM {full_table_name} "
+                f"WHERE id_ema = %s AND id_sensor = %s AND tiempo_de_medicion >= %s AND tiempo_de_medicion < %s "
+                f"ORDER BY tiempo_de_medicion ASC;",
+                (int(ema_id), int(sensor_id), desde, hasta)
+            )
+
+    # Rangos largos: por tramos en paralelo (cada tramo ya viene ordenado)
+    tramos = time_chunks.ejecutar(fecha_inicio_str, FECHA_FIN_SQL, consultar, etiqueta=sensor_name)
+
+    return {
+        'ema_id': int(estacion[0]), 'nombre_ema': estacion[1], 'descripcion_ema': estacion[2],
+        'latitud': estacion[3], 'longitud': estacion[4], 'sensor_nombre': sensor_name,
+        'contador_acumulado': False,
+        'timestamps': np.concatenate([t[1] for t in tramos]), 'valores': np.concatenate([t[2] for t in tramos])
+    }
+
+# ==============================================================================
+# === VARIAS ESTACIONES (gráficos comparativos) ================================
+# ==============================================================================
+def fetch_multi_station_series_repo(db_key, ids_por_ema, sensor_info, fecha_inicio_str, fecha_fin_str):
+    """
+    Serie cruda del mismo sensor en varias EMAs con UNA consulta (id_ema = ANY / id_sensor = ANY).
+    'ids_por_ema': {ema_id: [ids de sensor]} ya resueltos por nombre. Filas ordenadas por (ema, tiempo).
+    """
+    _, table_name, _ = sensor_info.split('|')
+    full_table_name = table_name if "." in table_name else f"master.{table_name}"
+    FECHA_FIN_SQL = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    ema_ids = sorted(int(e) for e in ids_por_ema)
+    sensor_ids = sorted({int(s) for ids in ids_por_ema.values() for s in ids})
+
+    replica = _replica_para(db_key, 'reporte', fecha_inicio_str, fecha_fin_str)
+    with _conexion_pooled(db_key, replica) as pc:
+        cursor = pc.conn.cursor()
+        try:
+            with cancellation.registrar(pc.conn.cancel):
+                cursor.execute(
+                    f"SELECT id_ema, tiempo_de_medicion, valor FROM {full_table_name} "
+                    f"WHERE id_ema = ANY(%s) AND id_sensor = ANY(%s) AND tiempo_de_medicion >= %s AND tiempo_de_medicion < %s "
+                    f"ORDER BY id_ema, tiempo_de_medicion;",
+                    (ema_ids, sensor_ids, fecha_inicio_str, FECHA_FIN_SQL)
+                )
+                filas = cursor.fetchall()
+            cursor.execute("SELECT id, nombre FROM master.estacion WHERE id = ANY(%s);", (ema_ids,))
+            estaciones = {int(ema_id): {'nombre_ema': nombre, 'contador_acumulado': False} for ema_id, nombre in cursor.fetchall()}
+        finally:
+            cursor.close()
+    return {'estaciones': estaciones, 'filas': filas}
+
+# ==============================================================================
+# === SERIES DE LLUVIA (para app/rainfall.py) ==================================
+# ==============================================================================
+def fetch_rain_series_repo(db_key, ema_ids, fecha_inicio_str, fecha_fin_str):
+    """
+    Todos los pluviómetros pedidos en UNA consulta, ordenados por (ema, sensor, tiempo).
+    'ema_ids' None = todas las estaciones.
+    """
+    FECHA_FIN_SQL = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    sql = "SELECT id_ema, id_sensor, tiempo_de_medicion, valor FROM master.medicion_pluviometrica WHERE tiempo_de_medicion >= %s AND tiempo_de_medicion < %s"
+    params = [fecha_inicio_str, FECHA_FIN_SQL]
+    if ema_ids:
+        sql += " AND id_ema = ANY(%s)"; params.append([int(e) for e in ema_ids])
+    sql += " ORDER BY id_ema, id_sensor, tiempo_de_medicion;"
+
+    replica = _replica_para(db_key, 'reporte', fecha_inicio_str, fecha_fin_str)
+    with _conexion_pooled(db_key, replica) as pc:
+        cursor = pc.conn.cursor()
+        try:
+            with cancellation.registrar(pc.conn.cancel):
+                cursor.execute(sql, params)
+                filas = cursor.fetchall()
+            cursor.execute("SELECT id, nombre FROM master.estacion WHERE id = ANY(%s);", (sorted({int(f[0]) for f in filas}),))
+            estaciones = {int(ema_id): {'nombre_ema': nombre, 'contador_acumulado': False} for ema_id, nombre in cursor.fetchall()}
+        finally:
+            cursor.close()
+    return {'estaciones': estaciones, 'filas': filas}
 
 # (Las funciones de create_excel, get_ema_list, get_ema_locations, get_ema_live_summary, get_dashboard_data quedan IGUAL)
 # Solo asegúrate de copiar y pegar el archivo completo o mantener las otras funciones intactas.
 
-def create_excel_from_dataframe(df):
-    output = io.BytesIO()
-    df_to_export = df.copy()
-    if 'ema_id' in df_to_export.columns: df_to_export = df_to_export.drop(columns=['ema_id'])
-    df_to_export.to_excel(output, index=False, sheet_name='Datos', engine='openpyxl')
-    return output
-
 def get_ema_list_repo(db_key):
-    SQL_QUERY = "SELECT id, nombre FROM master.estacion ORDER BY LENGTH(nombre) ASC, nombre ASC;"
     try:
-        conn = get_db_connection(db_key)
-        cursor = conn.cursor()
-        cursor.execute(SQL_QUERY)
-        res = cursor.fetchall()
-        cursor.close(); conn.close()
-        return res
-    except: return []
+        with _conexion_pooled(db_key) as pc:
+            return _ejecutar_preparada(pc, 'pg_lista_emas').fetchall()
+    except Exception as e:
+        if circuit_breaker.es_falla_de_conexion(e): raise
+        print(f"⚠️ Lista de EMAs ({db_key}): {e}")
+        return []
 
 def get_ema_locations_repo(db_key):
-    SQL_QUERY = "SELECT id, nombre, descripcion_lugar, latitud, longitud FROM master.estacion WHERE latitud IS NOT NULL AND longitud IS NOT NULL;"
     locations = []
     try:
-        conn = get_db_connection(db_key)
-        cursor = conn.cursor()
-        cursor.execute(SQL_QUERY)
-        for row in cursor.fetchall():
-            locations.append({'id': row[0], 'nombre': row[1], 'descripcion': row[2] or "Sin descripción.", 'lat': float(row[3]), 'lon': float(row[4])})
-        cursor.close(); conn.close()
+        with _conexion_pooled(db_key) as pc:
+            for row in _ejecutar_preparada(pc, 'pg_ubicaciones_emas').fetchall():
+                locations.append({'id': row[0], 'nombre': row[1], 'descripcion': row[2] or "Sin descripción.", 'lat': float(row[3]), 'lon': float(row[4])})
         return locations
-    except: return []
+    except Exception as e:
+        if circuit_breaker.es_falla_de_conexion(e): raise
+        print(f"⚠️ Ubicaciones de EMAs ({db_key}): {e}")
+        return []
 
 def get_ema_live_summary_repo(db_key, ema_id):
     data = { 'temperatura': None, 'nivel_max_hoy': None, 'pluvio_sum_hoy': None }
-    queries = {
-        'temperatura': "SELECT valor FROM master.medicion_temperatura_atmosferica WHERE id_ema = %s ORDER BY tiempo_de_medicion DESC LIMIT 1",
-        'nivel_max_hoy': "SELECT MAX(valor) FROM master.medicion_limnigrafica WHERE id_ema = %s AND tiempo_de_medicion >= CURRENT_DATE",
-        'pluvio_sum_hoy': "SELECT SUM(valor) FROM master.medicion_pluviometrica WHERE id_ema = %s AND tiempo_de_medicion >= CURRENT_DATE"
+    sentencias = {
+        'temperatura': 'pg_ultima_temperatura',
+        'nivel_max_hoy': 'pg_nivel_max_hoy',
+        'pluvio_sum_hoy': 'pg_pluvio_sum_hoy'
     }
     try:
-        conn = get_db_connection(db_key)
-        cursor = conn.cursor()
-        for key, sql in queries.items():
-            try:
-                cursor.execute(sql, (ema_id,))
-                result = cursor.fetchone()
-                if result and result[0] is not None: data[key] = result[0]
-            except: conn.rollback()
-        cursor.close(); conn.close()
+        with _conexion_pooled(db_key) as pc:
+            for key, nombre in sentencias.items():
+                try:
+                    result = _ejecutar_preparada(pc, nombre, (ema_id,)).fetchone()
+                    if result and result[0] is not None: data[key] = result[0]
+                except Exception as e:
+                    if circuit_breaker.es_falla_de_conexion(e): raise
+                    print(f"Error en {nombre} ({db_key}, EMA {ema_id}): {e}")
+        return data
+    except Exception as e:
+        if circuit_breaker.es_falla_de_conexion(e): raise
+        print(f"Error en resumen en vivo de {db_key} (EMA {ema_id}): {e}")
         return data
-    except: return data
 
 def get_dashboard_data_repo(db_key, ema_id):
     data = {'temperatura': None, 'nivel_max_hoy': None, 'pluvio_sum_hoy': None, 'viento_vel': None, 'viento_dir': None}
-    queries = {
-        'temperatura': "SELECT valor, tiempo_de_medicion FROM master.medicion_temperatura_atmosferica WHERE id_ema = %s ORDER BY tiempo_de_medicion DESC LIMIT 1",
-        'nivel_max_hoy': "SELECT MAX(valor) FROM master.medicion_limnigrafica WHERE id_ema = %s AND tiempo_de_medicion >= CURRENT_DATE",
-        'pluvio_sum_hoy': "SELECT SUM(valor) FROM master.medicion_pluviometrica WHERE id_ema = %s AND tiempo_de_medicion >= CURRENT_DATE",
-        'viento_vel': "SELECT valor, tiempo_de_medicion FROM master.medicion_anemometrica WHERE id_ema = %s ORDER BY tiempo_de_medicion DESC LIMIT 1",
-        'viento_dir': "SELECT valor, tiempo_de_medicion FROM master.medicion_direccion_viento WHERE id_ema = %s ORDER BY tiempo_de_medicion DESC LIMIT 1"
+    sentencias = {
+        'temperatura': 'pg_ultima_temperatura',
+        'nivel_max_hoy': 'pg_nivel_max_hoy',
+        'pluvio_sum_hoy': 'pg_pluvio_sum_hoy',
+        'viento_vel': 'pg_ultimo_viento_vel',
+        'viento_dir': 'pg_ultimo_viento_dir'
     }
     try:
-        conn = get_db_connection(db_key)
-        cursor = conn.cursor()
-        for key, sql in queries.items():
-            try:
-                cursor.execute(sql, (ema_id,))
-                result = cursor.fetchone()
-                if result and result[0] is not None:
-                    if key in ['temperatura', 'viento_vel', 'viento_dir']: data[key] = {'valor': result[0], 'timestamp': result[1]}
-                    else: data[key] = {'valor': result[0]}
-            except: conn.rollback()
-        cursor.close(); conn.close()
+        with _conexion_pooled(db_key) as pc:
+            for key, nombre in sentencias.items():
+                try:
+                    result = _ejecutar_preparada(pc, nombre, (ema_id,)).fetchone()
+                    if result and result[0] is not None:
+                        if key in ['temperatura', 'viento_vel', 'viento_dir']: data[key] = {'valor': result[0], 'timestamp': result[1]}
+                        else: data[key] = {'valor': result[0]}
+                except Exception as e:
+                    if circuit_breaker.es_falla_de_conexion(e): raise
+                    print(f"Error en {nombre} ({db_key}, EMA {ema_id}): {e}")
+        return data
+    except Exception as e:
+        if circuit_breaker.es_falla_de_conexion(e): raise
+        print(f"Error en dashboard de {db_key} (EMA {ema_id}): {e}")
         return data
-    except: return data
\ No newline at end of file
+
+def get_latest_measurement_ts_repo(db_key, ema_id):
+    """
+    Marca de agua del dashboard: la última medición de cualquiera de sus tablas.
+    Es mucho más barata que get_dashboard_data_repo y sirve para saber si hay algo nuevo.
+    """
+    with _conexion_pooled(db_key) as pc:
+        row = _ejecutar_preparada(pc, 'pg_marca_agua_dashboard', (ema_id,)).fetchone()
+        return row[0] if row else None
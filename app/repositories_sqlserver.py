@@ -1,8 +1,15 @@
 import pyodbc
-import pandas as pd
 import io
+import decimal
+import numpy as np
 import config 
 from datetime import datetime, timedelta
+from . import db_pool
+from . import cancellation
+from . import circuit_breaker
+from . import db_routing
+from . import time_chunks
+from .sensor_index import IndiceSensores
 
 PROCESS_TYPE_TRANSLATION = {
     'raw': 'Dato Crudo',
@@ -13,28 +20,155 @@ PROCESS_TYPE_TRANSLATION = {
     'max_hourly': 'Maximo por Hora'
 }
 
-def get_db_connection(db_key):
-    db_config = config.DATABASE_CONNECTIONS.get(db_key)
+# Timeout por consulta (ms) si la BD no define 'statement_timeout_ms' en config.DATABASE_CONNECTIONS
+DEFAULT_STATEMENT_TIMEOUT_MS = getattr(config, 'DEFAULT_STATEMENT_TIMEOUT_MS', 120000)
+
+def get_db_connection(db_key, replica=None):
+    db_config = db_routing.config_endpoint(db_key, replica)
     conn_str = f"DRIVER={{{db_config['odbc_driver']}}};SERVER={db_config['host']},{db_config['port']};DATABASE={db_config['name']};UID={db_config['user']};PWD={db_config['pass']};"
-    return pyodbc.connect(conn_str)
+    # Las secundarias legibles de un Availability Group solo aceptan conexiones de solo lectura
+    if replica is not None: conn_str += "ApplicationIntent=ReadOnly;"
+    # Timeout de login corto y disyuntor por BD: un servidor caído falla rápido
+    conn = circuit_breaker.conectar(db_key, replica, lambda: pyodbc.connect(conn_str, timeout=circuit_breaker.connect_timeout(db_config)))
+    # Timeout por consulta (segundos) para todos los cursores de esta conexión
+    timeout_ms = db_config.get('statement_timeout_ms', DEFAULT_STATEMENT_TIMEOUT_MS)
+    if timeout_ms: conn.timeout = max(1, int(timeout_ms) // 1000)
+    return conn
 
-def build_active_sensor_cache(db_key):
+# --- Sentencias de forma fija: cursor dedicado por conexión del pool (app/db_pool.py) ---
+SQL_PREPARADAS = {
+    'ss_nombre_remota': "SELECT Nombre FROM dbo.Remotas WHERE id = ?",
+    'ss_ultima_bateria': "SELECT TOP 1 Valor, FechaDelDato FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas=sr.id WHERE sr.idRemotas=? AND sr.idSensores=8 ORDER BY FechaDelDato DESC",
+    'ss_ultima_presion': "SELECT TOP 1 Valor, FechaDelDato FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas=sr.id WHERE sr.idRemotas=? AND sr.idSensores=15 ORDER BY FechaDelDato DESC",
+    'ss_pluvio_hoy': "SELECT Valor, FechaDelDato FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas=sr.id WHERE sr.idRemotas=? AND sr.idSensores=7 AND FechaDelDato >= CAST(GETDATE() AS date) ORDER BY FechaDelDato ASC",
+    'ss_marca_agua_dashboard': "SELECT MAX(t.FechaDelDato) FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas=sr.id WHERE sr.idRemotas=? AND sr.idSensores IN (7, 8, 15)",
+    'ss_id_relacion': "SELECT id FROM dbo.SensoresRemotas WHERE idRemotas = ? AND idSensores = ?",
+    'ss_min_fecha_relacion': "SELECT MIN(FechaDelDato) FROM dbo.DatosUTR WHERE idSensoresRemotas = ?",
+    'ss_lista_emas': "SELECT id, Nombre FROM dbo.Remotas ORDER BY Nombre",
+    'ss_ubicaciones_emas': "SELECT id, Nombre, Observaciones, LatGrados, LatMinutos, LatSegundos, LongGrados, LongMinutos, LongSegundos FROM dbo.Remotas WHERE LatGrados IS NOT NULL",
+}
+
+def _conexion_pooled(db_key, replica=None):
+    return db_pool.conexion(db_key, get_db_connection, 'pyodbc', replica=replica)
+
+def _ejecutar_preparada(pc, nombre, params=()):
+    return db_pool.ejecutar_preparada(pc, nombre, SQL_PREPARADAS[nombre], params)
+
+# --- Ruteo a réplicas (app/db_routing.py) ---
+SQL_LAG_REPLICA = (
+    "SELECT COALESCE(MAX(DATEDIFF(SECOND, last_commit_time, GETDATE())), 0) "
+    "FROM sys.dm_hadr_database_replica_states WHERE is_local = 1 AND database_id = DB_ID()"
+)
+
+def medir_lag_replica_repo(db_key, replica):
+    """
+    Segundos desde el último commit aplicado en la réplica (0 si no está en un Availability Group).
+    Conexión directa que se cierra al terminar (ver el caso de --preload en repositories_postgres).
+    """
+    conn = get_db_connection(db_key, replica)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SQL_LAG_REPLICA)
+        return float(cursor.fetchone()[0] or 0)
+    except Exception as e:
+        circuit_breaker.anotar_error(db_key, replica, e)
+        raise
+    finally:
+        conn.close()
+
+def _replica_para(db_key, carga, fecha_inicio_str=None, fecha_fin_str=None):
+    dias = None
+    if fecha_inicio_str and fecha_fin_str:
+        dias = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') - datetime.strptime(fecha_inicio_str, '%Y-%m-%d')).days + 1
+    return db_routing.elegir_replica(db_key, carga, medir_lag_replica_repo, dias=dias)
+
+# Clasificación de sensores por id (ver get_sensors_for_ema_repo)
+ID_MAP = {7: 'pluviometro', 8: 'bateria', 15: 'presion'}
+
+def build_sensor_index_repo(db_key):
+    """
+    Caché + índice de sensores (app/sensor_index.py) en una sola consulta:
+    cada relación EMA-sensor con el nombre del sensor (solo SensoresRemotas y Sensores).
+    La primera fecha de cada sensor queda pendiente, como en PostgreSQL: un MIN por
+    relación contra DatosUTR al arrancar cuesta más que todo lo demás.
+    primeras_fechas_repo la completa cuando se pide esa EMA.
+    """
     print(f"--- Construyendo cache para: {db_key} (SQL Server) ---")
-    QUERY = "SELECT DISTINCT idRemotas, idSensores FROM dbo.SensoresRemotas WHERE idRemotas IS NOT NULL;"
-    temp_cache_db = {}
+    import pandas as pd
+    QUERY = (
+        "SELECT sr.idRemotas AS ema_id, sr.idSensores AS sensor_id, s.Nombre AS nombre FROM dbo.SensoresRemotas sr "
+        "LEFT JOIN dbo.Sensores s ON s.id = sr.idSensores "
+        "WHERE sr.idRemotas IS NOT NULL ORDER BY s.Nombre"
+    )
+    # Conexión directa, igual que la medición de atraso de la réplica (al arrancar no se deja
+    # nada en el pool antes del fork de los workers)
+    replica = _replica_para(db_key, 'cache')
+    conn = get_db_connection(db_key, replica)
     try:
-        conn = get_db_connection(db_key)
-        try:
-             df = pd.read_sql_query(QUERY, conn)
-             for index, row in df.iterrows():
-                 ema_id = int(row['idRemotas'])
-                 sensor_id = int(row['idSensores'])
-                 if ema_id not in temp_cache_db: temp_cache_db[ema_id] = []
-                 temp_cache_db[ema_id].append(sensor_id)
-        except: pass
+        cursor = conn.cursor()
+        df = pd.DataFrame(_leer_columnas(cursor, QUERY, ()))
+        cursor.close()
+    except Exception as e:
+        circuit_breaker.anotar_error(db_key, replica, e)
+        raise
+    finally:
         conn.close()
-        return temp_cache_db
-    except: return {} 
+
+    indice = IndiceSensores()
+    if df.empty: return indice
+    df['ema_id'] = df['ema_id'].astype('int64')
+    df['sensor_id'] = df['sensor_id'].astype('int64')
+
+    # Agrupado en bloque: ids por EMA
+    relaciones = df[['ema_id', 'sensor_id']].drop_duplicates().sort_values(['ema_id', 'sensor_id'])
+    ids_por_ema = relaciones.groupby('ema_id')['sensor_id'].agg(list).to_dict()
+
+    # Las filas ya vienen ordenadas por nombre: el primer registro de cada sensor fija el orden
+    for sid, sname in df[df['nombre'].notna()].drop_duplicates('sensor_id')[['sensor_id', 'nombre']].itertuples(index=False):
+        indice.agregar_sensor(int(sid), sname, ID_MAP.get(int(sid), 'otro'), sname.lower())
+    indice.sensores_por_ema = {int(ema_id): [int(s) for s in ids] for ema_id, ids in ids_por_ema.items()}
+
+    ordenados = list(indice.sensores.values())
+    for ema_id, ids in indice.sensores_por_ema.items():
+        ids = set(ids)
+        # fecha_inicio=None: pendiente (ver primeras_fechas_repo)
+        indice.por_ema[ema_id] = [dict(sensor, fecha_inicio=None) for sensor in ordenados if sensor['id'] in ids]
+
+    # 'todas': un sensor por nombre, sin fecha
+    vistos = set()
+    for sensor in ordenados:
+        if sensor['nombre'] in vistos: continue
+        vistos.add(sensor['nombre'])
+        indice.todas.append(dict(sensor, fecha_inicio="N/A"))
+
+    return indice
+
+def primeras_fechas_repo(db_key, ema_id, sensores):
+    """
+    Primera medición de cada sensor de una EMA ('sensores' son entradas del índice):
+    sus relaciones en SensoresRemotas y un MIN por relación (sentencias preparadas).
+    Devuelve sensor_id -> 'YYYY-MM-DD' o "N/A".
+    """
+    fechas = {}
+    with _conexion_pooled(db_key) as pc:
+        for sensor in sensores:
+            try:
+                relaciones = [fila[0] for fila in _ejecutar_preparada(pc, 'ss_id_relacion', (int(ema_id), int(sensor['id']))).fetchall()]
+                minimos = [_ejecutar_preparada(pc, 'ss_min_fecha_relacion', (relacion,)).fetchone()[0] for relacion in relaciones]
+            except Exception as e:
+                if circuit_breaker.es_falla_de_conexion(e): raise
+                print(f"Error fecha SQLServer sensor {sensor['id']}: {e}")
+                minimos = []
+            minimos = [m for m in minimos if m]
+            fechas[sensor['id']] = min(minimos).strftime('%Y-%m-%d') if minimos else "N/A"
+    return fechas
+
+def build_active_sensor_cache(db_key):
+    try:
+        return build_sensor_index_repo(db_key).sensores_por_ema
+    except Exception as e:
+        print(f"!!! ERROR al construir el cache para {db_key}: {e}")
+        return {}
 
 def dms_to_dd(g, m, s, direccion):
     try:
@@ -58,66 +192,137 @@ def get_sensors_for_ema_repo(db_key, G_SENSOR_CACHE, ema_id):
     if not active_ids: return []
 
     try:
-        conn = get_db_connection(db_key)
-        cursor = conn.cursor()
-        
-        placeholders = ','.join(['?'] * len(active_ids))
-        sql = f"SELECT id, Nombre FROM dbo.Sensores WHERE id IN ({placeholders}) ORDER BY Nombre"
-        cursor.execute(sql, list(active_ids))
-        
-        sensores = []
-        ID_MAP = {7: 'pluviometro', 8: 'bateria', 15: 'presion'}
-        
-        raw_rows = cursor.fetchall()
-        seen = set()
-
-        for row in raw_rows:
-            sid, sname = row
-            tipo = ID_MAP.get(sid, 'otro')
-            key = sname if ema_id == 'todas' else sid
+        with _conexion_pooled(db_key) as pc:
+            # (El IN cambia de largo según la EMA: no es de forma fija, va sin preparar)
+            cursor = pc.conn.cursor()
+            placeholders = ','.join(['?'] * len(active_ids))
+            sql = f"SELECT id, Nombre FROM dbo.Sensores WHERE id IN ({placeholders}) ORDER BY Nombre"
+            cursor.execute(sql, list(active_ids))
+            raw_rows = cursor.fetchall()
+            cursor.close()
             
-            if key not in seen:
-                seen.add(key)
-                fecha_inicio_str = "N/A"
+            sensores = []
+            seen = set()
+
+            for row in raw_rows:
+                sid, sname = row
+                tipo = ID_MAP.get(sid, 'otro')
+                key = sname if ema_id == 'todas' else sid
                 
-                # --- NUEVO: Optimización para buscar fecha ---
-                # Evitamos hacer un JOIN gigante. 
-                # 1. Buscamos el ID del enlace (SensoresRemotas)
-                # 2. Buscamos el Minimo en DatosUTR usando ese ID exacto
-                if ema_id != 'todas':
-                    try:
-                        # Paso 1: Obtener el ID de la relación
-                        cursor.execute("SELECT id FROM dbo.SensoresRemotas WHERE idRemotas = ? AND idSensores = ?", (int(ema_id), int(sid)))
-                        rel_row = cursor.fetchone()
-                        
-                        if rel_row:
-                            id_relacion = rel_row[0]
-                            # Paso 2: Buscar fecha mínima solo para ese ID (mucho más rápido)
-                            cursor.execute("SELECT MIN(FechaDelDato) FROM dbo.DatosUTR WHERE idSensoresRemotas = ?", (id_relacion,))
-                            min_row = cursor.fetchone()
+                if key not in seen:
+                    seen.add(key)
+                    fecha_inicio_str = "N/A"
+                    
+                    # --- NUEVO: Optimización para buscar fecha ---
+                    # Evitamos hacer un JOIN gigante. 
+                    # 1. Buscamos el ID del enlace (SensoresRemotas)
+                    # 2. Buscamos el Minimo en DatosUTR usando ese ID exacto
+                    if ema_id != 'todas':
+                        try:
+                            # Paso 1: Obtener el ID de la relación
+                            rel_row = _ejecutar_preparada(pc, 'ss_id_relacion', (int(ema_id), int(sid))).fetchone()
                             
-                            if min_row and min_row[0]:
-                                fecha_inicio_str = min_row[0].strftime('%Y-%m-%d')
-                    except Exception as e_date:
-                        print(f"Error fecha SQLServer sensor {sid}: {e_date}")
-
-                sensores.append({
-                    'id': sid,
-                    'nombre': sname,
-                    'table_name': tipo,
-                    'search_text': sname.lower(),
-                    'fecha_inicio': fecha_inicio_str
-                })
+                            if rel_row:
+                                id_relacion = rel_row[0]
+                                # Paso 2: Buscar fecha mínima solo para ese ID (mucho más rápido)
+                                min_row = _ejecutar_preparada(pc, 'ss_min_fecha_relacion', (id_relacion,)).fetchone()
+                                
+                                if min_row and min_row[0]:
+                                    fecha_inicio_str = min_row[0].strftime('%Y-%m-%d')
+                        except Exception as e_date:
+                            if circuit_breaker.es_falla_de_conexion(e_date): raise
+                            print(f"Error fecha SQLServer sensor {sid}: {e_date}")
+
+                    sensores.append({
+                        'id': sid,
+                        'nombre': sname,
+                        'table_name': tipo,
+                        'search_text': sname.lower(),
+                        'fecha_inicio': fecha_inicio_str
+                    })
         
-        conn.close()
         return sensores
     except Exception as e:
+        if circuit_breaker.es_falla_de_conexion(e): raise
         print(f"Error get_sensors: {e}")
         return []
 
 # (El resto de funciones se mantienen igual, solo copio calcular_lluvia_acumulada para completar el archivo)
 
+# --- Lectura por columnas ---
+# pyodbc entrega una Row por fila; lo que sí se puede evitar es lo que venía después
+# (copiar cada Row a una tupla y que DataFrame.from_records infiera el tipo fila por fila).
+# Se leen lotes grandes con fetchmany, se transponen a columnas y cada columna pasa de
+# una vez a su array de NumPy según el tipo que informa el driver:
+# fechas -> datetime64[ns], números -> float64 (enteros sin nulos -> int64), resto objeto.
+SS_FETCHMANY_FILAS = getattr(config, 'SS_FETCHMANY_FILAS', 50000)
+
+
+def _a_array(valores, tipo):
+    if tipo is datetime:
+        return np.array(valores, dtype='datetime64[ns]')   # None -> NaT
+    if tipo is int and None not in valores:
+        return np.array(valores, dtype='int64')
+    if tipo is float:
+        return np.array(valores, dtype='float64')          # None -> NaN
+    if tipo is decimal.Decimal:
+        return np.array([np.nan if v is None else float(v) for v in valores], dtype='float64')
+    arr = np.empty(len(valores), dtype=object)
+    arr[:] = valores
+    return arr
+
+
+def _leer_columnas(cursor, sql, params):
+    """Ejecuta 'sql' y devuelve {columna: array} leyendo de a SS_FETCHMANY_FILAS filas."""
+    cursor.arraysize = SS_FETCHMANY_FILAS
+    cursor.execute(sql, params)
+    descripcion = [(col[0], col[1]) for col in cursor.description]
+    partes = [[] for _ in descripcion]
+    while True:
+        lote = cursor.fetchmany(SS_FETCHMANY_FILAS)
+        if not lote: break
+        for i, valores in enumerate(zip(*lote)):
+            partes[i].append(_a_array(valores, descripcion[i][1]))
+    columnas = {}
+    for (nombre, tipo), arrays in zip(descripcion, partes):
+        if not arrays:
+            columnas[nombre] = _a_array((), tipo)
+        elif len(arrays) == 1:
+            columnas[nombre] = arrays[0]
+        else:
+            # Un lote con nulos pudo quedar como objeto/float y otro como int64: se unifica
+            tipos = {a.dtype for a in arrays}
+            columnas[nombre] = np.concatenate(arrays if len(tipos) == 1 else [a.astype(object) for a in arrays])
+    return columnas
+
+
+def _read_sql(conn, sql, params):
+    """
+    Como pd.read_sql_query, pero con un cursor propio para poder cortarlo
+    con cursor.cancel() si la petición se cancela, y leyendo por columnas.
+    """
+    import pandas as pd
+    cursor = conn.cursor()
+    try:
+        with cancellation.registrar(cursor.cancel):
+            return pd.DataFrame(_leer_columnas(cursor, sql, params))
+    finally:
+        cursor.close()
+
+def _read_sql_por_tramos(db_key, replica, sql, armar_params, desde, hasta, etiqueta=None):
+    """
+    _read_sql de [desde, hasta) por tramos de tiempo en paralelo (app/time_chunks.py),
+    cada tramo con su conexión del pool. armar_params(desde_tramo, hasta_tramo) -> params.
+    """
+    import pandas as pd
+    def consultar(d, h):
+        with _conexion_pooled(db_key, replica) as pc:
+            return _read_sql(pc.conn, sql, armar_params(d, h))
+    partes = time_chunks.ejecutar(desde, hasta, consultar, etiqueta=etiqueta)
+    return partes[0] if len(partes) == 1 else pd.concat(partes, ignore_index=True)
+
 def calcular_lluvia_acumulada(df_raw, agrupar_por='dia'):
+    import pandas as pd
     if df_raw.empty: return pd.DataFrame()
     if agrupar_por == 'dia':
         df_raw['grupo'] = df_raw['tiempo_de_medicion'].dt.date
@@ -144,61 +349,209 @@ def calcular_lluvia_acumulada(df_raw, agrupar_por='dia'):
     df_final['descripcion_ema'] = ''; df_final['sensor_nombre'] = '_Pluviometro'; df_final['latitud'] = None; df_final['longitud'] = None
     return df_final
 
-def generate_report_repo(db_key, ema_id_form, fecha_inicio_str, fecha_fin_str, sensor_info_list, process_type_list):
+def generate_report_repo(db_key, ema_id_form, fecha_inicio_str, fecha_fin_str, sensor_info_list, process_type_list, G_SENSOR_CACHE=None, G_SENSOR_INDEX=None):
+    import pandas as pd
+    # (G_SENSOR_CACHE y G_SENSOR_INDEX se aceptan para tener la misma firma que PostgreSQL; acá no se usan)
     FECHA_INICIO_SQL = fecha_inicio_str
     FECHA_PREVIA = (datetime.strptime(fecha_inicio_str, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
     FECHA_FIN_SQL = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
     dfs_result = []
-    conn = get_db_connection(db_key)
-    try:
-        for sensor_info, process_type in zip(sensor_info_list, process_type_list):
-            sensor_id, table_name, sensor_name = sensor_info.split('|')
-            sensor_id = int(sensor_id)
-            if table_name == 'pluviometro' and process_type in ['pluvio_sum', 'sum_hourly']:
-                query = f"SELECT e.id as ema_id, e.Nombre as nombre_ema, t.FechaDelDato as tiempo_de_medicion, t.Valor as valor FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas = sr.id JOIN dbo.Remotas e ON sr.idRemotas = e.id WHERE sr.idSensores = 7 AND t.FechaDelDato >= ? AND t.FechaDelDato < ?"
-                params = [FECHA_PREVIA, FECHA_FIN_SQL]
-                if ema_id_form != 'todas':
-                    query += " AND e.id = ?"; params.append(int(ema_id_form))
-                df_raw = pd.read_sql_query(query, conn, params=params)
-                agrupacion = 'dia' if process_type == 'pluvio_sum' else 'hora'
-                df_proc = calcular_lluvia_acumulada(df_raw, agrupacion)
-                if not df_proc.empty:
-                    col_filtro = 'dia' if agrupacion == 'dia' else 'hora'
-                    df_proc[col_filtro] = pd.to_datetime(df_proc[col_filtro])
-                    df_proc = df_proc[df_proc[col_filtro] >= pd.to_datetime(fecha_inicio_str)]
-                    df_proc['tipo_procesamiento'] = PROCESS_TYPE_TRANSLATION[process_type]
-                    dfs_result.append(df_proc)
-            else:
-                base_sql = "SELECT e.id AS ema_id, e.Nombre AS nombre_ema, e.Observaciones AS descripcion_ema, NULL AS latitud, NULL AS longitud, ? AS sensor_nombre,"
-                cols = ""; group = ""
-                if process_type == 'raw': cols = "t.FechaDelDato AS tiempo_de_medicion, NULL AS dia, NULL AS hora, t.Valor AS valor"
-                elif process_type == 'nivel_max': cols = "NULL, CAST(t.FechaDelDato as date) as dia, NULL, MAX(t.Valor) as valor"; group = "GROUP BY e.id, e.Nombre, e.Observaciones, CAST(t.FechaDelDato as date)"
-                else: cols = "t.FechaDelDato AS tiempo_de_medicion, NULL, NULL, t.Valor AS valor"
-                sql = f"{base_sql} {cols}, ? AS tipo_procesamiento FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas = sr.id JOIN dbo.Remotas e ON sr.idRemotas = e.id WHERE sr.idSensores = ? AND t.FechaDelDato >= ? AND t.FechaDelDato < ?"
-                q_params = [sensor_name, PROCESS_TYPE_TRANSLATION.get(process_type, 'Dato'), sensor_id, FECHA_INICIO_SQL, FECHA_FIN_SQL]
-                if ema_id_form != 'todas': sql += " AND e.id = ?"; q_params.append(int(ema_id_form))
-                if group: sql += f" {group}"
-                df = pd.read_sql_query(sql, conn, params=q_params)
-                dfs_result.append(df)
-    except Exception as e: raise e
-    finally: conn.close()
+    # Rangos largos a una réplica (si hay y no está atrasada); los cortos quedan en el primario
+    replica = _replica_para(db_key, 'reporte', fecha_inicio_str, fecha_fin_str)
+    # Rangos largos: cada sensor por tramos de tiempo en paralelo (una conexión del pool por tramo)
+    for sensor_info, process_type in zip(sensor_info_list, process_type_list):
+        sensor_id, table_name, sensor_name = sensor_info.split('|')
+        sensor_id = int(sensor_id)
+        if table_name == 'pluviometro' and process_type in ['pluvio_sum', 'sum_hourly']:
+            query = f"SELECT e.id as ema_id, e.Nombre as nombre_ema, t.FechaDelDato as tiempo_de_medicion, t.Valor as valor FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas = sr.id JOIN dbo.Remotas e ON sr.idRemotas = e.id WHERE sr.idSensores = 7 AND t.FechaDelDato >= ? AND t.FechaDelDato < ?"
+            filtro_ema = []
+            if ema_id_form != 'todas':
+                query += " AND e.id = ?"; filtro_ema = [int(ema_id_form)]
+            df_raw = _read_sql_por_tramos(db_key, replica, query, lambda d, h: [d, h] + filtro_ema, FECHA_PREVIA, FECHA_FIN_SQL, sensor_name)
+            agrupacion = 'dia' if process_type == 'pluvio_sum' else 'hora'
+            df_proc = calcular_lluvia_acumulada(df_raw, agrupacion)
+            if not df_proc.empty:
+                col_filtro = 'dia' if agrupacion == 'dia' else 'hora'
+                df_proc[col_filtro] = pd.to_datetime(df_proc[col_filtro])
+                df_proc = df_proc[df_proc[col_filtro] >= pd.to_datetime(fecha_inicio_str)]
+                df_proc['tipo_procesamiento'] = PROCESS_TYPE_TRANSLATION[process_type]
+                dfs_result.append(df_proc)
+        else:
+            base_sql = "SELECT e.id AS ema_id, e.Nombre AS nombre_ema, e.Observaciones AS descripcion_ema, NULL AS latitud, NULL AS longitud, ? AS sensor_nombre,"
+            cols = ""; group = ""
+            if process_type == 'raw': cols = "t.FechaDelDato AS tiempo_de_medicion, NULL AS dia, NULL AS hora, t.Valor AS valor"
+            elif process_type == 'nivel_max': cols = "NULL, CAST(t.FechaDelDato as date) as dia, NULL, MAX(t.Valor) as valor"; group = "GROUP BY e.id, e.Nombre, e.Observaciones, CAST(t.FechaDelDato as date)"
+            else: cols = "t.FechaDelDato AS tiempo_de_medicion, NULL, NULL, t.Valor AS valor"
+            sql = f"{base_sql} {cols}, ? AS tipo_procesamiento FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas = sr.id JOIN dbo.Remotas e ON sr.idRemotas = e.id WHERE sr.idSensores = ? AND t.FechaDelDato >= ? AND t.FechaDelDato < ?"
+            q_params = [sensor_name, PROCESS_TYPE_TRANSLATION.get(process_type, 'Dato'), sensor_id]
+            filtro_ema = []
+            if ema_id_form != 'todas': sql += " AND e.id = ?"; filtro_ema = [int(ema_id_form)]
+            if group: sql += f" {group}"
+            df = _read_sql_por_tramos(db_key, replica, sql, lambda d, h: q_params + [d, h] + filtro_ema, FECHA_INICIO_SQL, FECHA_FIN_SQL, sensor_name)
+            dfs_result.append(df)
     if dfs_result: return pd.concat(dfs_result, ignore_index=True)
     else: return pd.DataFrame()
 
+# Días (al final del rango) que se cuentan para estimar el tamaño de un reporte
+REPORT_ESTIMACION_MUESTRA_DIAS = getattr(config, 'REPORT_ESTIMACION_MUESTRA_DIAS', 7)
+
+def estimar_filas_repo(db_key, ema_id, sensor_info, fecha_inicio_str, fecha_fin_str):
+    """
+    Filas crudas estimadas: se cuentan las de los últimos días del rango (hasta hoy)
+    y se extrapola al rango completo. Contar unos días por índice es barato; el rango entero no.
+    """
+    sensor_id, _, _ = sensor_info.split('|')
+    inicio = datetime.strptime(fecha_inicio_str, '%Y-%m-%d')
+    fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)
+    fin_muestra = min(fin, datetime.combine(datetime.now().date(), datetime.min.time()) + timedelta(days=1))
+    inicio_muestra = max(inicio, fin_muestra - timedelta(days=REPORT_ESTIMACION_MUESTRA_DIAS))
+    if fin_muestra <= inicio_muestra: return 0
+    sql = (
+        "SELECT COUNT_BIG(*) FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas = sr.id "
+        "WHERE sr.idSensores = ? AND t.FechaDelDato >= ? AND t.FechaDelDato < ?"
+    )
+    params = [int(sensor_id), inicio_muestra.strftime('%Y-%m-%d'), fin_muestra.strftime('%Y-%m-%d')]
+    if ema_id != 'todas':
+        sql += " AND sr.idRemotas = ?"; params.append(int(ema_id))
+    with _conexion_pooled(db_key) as pc:
+        cursor = pc.conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            muestra = cursor.fetchone()[0] or 0
+        finally:
+            cursor.close()
+    return int(muestra * (fin - inicio).days / max(1, (fin_muestra - inicio_muestra).days))
+
+def fetch_raw_series_repo(db_key, ema_id, sensor_info, fecha_inicio_str, fecha_fin_str):
+    """
+    Serie cruda (FechaDelDato, Valor) de UN sensor en UNA EMA para el motor de resampling.
+    'contador_acumulado' marca los pluviómetros tipo Areco (ver calcular_lluvia_acumulada).
+    """
+    sensor_id, table_name, sensor_name = sensor_info.split('|')
+    FECHA_FIN_SQL = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    replica = _replica_para(db_key, 'reporte', fecha_inicio_str, fecha_fin_str)
+    with _conexion_pooled(db_key, replica) as pc:
+        cursor = pc.conn.cursor()
+        try:
+            cursor.execute("SELECT id, Nombre, Observaciones FROM dbo.Remotas WHERE id = ?", (int(ema_id),))
+            estacion = cursor.fetchone() or (int(ema_id), '', None)
+        finally:
+            cursor.close()
+
+    def consultar(desde, hasta):
+        with _conexion_pooled(db_key, replica) as pc:
+            cursor = pc.conn.cursor()
+            try:
+                with cancellation.registrar(cursor.cancel):
+                    columnas = _leer_columnas(
+                        cursor,
+                        "SELECT t.FechaDelDato AS tiempo, CAST(t.Valor AS float) AS valor FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas = sr.id "
+                        "WHERE sr.idRemotas = ? AND sr.idSensores = ? AND t.FechaDelDato >= ? AND t.FechaDelDato < ? ORDER BY t.FechaDelDato ASC",
+                        (int(ema_id), int(sensor_id), desde, hasta)
+                    )
+                    return columnas['tiempo'], columnas['valor']
+            finally:
+                cursor.close()
+
+    # Rangos largos: por tramos en paralelo (cada tramo ya viene ordenado)
+    tramos = time_chunks.ejecutar(fecha_inicio_str, FECHA_FIN_SQL, consultar, etiqueta=sensor_name)
+
+    nombre_ema = estacion[1] or ''
+    return {
+        'ema_id': int(estacion[0]), 'nombre_ema': nombre_ema, 'descripcion_ema': estacion[2],
+        'latitud': None, 'longitud': None, 'sensor_nombre': sensor_name,
+        'contador_acumulado': table_name == 'pluviometro' and 'areco' in nombre_ema.lower(),
+        'timestamps': np.concatenate([t[0] for t in tramos]), 'valores': np.concatenate([t[1] for t in tramos])
+    }
+
+def fetch_multi_station_series_repo(db_key, ids_por_ema, sensor_info, fecha_inicio_str, fecha_fin_str):
+    """
+    Serie cruda del mismo sensor en varias EMAs con UNA consulta (listas IN).
+    'ids_por_ema': {ema_id: [ids de sensor]}. Filas ordenadas por (ema, tiempo).
+    """
+    _, table_name, _ = sensor_info.split('|')
+    FECHA_FIN_SQL = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    ema_ids = sorted(int(e) for e in ids_por_ema)
+    sensor_ids = sorted({int(s) for ids in ids_por_ema.values() for s in ids})
+    sql = (
+        "SELECT sr.idRemotas, t.FechaDelDato, t.Valor FROM dbo.DatosUTR t "
+        "JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas = sr.id "
+        f"WHERE sr.idRemotas IN ({','.join(['?'] * len(ema_ids))}) AND sr.idSensores IN ({','.join(['?'] * len(sensor_ids))}) "
+        "AND t.FechaDelDato >= ? AND t.FechaDelDato < ? ORDER BY sr.idRemotas, t.FechaDelDato"
+    )
+    params = ema_ids + sensor_ids + [fecha_inicio_str, FECHA_FIN_SQL]
+
+    replica = _replica_para(db_key, 'reporte', fecha_inicio_str, fecha_fin_str)
+    with _conexion_pooled(db_key, replica) as pc:
+        cursor = pc.conn.cursor()
+        try:
+            with cancellation.registrar(cursor.cancel):
+                cursor.execute(sql, params)
+                filas = [tuple(row) for row in cursor.fetchall()]
+            estaciones = {}
+            for ema_id, nombre in _ejecutar_preparada(pc, 'ss_lista_emas').fetchall():
+                if int(ema_id) not in ids_por_ema: continue
+                nombre = nombre or ''
+                estaciones[int(ema_id)] = {
+                    'nombre_ema': nombre,
+                    'contador_acumulado': table_name == 'pluviometro' and 'areco' in nombre.lower()
+                }
+        finally:
+            cursor.close()
+    return {'estaciones': estaciones, 'filas': filas}
+
+def fetch_rain_series_repo(db_key, ema_ids, fecha_inicio_str, fecha_fin_str):
+    """
+    Todos los pluviómetros (idSensores = 7) pedidos en UNA consulta, ordenados por (ema, sensor, tiempo).
+    'ema_ids' None = todas las estaciones. Las de Areco se marcan como contador acumulado.
+    """
+    FECHA_FIN_SQL = (datetime.strptime(fecha_fin_str, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    sql = (
+        "SELECT sr.idRemotas, sr.idSensores, t.FechaDelDato, t.Valor FROM dbo.DatosUTR t "
+        "JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas = sr.id "
+        "WHERE sr.idSensores = 7 AND t.FechaDelDato >= ? AND t.FechaDelDato < ?"
+    )
+    params = [fecha_inicio_str, FECHA_FIN_SQL]
+    if ema_ids:
+        sql += f" AND sr.idRemotas IN ({','.join(['?'] * len(ema_ids))})"; params.extend(int(e) for e in ema_ids)
+    sql += " ORDER BY sr.idRemotas, sr.idSensores, t.FechaDelDato"
+
+    replica = _replica_para(db_key, 'reporte', fecha_inicio_str, fecha_fin_str)
+    with _conexion_pooled(db_key, replica) as pc:
+        cursor = pc.conn.cursor()
+        try:
+            with cancellation.registrar(cursor.cancel):
+                cursor.execute(sql, params)
+                filas = [tuple(row) for row in cursor.fetchall()]
+            estaciones = {}
+            for ema_id, nombre in _ejecutar_preparada(pc, 'ss_lista_emas').fetchall():
+                nombre = nombre or ''
+                estaciones[int(ema_id)] = {'nombre_ema': nombre, 'contador_acumulado': 'areco' in nombre.lower()}
+        finally:
+            cursor.close()
+    return {'estaciones': estaciones, 'filas': filas}
+
 def get_ema_list_repo(db_key):
     try:
-        conn = get_db_connection(db_key); res = pd.read_sql("SELECT id, Nombre FROM dbo.Remotas ORDER BY Nombre", conn).values.tolist(); conn.close(); return res
-    except: return []
+        with _conexion_pooled(db_key) as pc:
+            return [list(row) for row in _ejecutar_preparada(pc, 'ss_lista_emas').fetchall()]
+    except Exception as e:
+        if circuit_breaker.es_falla_de_conexion(e): raise
+        print(f"⚠️ Lista de EMAs ({db_key}): {e}")
+        return []
 
 def get_ema_locations_repo(db_key):
     try:
-        conn = get_db_connection(db_key); cursor = conn.cursor(); cursor.execute("SELECT id, Nombre, Observaciones, LatGrados, LatMinutos, LatSegundos, LongGrados, LongMinutos, LongSegundos FROM dbo.Remotas WHERE LatGrados IS NOT NULL")
         locs = []
-        for r in cursor.fetchall():
-            lat = dms_to_dd(r.LatGrados, r.LatMinutos, r.LatSegundos, 'S'); lon = dms_to_dd(r.LongGrados, r.LongMinutos, r.LongSegundos, 'O')
-            if lat != 0 and lon != 0: locs.append({'id': r.id, 'nombre': r.Nombre, 'descripcion': r.Observaciones, 'lat': lat, 'lon': lon})
-        conn.close(); return locs
-    except: return []
+        with _conexion_pooled(db_key) as pc:
+            for r in _ejecutar_preparada(pc, 'ss_ubicaciones_emas').fetchall():
+                lat = dms_to_dd(r.LatGrados, r.LatMinutos, r.LatSegundos, 'S'); lon = dms_to_dd(r.LongGrados, r.LongMinutos, r.LongSegundos, 'O')
+                if lat != 0 and lon != 0: locs.append({'id': r.id, 'nombre': r.Nombre, 'descripcion': r.Observaciones, 'lat': lat, 'lon': lon})
+        return locs
+    except Exception as e:
+        if circuit_breaker.es_falla_de_conexion(e): raise
+        print(f"⚠️ Ubicaciones de EMAs ({db_key}): {e}")
+        return []
 
 
 # ==============================================================================
@@ -212,62 +565,48 @@ def get_dashboard_data_repo(db_key, ema_id):
     """
     data = {'bateria': None, 'presion': None, 'pluvio_sum_hoy': None}
     
-    conn = get_db_connection(db_key)
-    try:
-        cursor = conn.cursor()
+    with _conexion_pooled(db_key) as pc:
+        try:
+            # 0. IDENTIFICAR SI ES ARECO
+            row_nombre = _ejecutar_preparada(pc, 'ss_nombre_remota', (ema_id,)).fetchone()
+            es_areco = False
+            if row_nombre and 'areco' in row_nombre[0].lower():
+                es_areco = True
 
-        # 0. IDENTIFICAR SI ES ARECO
-        cursor.execute("SELECT Nombre FROM dbo.Remotas WHERE id = ?", (ema_id,))
-        row_nombre = cursor.fetchone()
-        es_areco = False
-        if row_nombre and 'areco' in row_nombre[0].lower():
-            es_areco = True
-
-        # 1. Batería (ID 8)
-        sql_bat = "SELECT TOP 1 Valor, FechaDelDato FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas=sr.id WHERE sr.idRemotas=? AND sr.idSensores=8 ORDER BY FechaDelDato DESC"
-        cursor.execute(sql_bat, (ema_id,))
-        row = cursor.fetchone()
-        if row and row[0] is not None: 
-            data['bateria'] = {'valor': row[0], 'timestamp': row[1]}
-        
-        # 2. Presión (ID 15)
-        sql_pres = "SELECT TOP 1 Valor, FechaDelDato FROM dbo.DatosUTR t JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas=sr.id WHERE sr.idRemotas=? AND sr.idSensores=15 ORDER BY FechaDelDato DESC"
-        cursor.execute(sql_pres, (ema_id,))
-        row = cursor.fetchone()
-        if row and row[0] is not None: 
-            data['presion'] = {'valor': row[0], 'timestamp': row[1]}
-        
-        # 3. Lluvia (ID 7) - Acumulado HOY
-        sql_pluvio = """
-            SELECT Valor, FechaDelDato 
-            FROM dbo.DatosUTR t 
-            JOIN dbo.SensoresRemotas sr ON t.idSensoresRemotas=sr.id 
-            WHERE sr.idRemotas=? AND sr.idSensores=7 
-            AND FechaDelDato >= CAST(GETDATE() AS date)
-            ORDER BY FechaDelDato ASC
-        """
-        df_pluvio = pd.read_sql_query(sql_pluvio, conn, params=[ema_id])
-        
-        if not df_pluvio.empty:
-            total_hoy = 0.0
+            # 1. Batería (ID 8)
+            row = _ejecutar_preparada(pc, 'ss_ultima_bateria', (ema_id,)).fetchone()
+            if row and row[0] is not None: 
+                data['bateria'] = {'valor': row[0], 'timestamp': row[1]}
             
-            if es_areco:
-                # LÓGICA ARECO: El acumulado es el valor máximo registrado hoy
-                total_hoy = df_pluvio['Valor'].max()
-            else:
-                # LÓGICA NORMAL (Usuario): Suma directa de todos los valores de hoy
-                total_hoy = df_pluvio['Valor'].sum()
+            # 2. Presión (ID 15)
+            row = _ejecutar_preparada(pc, 'ss_ultima_presion', (ema_id,)).fetchone()
+            if row and row[0] is not None: 
+                data['presion'] = {'valor': row[0], 'timestamp': row[1]}
             
-            if pd.notnull(total_hoy):
-                data['pluvio_sum_hoy'] = {'valor': float(total_hoy)}
+            # 3. Lluvia (ID 7) - Acumulado HOY
+            valores_hoy = [r[0] for r in _ejecutar_preparada(pc, 'ss_pluvio_hoy', (ema_id,)).fetchall() if r[0] is not None]
             
-    except Exception as e:
-        print(f"Error dashboard SQL: {e}")
-    finally:
-        conn.close()
+            if valores_hoy:
+                if es_areco:
+                    # LÓGICA ARECO: El acumulado es el valor máximo registrado hoy
+                    total_hoy = max(valores_hoy)
+                else:
+                    # LÓGICA NORMAL (Usuario): Suma directa de todos los valores de hoy
+                    total_hoy = sum(valores_hoy)
+                data['pluvio_sum_hoy'] = {'valor': float(total_hoy)}
+                
+        except Exception as e:
+            if circuit_breaker.es_falla_de_conexion(e): raise
+            print(f"Error dashboard SQL: {e}")
         
     return data
 
+def get_latest_measurement_ts_repo(db_key, ema_id):
+    """Marca de agua del dashboard: última FechaDelDato de lluvia, batería o presión."""
+    with _conexion_pooled(db_key) as pc:
+        row = _ejecutar_preparada(pc, 'ss_marca_agua_dashboard', (ema_id,)).fetchone()
+        return row[0] if row else None
+
 # ==============================================================================
 # ==============================================================================
 def create_excel_from_dataframe(df):
@@ -0,0 +1,126 @@
+# app/resampling.py
+# Motor de re-muestreo (resampling) vectorizado.
+# Recibe la serie cruda (timestamps, valores) UNA sola vez y calcula
+# cualquier cantidad de agregaciones (ancho de bucket + función) con NumPy.
+# Agregar un tipo de procesamiento nuevo = agregar una entrada en PROCESS_TYPES.
+
+import re
+import numpy as np
+
+FUNCIONES = ('sum', 'min', 'max', 'mean', 'count', 'first', 'last')
+
+# --- Catálogo de tipos de procesamiento ---
+# 'ancho': tamaño del bucket ('15min', '1h', '3h', '1D', '1W'); None = dato crudo.
+# 'columna': columna de tiempo del reporte donde va el inicio del bucket.
+PROCESS_TYPES = {
+    'raw':        {'ancho': None,    'funcion': None,   'columna': 'tiempo_de_medicion', 'etiqueta': 'Dato Crudo'},
+    'pluvio_sum': {'ancho': '1D',    'funcion': 'sum',  'columna': 'dia',  'etiqueta': 'Acumulado Diario'},
+    'nivel_max':  {'ancho': '1D',    'funcion': 'max',  'columna': 'dia',  'etiqueta': 'Maximo Diario'},
+    'avg_hourly': {'ancho': '1h',    'funcion': 'mean', 'columna': 'hora', 'etiqueta': 'Promedio por Hora'},
+    'sum_hourly': {'ancho': '1h',    'funcion': 'sum',  'columna': 'hora', 'etiqueta': 'Acumulado por Hora'},
+    'max_hourly': {'ancho': '1h',    'funcion': 'max',  'columna': 'hora', 'etiqueta': 'Maximo por Hora'},
+    'avg_15min':  {'ancho': '15min', 'funcion': 'mean', 'columna': 'hora', 'etiqueta': 'Promedio cada 15 min'},
+    'max_3h':     {'ancho': '3h',    'funcion': 'max',  'columna': 'hora', 'etiqueta': 'Maximo cada 3 Horas'},
+    'min_daily':  {'ancho': '1D',    'funcion': 'min',  'columna': 'dia',  'etiqueta': 'Minimo Diario'},
+    # Lluvia: máximo diario de los acumulados móviles 1h/3h/6h/24h/72h (lo calcula app/rainfall.py)
+    'pluvio_max_movil': {'ancho': '1D', 'funcion': 'max', 'columna': 'dia', 'etiqueta': 'Lluvia Maxima Movil', 'ventanas_moviles': True},
+}
+
+_UNIDADES = {'min': 'm', 'h': 'h', 'd': 'D', 'w': 'W'}
+# Los buckets semanales arrancan el lunes (el epoch 1970-01-01 fue jueves)
+_ORIGEN_SEMANAL = np.datetime64('1970-01-05', 'ns')
+_ORIGEN = np.datetime64('1970-01-01', 'ns')
+
+
+def parse_ancho(ancho):
+    """'15min' / '1h' / '3H' / '1D' / '2W' -> np.timedelta64 en nanosegundos."""
+    match = re.fullmatch(r'\s*(\d+)\s*(min|h|d|w)\s*', str(ancho), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Ancho de bucket no soportado: {ancho}")
+    cantidad, unidad = int(match.group(1)), _UNIDADES[match.group(2).lower()]
+    if cantidad <= 0:
+        raise ValueError(f"Ancho de bucket no soportado: {ancho}")
+    return np.timedelta64(cantidad, unidad).astype('timedelta64[ns]')
+
+
+def series_desde_filas(filas):
+    """Lista de (timestamp, valor) -> (datetime64[ns], float64), sin nulos y ordenada."""
+    if not filas:
+        return np.array([], dtype='datetime64[ns]'), np.array([], dtype='float64')
+    tiempos, valores = zip(*filas)
+    timestamps = np.array(tiempos, dtype='datetime64[ns]')
+    valores = np.array([np.nan if v is None else float(v) for v in valores], dtype='float64')
+    return ordenar_serie(timestamps, valores)
+
+
+def ordenar_serie(timestamps, valores):
+    """Descarta nulos (como hacen SUM/AVG/MAX en SQL) y garantiza orden ascendente."""
+    validos = ~np.isnat(timestamps) & ~np.isnan(valores)
+    timestamps, valores = timestamps[validos], valores[validos]
+    if len(timestamps) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+        orden = np.argsort(timestamps, kind='stable')
+        timestamps, valores = timestamps[orden], valores[orden]
+    return timestamps, valores
+
+
+def _limites(timestamps, ancho_ns):
+    """Índices de inicio de cada bucket y su timestamp de inicio (la serie ya está ordenada)."""
+    origen = _ORIGEN_SEMANAL if ancho_ns % np.timedelta64(7, 'D') == np.timedelta64(0, 'ns') else _ORIGEN
+    ids = (timestamps - origen) // ancho_ns
+    inicios = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    return inicios, origen + ids[inicios] * ancho_ns
+
+
+def a_float64(valores):
+    """float32 -> float64 con el valor que se ve (12.345 y no 12.345000267); lo demás queda igual."""
+    if getattr(valores, 'dtype', None) != np.float32: return valores
+    return valores.astype(str).astype('float64')
+
+
+def inicio_de_bucket(timestamp, ancho):
+    """Inicio del bucket de 'ancho' que contiene a 'timestamp' (datetime64); sin ancho, el mismo timestamp."""
+    timestamp = np.datetime64(timestamp, 'ns')
+    if ancho is None: return timestamp
+    ancho_ns = parse_ancho(ancho)
+    origen = _ORIGEN_SEMANAL if ancho_ns % np.timedelta64(7, 'D') == np.timedelta64(0, 'ns') else _ORIGEN
+    return origen + ((timestamp - origen) // ancho_ns) * ancho_ns
+
+
+def resample(timestamps, valores, specs):
+    """
+    Calcula todas las agregaciones pedidas en 'specs' (lista de (ancho, funcion)).
+    Los límites de bucket se calculan una sola vez por ancho y se reusan entre funciones.
+    Devuelve {(ancho, funcion): (inicios_de_bucket, valores_agregados)}.
+    """
+    resultados = {}
+    por_ancho = {}
+    n = len(timestamps)
+    for ancho, funcion in specs:
+        if funcion not in FUNCIONES:
+            raise ValueError(f"Función de agregación no soportada: {funcion}")
+        if n == 0:
+            resultados[(ancho, funcion)] = (np.array([], dtype='datetime64[ns]'), np.array([], dtype='float64'))
+            continue
+
+        ancho_ns = parse_ancho(ancho)
+        if ancho_ns not in por_ancho:
+            por_ancho[ancho_ns] = {'limites': _limites(timestamps, ancho_ns)}
+        cache = por_ancho[ancho_ns]
+        inicios, buckets = cache['limites']
+
+        # sum/count se comparten entre 'sum' y 'mean'
+        if funcion in ('sum', 'mean') and 'sum' not in cache:
+            cache['sum'] = np.add.reduceat(valores, inicios)
+        if funcion in ('count', 'mean') and 'count' not in cache:
+            cache['count'] = np.diff(np.r_[inicios, n]).astype('float64')
+
+        if funcion == 'sum': agregado = cache['sum']
+        elif funcion == 'count': agregado = cache['count']
+        elif funcion == 'mean': agregado = cache['sum'] / cache['count']
+        elif funcion == 'min': agregado = np.minimum.reduceat(valores, inicios)
+        elif funcion == 'max': agregado = np.maximum.reduceat(valores, inicios)
+        elif funcion == 'first': agregado = valores[inicios]
+        else: agregado = valores[np.r_[inicios[1:], n] - 1]
+
+        resultados[(ancho, funcion)] = (buckets, agregado)
+    return resultados
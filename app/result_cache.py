@@ -0,0 +1,123 @@
+# app/result_cache.py
+# Caché de resultados: series crudas por sensor (lo que cuesta de verdad en gráficos y
+# reportes) y datos crudos del dashboard. El formateo por rol se sigue haciendo afuera.
+#
+# - Vencimiento según el rango: los que terminan antes de hoy ya no cambian
+#   (RESULT_CACHE_TTL_CERRADO); los que incluyen hoy, poco (RESULT_CACHE_TTL_ABIERTO).
+#   Además, cuando el precalentamiento (app/warmup.py) ve datos nuevos de una EMA,
+#   invalida sus entradas abiertas.
+# - Cada consulta deja una 'receta' con las fechas relativas a hoy ("últimos 7 días",
+#   no "12 al 18"): así el precalentamiento puede repetir mañana lo que fue popular hoy.
+# - Tope por memoria, no solo por cantidad: la suma de los nbytes de lo guardado no pasa
+#   de RESULT_CACHE_MAX_BYTES (se descartan las menos usadas).
+
+import contextvars
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+import config
+
+RESULT_CACHE_MAX_ENTRADAS = getattr(config, 'RESULT_CACHE_MAX_ENTRADAS', 256)
+RESULT_CACHE_MAX_BYTES = getattr(config, 'RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+RESULT_CACHE_TTL_ABIERTO = getattr(config, 'RESULT_CACHE_TTL_ABIERTO', 120)
+RESULT_CACHE_TTL_CERRADO = getattr(config, 'RESULT_CACHE_TTL_CERRADO', 6 * 3600)
+# Recetas distintas que se recuerdan (al pasarse, se olvidan las menos usadas)
+RESULT_CACHE_MAX_RECETAS = getattr(config, 'RESULT_CACHE_MAX_RECETAS', 500)
+
+_cache = OrderedDict()   # clave -> (valor, vence, abierta, (db_key, ema_id), bytes)
+_bytes = 0               # suma de los bytes de las entradas de _cache
+_lock = threading.Lock()
+_usos = Counter()        # receta -> veces pedida por usuarios
+_precalentando = contextvars.ContextVar('precalentando', default=False)
+_stats = {'aciertos': 0, 'fallos': 0, 'precalentados': 0, 'invalidados': 0, 'descartados': 0}
+
+
+def tamano(valor):
+    """Bytes aproximados de un valor: nbytes de los arrays, recorriendo dicts/listas/tuplas."""
+    nbytes = getattr(valor, 'nbytes', None)
+    if nbytes is not None: return int(nbytes)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamano(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(tamano(v) for v in valor)
+    return sys.getsizeof(valor)
+
+
+def _quitar(clave):
+    global _bytes
+    _bytes -= _cache.pop(clave)[4]
+
+
+@contextmanager
+def precalentando():
+    """Dentro de este bloque las consultas no cuentan como uso y lo abierto se recalcula."""
+    marca = _precalentando.set(True)
+    try:
+        yield
+    finally:
+        _precalentando.reset(marca)
+
+
+def obtener(clave, calcular, abierta, ema, receta=None, cachear_si=None, ttl=None):
+    """
+    Devuelve el valor cacheado de 'clave' o lo calcula y lo guarda.
+    'ema' es (db_key, ema_id) para poder invalidar; 'cachear_si(valor)' permite
+    no guardar resultados demasiado grandes; 'ttl' reemplaza el vencimiento por defecto.
+    """
+    precalentado = _precalentando.get()
+    ahora = time.monotonic()
+    with _lock:
+        if receta is not None and not precalentado:
+            _usos[receta] += 1
+            if len(_usos) > RESULT_CACHE_MAX_RECETAS:
+                quedan = _usos.most_common(RESULT_CACHE_MAX_RECETAS // 2)
+                _usos.clear()
+                _usos.update(dict(quedan))
+        entrada = _cache.get(clave)
+        if entrada is not None and entrada[1] > ahora and not (precalentado and entrada[2]):
+            _cache.move_to_end(clave)
+            _stats['aciertos'] += 1
+            return entrada[0]
+        _stats['precalentados' if precalentado else 'fallos'] += 1
+
+    valor = calcular()
+    if cachear_si is not None and not cachear_si(valor):
+        return valor
+    if ttl is None:
+        ttl = RESULT_CACHE_TTL_ABIERTO if abierta else RESULT_CACHE_TTL_CERRADO
+    nbytes = tamano(valor)
+    if nbytes > RESULT_CACHE_MAX_BYTES:
+        return valor
+    global _bytes
+    with _lock:
+        if clave in _cache: _quitar(clave)
+        _cache[clave] = (valor, time.monotonic() + ttl, abierta, ema, nbytes)
+        _bytes += nbytes
+        while len(_cache) > RESULT_CACHE_MAX_ENTRADAS or _bytes > RESULT_CACHE_MAX_BYTES:
+            _quitar(next(iter(_cache)))
+            _stats['descartados'] += 1
+    return valor
+
+
+def invalidar_ema(db_key, ema_id):
+    """Llegaron datos nuevos de la EMA: lo que incluye hoy deja de valer."""
+    ema = (db_key, int(ema_id))
+    with _lock:
+        viejas = [clave for clave, entrada in _cache.items() if entrada[2] and entrada[3] == ema]
+        for clave in viejas:
+            _quitar(clave)
+        _stats['invalidados'] += len(viejas)
+    return len(viejas)
+
+
+def populares(cantidad):
+    """Las recetas más pedidas por los usuarios (más usada primero)."""
+    with _lock:
+        return [receta for receta, _ in _usos.most_common(cantidad)]
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats, entradas=len(_cache), bytes=_bytes, max_bytes=RESULT_CACHE_MAX_BYTES, recetas=len(_usos))
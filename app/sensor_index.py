@@ -0,0 +1,64 @@
+# app/sensor_index.py
+# Índice en memoria de los sensores de cada BD.
+#
+# Se arma junto con el caché de sensores (build_global_cache) y deja resuelto
+# todo lo que /get-sensors y el reporte de 'todas' antes consultaban en cada petición:
+#   - sensor id -> nombre, tabla (clasificación), texto de búsqueda, visibilidad restringida
+#   - ema -> lista de sensores ya armada (con su fecha de inicio; si el repositorio la deja
+#     en None, se completa la primera vez que se pide esa EMA: fechas_pendientes/poner_fechas)
+#   - nombre -> ids de sensor
+# Cada repositorio sabe cómo clasificar sus sensores; acá solo se guardan y se consultan.
+
+# Palabras que ocultan un sensor al rol 'restricted' (batería)
+PALABRAS_RESTRINGIDAS = ['bateria', 'Bateria', '_Bateria', '_bateria']
+
+
+def es_sensor_restringido(table_name, search_text):
+    """Un sensor es de batería si lo dice su tabla o su nombre visible."""
+    if 'bateria' in (table_name or '').lower(): return True
+    texto = (search_text or '').lower()
+    return any(palabra in texto for palabra in PALABRAS_RESTRINGIDAS)
+
+
+class IndiceSensores:
+
+    def __init__(self):
+        self.sensores = {}          # id -> {'id', 'nombre', 'table_name', 'search_text', 'restringido'}
+        self.por_ema = {}           # ema_id -> [sensor para /get-sensors]
+        self.todas = []             # lista para 'todas' (un sensor por nombre)
+        self.ids_por_nombre = {}    # nombre en minúsculas -> {ids}
+        self.sensores_por_ema = {}  # ema_id -> [ids]  (mismo formato que G_SENSOR_CACHE)
+
+    def agregar_sensor(self, sensor_id, nombre, table_name, search_text, nombre_original=None):
+        """'nombre_original' es el nombre tal cual está en la BD (si 'nombre' viene formateado)."""
+        self.sensores[sensor_id] = {
+            'id': sensor_id, 'nombre': nombre, 'table_name': table_name, 'search_text': search_text,
+            'restringido': es_sensor_restringido(table_name, search_text),
+        }
+        self.ids_por_nombre.setdefault(str(nombre_original or nombre).lower(), set()).add(sensor_id)
+
+    def listar(self, ema_id, incluir_restringidos=True):
+        """Sensores de una EMA (o de 'todas') en el formato que espera el frontend."""
+        if ema_id == 'todas':
+            lista = self.todas
+        else:
+            try:
+                lista = self.por_ema.get(int(ema_id), [])
+            except ValueError:
+                return []
+        return [
+            dict({k: v for k, v in s.items() if k != 'restringido'}, fecha_inicio=s.get('fecha_inicio') or "N/A")
+            for s in lista if incluir_restringidos or not s['restringido']
+        ]
+
+    def fechas_pendientes(self, ema_id):
+        """Sensores de la EMA cuya primera fecha todavía no se consultó."""
+        return [s for s in self.por_ema.get(int(ema_id), []) if s.get('fecha_inicio', "N/A") is None]
+
+    def poner_fechas(self, ema_id, fechas):
+        """'fechas': sensor_id -> 'YYYY-MM-DD' (o "N/A")."""
+        for s in self.por_ema.get(int(ema_id), []):
+            if s['id'] in fechas: s['fecha_inicio'] = fechas[s['id']]
+
+    def ids_para_nombre(self, nombre):
+        return self.ids_por_nombre.get(str(nombre).lower(), set())
@@ -1,11 +1,28 @@
 # app/services.py
 # [CORRECCIÓN FINAL: Arreglado el error de 'round(dict)' para Postgres]
 
-from . import repositories_postgres
-from . import repositories_sqlserver
+from . import db_pool
+from . import admission
+from . import cancellation
+from . import db_routing
+from . import shared_cache
+from . import result_cache
+from . import single_flight
+from . import time_chunks
+from . import warmup
+from . import circuit_breaker
+from .sensor_index import es_sensor_restringido
 import config
-import pandas as pd 
-from datetime import datetime
+import importlib
+import threading
+# pandas y numpy (con resampling/excel_export, que los usan) se importan dentro de las
+# funciones que los necesitan: tardan en cargar y el arranque (caché de sensores) no los
+# usa. Igual los módulos de uso ocasional: report_bundle, report_jobs, live_stream,
+# chart_pyramid y rainfall.
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Empty
+from flask import current_app
 from flask_login import current_user # Importamos para chequear el rol
 
 # (El mapa de municipios solo se usará para 'db_principal')
@@ -16,12 +33,42 @@ EMA_MUNICIPIO_MAP = {
     13: "Gral Rodriguez", 14: "Moreno", 15: "Lujan",
 }
 
+# Driver -> módulo de repositorio. Se importa recién cuando una BD configurada lo usa:
+# así psycopg2 / pyodbc (y el driver ODBC) solo se cargan si hacen falta.
+# También acepta módulos de afuera del paquete (p. ej. el backend sintético de loadtest/).
 REPOSITORIES_MAP = {
-    'psycopg2': repositories_postgres,
-    'pyodbc': repositories_sqlserver
+    'psycopg2': '.repositories_postgres',
+    'pyodbc': '.repositories_sqlserver'
 }
+_repos_cargados = {}
+_repos_lock = threading.Lock()
 
 G_SENSOR_CACHE = {}
+# db_key -> IndiceSensores (app/sensor_index.py), se arma junto con el caché
+G_SENSOR_INDEX = {}
+
+# --- Fan-out entre varias BDs ---
+# Columnas normalizadas de un reporte, sin importar el motor de origen
+REPORT_COLUMNS = [
+    'ema_id', 'nombre_ema', 'descripcion_ema', 'latitud', 'longitud', 'sensor_nombre',
+    'tiempo_de_medicion', 'dia', 'hora', 'valor', 'tipo_procesamiento'
+]
+# Hilos del ejecutor del fan-out, compartido por todas las peticiones del proceso (las
+# consultas de cada BD van al ejecutor de app/time_chunks.py: no se esperan entre sí)
+FAN_OUT_MAX_WORKERS = getattr(config, 'FAN_OUT_MAX_WORKERS', 8)
+_pool_fan_out = None
+_pool_fan_out_lock = threading.Lock()
+
+# --- Dashboard en vivo (SSE) ---
+LIVE_HEARTBEAT_SECONDS = getattr(config, 'LIVE_HEARTBEAT_SECONDS', 15)
+
+# Colores por BD (la primera conserva los colores de siempre)
+FAN_OUT_COLORS = [
+    None,
+    {'bg': 'rgba(75, 192, 192, 0.6)', 'border': 'rgba(75, 192, 192, 1)'},
+    {'bg': 'rgba(255, 159, 64, 0.6)', 'border': 'rgba(255, 159, 64, 1)'},
+    {'bg': 'rgba(153, 102, 255, 0.6)', 'border': 'rgba(153, 102, 255, 1)'},
+]
 
 
 def get_repo_for_db(db_key):
@@ -34,87 +81,554 @@ def get_repo_for_db(db_key):
         raise ValueError(f"No se encontró config para la DB: {db_key}")
         
     driver = db_config.get('driver')
-    repo = REPOSITORIES_MAP.get(driver)
-    
-    if not repo:
+    repo = _repos_cargados.get(driver)
+    if repo is not None: return repo
+
+    modulo = REPOSITORIES_MAP.get(driver)
+    if not modulo:
         raise ValueError(f"Driver no soportado: {driver}")
-        
-    return repo
+
+    with _repos_lock:
+        if driver not in _repos_cargados:
+            _repos_cargados[driver] = importlib.import_module(modulo, __package__)
+        return _repos_cargados[driver]
+
+
+def cargar_repositorios_configurados():
+    """
+    Arranque: importa solo los repositorios de los drivers que usa DATABASE_CONNECTIONS.
+    Si un driver no carga (p. ej. falta el driver ODBC), las demás BDs siguen funcionando.
+    """
+    for db_key in config.DATABASE_CONNECTIONS:
+        try:
+            get_repo_for_db(db_key)
+        except Exception as e:
+            print(f"⚠️ No se pudo cargar el repositorio de {db_key}: {e}")
+    return sorted(_repos_cargados)
+
+
+def get_db_display_name(db_key):
+    return config.DATABASE_CONNECTIONS.get(db_key, {}).get('display_name', db_key)
+
+
+class FormularioPorDB:
+    """
+    Vista de un form (MultiDict) para una sola BD.
+    En modo fan-out, un campo 'ema_id@db_sql' tiene prioridad sobre 'ema_id'
+    (los IDs de EMAs y sensores no son iguales entre motores).
+    """
+    def __init__(self, form_data, db_key):
+        self.form_data = form_data
+        self.db_key = db_key
+
+    def _key(self, key):
+        scoped = f"{key}@{self.db_key}"
+        return scoped if scoped in self.form_data else key
+
+    def get(self, key, default=None):
+        return self.form_data.get(self._key(key), default)
+
+    def getlist(self, key):
+        return self.form_data.getlist(self._key(key))
+
+
+def fan_out(db_keys, fn):
+    """
+    Ejecuta fn(db_key) para cada BD en paralelo.
+    Devuelve (resultados, errores), ambos dicts por db_key.
+    Una BD caída no tumba a las demás: su error queda en 'errores'.
+    """
+    global _pool_fan_out
+    with _pool_fan_out_lock:
+        if _pool_fan_out is None:
+            _pool_fan_out = ThreadPoolExecutor(max_workers=max(1, FAN_OUT_MAX_WORKERS), thread_name_prefix='fan-out')
+        pool = _pool_fan_out
+    resultados, errores = {}, {}
+    futuros = {pool.submit(cancellation.en_contexto(fn), db_key): db_key for db_key in db_keys}
+    for futuro in as_completed(futuros):
+        db_key = futuros[futuro]
+        try:
+            resultados[db_key] = futuro.result()
+        except cancellation.ConsultaCancelada:
+            for pendiente in futuros: pendiente.cancel()
+            raise
+        except Exception as e:
+            print(f"⚠️ Fan-out: falló {db_key}: {e}")
+            errores[db_key] = str(e)
+    return resultados, errores
+
+
+# Orden de las partes dentro de un sensor (igual que el ORDER BY de los repositorios)
+_ORDEN_COLUMNA_TIEMPO = {'tiempo_de_medicion': 0, 'dia': 1, 'hora': 2}
+
+
+def _spec_resampling(process_type, serie):
+    from . import resampling
+    tipo = resampling.PROCESS_TYPES[process_type]
+    funcion = tipo['funcion']
+    # Regla Areco: el pluviómetro es un contador acumulado, el total del bucket es su máximo
+    if serie.get('contador_acumulado') and funcion == 'sum':
+        funcion = 'max'
+    return (tipo['ancho'], funcion)
+
+
+def _arrays_de_serie(serie):
+    """(timestamps, valores) ordenados de lo que devuelve fetch_raw_series_repo."""
+    from . import resampling
+    if 'timestamps' in serie:
+        return resampling.ordenar_serie(serie['timestamps'], serie['valores'])
+    return resampling.series_desde_filas(serie['filas'])
+
+
+# --- Caché de resultados (app/result_cache.py) ---
+# Series más largas que esto no se guardan (un año crudo ocuparía la memoria de todo lo demás);
+# el total del caché además tiene su tope en bytes (RESULT_CACHE_MAX_BYTES)
+RESULT_CACHE_MAX_FILAS = getattr(config, 'RESULT_CACHE_MAX_FILAS', 200000)
+# El dashboard se refresca seguido: vence antes que las series
+RESULT_CACHE_TTL_DASHBOARD = getattr(config, 'RESULT_CACHE_TTL_DASHBOARD', 30)
+
+
+def _dias_atras(fecha_str, hoy):
+    return (hoy - datetime.strptime(fecha_str, '%Y-%m-%d').date()).days
+
+
+def _filas_de_serie(serie):
+    return len(serie['timestamps'] if 'timestamps' in serie else serie['filas'])
+
+
+def fetch_raw_series(db_key, ema_id, sensor_info, fecha_inicio, fecha_fin):
+    """fetch_raw_series_repo pasando por el caché de resultados."""
+    repo = get_repo_for_db(db_key)
+    hoy = datetime.now().date()
+    return result_cache.obtener(
+        ('serie', db_key, int(ema_id), sensor_info, fecha_inicio, fecha_fin),
+        # Fallo de caché: pedidos idénticos simultáneos comparten una sola consulta
+        lambda: single_flight.ejecutar(
+            ('serie', db_key, int(ema_id), sensor_info, fecha_inicio, fecha_fin),
+            lambda: repo.fetch_raw_series_repo(db_key, ema_id, sensor_info, fecha_inicio, fecha_fin),
+        ),
+        abierta=fecha_fin >= hoy.isoformat(), ema=(db_key, int(ema_id)),
+        receta=('serie', db_key, int(ema_id), sensor_info, _dias_atras(fecha_inicio, hoy), _dias_atras(fecha_fin, hoy)),
+        cachear_si=lambda serie: _filas_de_serie(serie) <= RESULT_CACHE_MAX_FILAS,
+    )
+
+
+def fetch_dashboard_raw(db_key, ema_id):
+    """Datos crudos del dashboard (sin formatear: el filtro de batería depende del usuario)."""
+    repo = get_repo_for_db(db_key)
+    return result_cache.obtener(
+        ('dashboard', db_key, int(ema_id)),
+        lambda: single_flight.ejecutar(
+            ('dashboard', db_key, int(ema_id)), lambda: repo.get_dashboard_data_repo(db_key, ema_id)
+        ),
+        abierta=True, ema=(db_key, int(ema_id)), receta=('dashboard', db_key, int(ema_id)),
+        ttl=RESULT_CACHE_TTL_DASHBOARD,
+    )
+
+
+def generate_resampled_report_df(db_key, ema_id, fecha_inicio, fecha_fin, sensor_info_list, process_type_list):
+    """
+    Reporte calculado con el motor de resampling (app/resampling.py):
+    UNA consulta cruda por sensor, sin importar cuántos tipos de procesamiento se pidan.
+    Devuelve las mismas columnas que generate_report_repo.
+    """
+    import pandas as pd
+    import numpy as np
+    from . import resampling, rainfall
+    repo = get_repo_for_db(db_key)
+    pedidos = {}
+    for sensor_info, process_type in zip(sensor_info_list, process_type_list):
+        pedidos.setdefault(sensor_info, []).append(process_type)
+
+    def parte(serie, columna, tiempos, vals, etiqueta):
+        tiempos = pd.Series(tiempos)
+        if columna == 'dia': tiempos = tiempos.dt.date
+        df = pd.DataFrame({
+            'ema_id': serie['ema_id'], 'nombre_ema': serie['nombre_ema'], 'descripcion_ema': serie['descripcion_ema'],
+            'latitud': serie['latitud'], 'longitud': serie['longitud'], 'sensor_nombre': serie['sensor_nombre'],
+            'tiempo_de_medicion': tiempos if columna == 'tiempo_de_medicion' else None,
+            'dia': tiempos if columna == 'dia' else None,
+            'hora': tiempos if columna == 'hora' else None,
+            'valor': vals,
+            'tipo_procesamiento': etiqueta,
+        }, columns=REPORT_COLUMNS)
+        return ((serie['sensor_nombre'], _ORDEN_COLUMNA_TIEMPO[columna]), df)
+
+    partes = []
+    for sensor_info, process_types in pedidos.items():
+        # Las ventanas móviles de lluvia necesitan datos previos al inicio (margen de la ventana más larga)
+        moviles = [pt for pt in process_types if resampling.PROCESS_TYPES[pt].get('ventanas_moviles')]
+        fecha_fetch = fecha_inicio
+        if moviles:
+            fecha_fetch = (pd.Timestamp(fecha_inicio) - pd.Timedelta(seconds=rainfall.MARGEN_SEGUNDOS)).strftime('%Y-%m-%d')
+        serie = fetch_raw_series(db_key, ema_id, sensor_info, fecha_fetch, fecha_fin)
+        ts_con_margen, vals_con_margen = _arrays_de_serie(serie)
+        en_rango = ts_con_margen >= np.datetime64(fecha_inicio, 'ns')
+        timestamps, valores = ts_con_margen[en_rango], vals_con_margen[en_rango]
+
+        specs = {pt: _spec_resampling(pt, serie) for pt in process_types if pt != 'raw' and pt not in moviles}
+        agregados = resampling.resample(timestamps, valores, set(specs.values()))
+
+        for process_type in process_types:
+            tipo = resampling.PROCESS_TYPES[process_type]
+            if process_type in moviles:
+                # Máximo diario del acumulado en cada ventana móvil (respeta la regla Areco)
+                grupos = np.zeros(len(ts_con_margen), dtype='int64')
+                inc = rainfall.incrementos(grupos, vals_con_margen, [serie.get('contador_acumulado', False)])
+                for ventana, totales in rainfall.totales_moviles(grupos, ts_con_margen, inc).items():
+                    dias, maximos = resampling.resample(timestamps, totales[en_rango], {(tipo['ancho'], 'max')})[(tipo['ancho'], 'max')]
+                    partes.append(parte(serie, tipo['columna'], dias, np.round(maximos, 2), f"{tipo['etiqueta']} {ventana}"))
+                continue
+            if process_type == 'raw':
+                tiempos, vals = timestamps, valores
+            else:
+                tiempos, vals = agregados[specs[process_type]]
+                if specs[process_type][1] == 'mean': vals = np.round(vals, 3)
+            partes.append(parte(serie, tipo['columna'], tiempos, vals, tipo['etiqueta']))
+
+    if not partes: return pd.DataFrame()
+    partes.sort(key=lambda p: p[0])
+    return pd.concat([df for _, df in partes], ignore_index=True)
+
+
+def fetch_report_df(db_key, ema_id, fecha_inicio, fecha_fin, sensor_info_list, process_type_list):
+    """
+    Punto único para obtener datos procesados de una BD.
+    - Una EMA: motor de resampling (una consulta por sensor).
+    - 'todas': SQL del repositorio (solo tipos de procesamiento originales).
+    """
+    from . import resampling
+    repo = get_repo_for_db(db_key)
+    desconocidos = [pt for pt in process_type_list if pt not in resampling.PROCESS_TYPES]
+    if desconocidos:
+        raise ValueError(f"Tipo de procesamiento no soportado: {', '.join(desconocidos)}")
+
+    if ema_id != 'todas':
+        return generate_resampled_report_df(db_key, ema_id, fecha_inicio, fecha_fin, sensor_info_list, process_type_list)
+
+    no_sql = [pt for pt in process_type_list if pt not in repo.PROCESS_TYPE_TRANSLATION]
+    if no_sql:
+        raise ValueError(f"El procesamiento '{resampling.PROCESS_TYPES[no_sql[0]]['etiqueta']}' no está disponible para TODAS las EMAs.")
+    return repo.generate_report_repo(
+        db_key=db_key, 
+        ema_id_form=ema_id,
+        fecha_inicio_str=fecha_inicio,
+        fecha_fin_str=fecha_fin,
+        sensor_info_list=sensor_info_list,
+        process_type_list=process_type_list,
+        G_SENSOR_CACHE=G_SENSOR_CACHE,
+        G_SENSOR_INDEX=G_SENSOR_INDEX
+    )
+
+
+def _generate_report_df(db_key, form_data):
+    df = fetch_report_df(
+        db_key,
+        form_data.get('ema_id'),
+        form_data.get('fecha_inicio'),
+        form_data.get('fecha_fin'),
+        form_data.getlist('sensor_info'),
+        form_data.getlist('process_type')
+    )
+    return agregar_municipio(df, db_key)
+
+
+def agregar_municipio(df, db_key):
+    # (Solo agregamos el municipio si es la DB principal)
+    if 'ema_id' in df.columns and db_key == 'db_principal':
+        df['municipio'] = df['ema_id'].map(EMA_MUNICIPIO_MAP).fillna('N/A')
+        cols = list(df.columns)
+        if 'nombre_ema' in cols:
+            municipio_col = cols.pop(cols.index('municipio'))
+            nombre_ema_index = cols.index('nombre_ema')
+            cols.insert(nombre_ema_index + 1, municipio_col)
+            df = df[cols] 
+    return df
+
+
+def normalizar_reporte_df(df, db_key):
+    """
+    Lleva el reporte de cualquier motor al mismo esquema (REPORT_COLUMNS),
+    con tipos homogéneos y una columna 'base_datos' con el origen.
+    """
+    import pandas as pd
+    extras = [c for c in df.columns if c not in REPORT_COLUMNS]
+    municipio = ['municipio'] if 'municipio' in extras else []
+    otras = [c for c in extras if c != 'municipio']
+    df = df.reindex(columns=REPORT_COLUMNS[:2] + municipio + REPORT_COLUMNS[2:] + otras)
+    for col in ['tiempo_de_medicion', 'dia', 'hora']:
+        df[col] = pd.to_datetime(df[col], errors='coerce')
+    for col in ['latitud', 'longitud', 'valor']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df.insert(0, 'base_datos', get_db_display_name(db_key))
+    return df
 
 
 def generate_report_service(db_key, form_data):
     """
     Servicio para generar el reporte.
+    Si 'db_key' es una lista, se consulta cada BD en paralelo (fan-out)
+    y se devuelve un único Excel con la columna 'base_datos'.
     """
+    from . import excel_export
     try:
-        repo = get_repo_for_db(db_key)
-        df = repo.generate_report_repo(
-            db_key=db_key, 
-            ema_id_form=form_data.get('ema_id'),
-            fecha_inicio_str=form_data.get('fecha_inicio'),
-            fecha_fin_str=form_data.get('fecha_fin'),
-            sensor_info_list=form_data.getlist('sensor_info'),
-            process_type_list=form_data.getlist('process_type')
-        )
-        
-        # (Solo agregamos el municipio si es la DB principal)
-        if 'ema_id' in df.columns and db_key == 'db_principal':
-            df['municipio'] = df['ema_id'].map(EMA_MUNICIPIO_MAP).fillna('N/A')
-            cols = list(df.columns)
-            if 'nombre_ema' in cols:
-                municipio_col = cols.pop(cols.index('municipio'))
-                nombre_ema_index = cols.index('nombre_ema')
-                cols.insert(nombre_ema_index + 1, municipio_col)
-                df = df[cols] 
-
-        output_excel = repositories_postgres.create_excel_from_dataframe(df)
-        
-        fecha_i = form_data.get("fecha_inicio", "inicio")
-        fecha_f = form_data.get("fecha_fin", "fin")
-        nombre_archivo = f'reporte_EMA_{form_data.get("ema_id")}_{fecha_i}_al_{fecha_f}.xlsx'
-        
-        return output_excel.getvalue(), nombre_archivo
+        if isinstance(db_key, (list, tuple)):
+            return _generate_report_multi_db(list(db_key), form_data)
+
+        df = _generate_report_df(db_key, form_data)
+        output_excel = excel_export.create_excel_from_dataframe(df)
+        return output_excel.getvalue(), _nombre_reporte(form_data, 'xlsx')
 
     except Exception as e:
         print(f"Error en generate_report_service: {e}")
         raise e
 
+
+def _nombre_reporte(form_data, extension):
+    fecha_i = form_data.get("fecha_inicio", "inicio")
+    fecha_f = form_data.get("fecha_fin", "fin")
+    return f'reporte_EMA_{form_data.get("ema_id")}_{fecha_i}_al_{fecha_f}.{extension}'
+
+
+# --- Preflight de reportes: costo estimado -> cómo se entrega ---
+# Hasta REPORT_INLINE_MAX_FILAS: Excel en el momento (un .xlsx no admite más de ~1 M de filas);
+# hasta REPORT_CSV_MAX_FILAS: CSV en streaming; hasta REPORT_JOB_MAX_FILAS: CSV comprimido
+# en segundo plano (app/report_jobs.py); más que eso se rechaza.
+REPORT_INLINE_MAX_FILAS = getattr(config, 'REPORT_INLINE_MAX_FILAS', 300000)
+REPORT_CSV_MAX_FILAS = getattr(config, 'REPORT_CSV_MAX_FILAS', 3000000)
+REPORT_JOB_MAX_FILAS = getattr(config, 'REPORT_JOB_MAX_FILAS', 30000000)
+REPORT_BYTES_POR_FILA = getattr(config, 'REPORT_BYTES_POR_FILA', 90)
+
+
+def _filas_procesadas(crudas, process_type, dias, estaciones):
+    """Filas de salida de un procesamiento: a lo sumo una por bucket, y nunca más que las crudas."""
+    import numpy as np
+    from . import resampling, rainfall
+    tipo = resampling.PROCESS_TYPES[process_type]
+    if tipo['ancho'] is None: return crudas
+    buckets = int(np.timedelta64(dias, 'D') / resampling.parse_ancho(tipo['ancho'])) * estaciones
+    if tipo.get('ventanas_moviles'):
+        # Una fila por ventana y por día, haya llovido o no
+        return buckets * len(rainfall.VENTANAS) if crudas else 0
+    return min(crudas, buckets)
+
+
+def _estimar_filas(db_key, ema_id, fecha_inicio, fecha_fin, sensor_info_list, process_type_list):
+    repo = get_repo_for_db(db_key)
+    dias = (datetime.strptime(fecha_fin, '%Y-%m-%d') - datetime.strptime(fecha_inicio, '%Y-%m-%d')).days + 1
+    estaciones = (len(G_SENSOR_CACHE.get(db_key) or {}) or 1) if ema_id == 'todas' else 1
+    crudas = {}
+    total = 0
+    for sensor_info, process_type in zip(sensor_info_list, process_type_list):
+        if sensor_info not in crudas:
+            crudas[sensor_info] = repo.estimar_filas_repo(db_key, ema_id, sensor_info, fecha_inicio, fecha_fin)
+        total += _filas_procesadas(crudas[sensor_info], process_type, dias, estaciones)
+    return total
+
+
+def estimar_reporte_service(db_key, form_data):
+    """
+    Preflight de un reporte: filas y tamaño aproximados, y cómo se entrega
+    ('excel', 'csv', 'trabajo' o 'rechazar'). Las filas crudas las estima cada
+    repositorio (EXPLAIN en PostgreSQL, muestra de los últimos días en SQL Server).
+    Si la estimación falla, se sigue como siempre (Excel).
+    """
+    db_keys = list(db_key) if isinstance(db_key, (list, tuple)) else [db_key]
+    try:
+        filas = 0
+        for k in db_keys:
+            form = FormularioPorDB(form_data, k)
+            filas += _estimar_filas(
+                k, form.get('ema_id'), form.get('fecha_inicio'), form.get('fecha_fin'),
+                form.getlist('sensor_info'), form.getlist('process_type')
+            )
+    except Exception as e:
+        if circuit_breaker.es_falla_de_conexion(e): raise
+        print(f"⚠️ Estimación del reporte: {e}")
+        return {'filas': None, 'megabytes': None, 'entrega': 'excel', 'mensaje': "No se pudo estimar el tamaño del reporte."}
+
+    if filas <= REPORT_INLINE_MAX_FILAS:
+        entrega, mensaje = 'excel', "Se descargará como Excel."
+    elif len(db_keys) > 1:
+        entrega, mensaje = 'rechazar', "El reporte es demasiado grande para combinar varias bases de datos: pídalo de a una."
+    elif filas <= REPORT_CSV_MAX_FILAS:
+        entrega, mensaje = 'csv', "Es demasiado grande para Excel: se descargará como CSV a medida que se genera."
+    elif filas <= REPORT_JOB_MAX_FILAS:
+        entrega, mensaje = 'trabajo', "Se generará en segundo plano (CSV comprimido); podrá descargarlo desde esta página."
+    else:
+        cantidad = f"{filas:,}".replace(',', '.')
+        entrega, mensaje = 'rechazar', (
+            f"El reporte es demasiado grande (≈{cantidad} filas). Acorte el rango de fechas, "
+            "use un procesamiento agregado (diario u horario) o elija menos sensores."
+        )
+    return {'filas': filas, 'megabytes': round(filas * REPORT_BYTES_POR_FILA / 1e6, 1), 'entrega': entrega, 'mensaje': mensaje}
+
+
+def _csv_reporte(db_key, ema_id, fecha_inicio, fecha_fin, sensor_info_list, process_type_list):
+    """
+    Generador con los bytes del CSV del reporte. Cada (sensor, procesamiento) y cada tramo
+    de tiempo (app/time_chunks.py) se consulta y se escribe por separado: la memoria no
+    depende del rango. Cada parte terminada se avisa con time_chunks.avisar_progreso.
+    """
+    from . import resampling, report_jobs
+    hasta = (datetime.strptime(fecha_fin, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    tramos = time_chunks.partir(fecha_inicio, hasta)
+    # Mismo orden que el Excel: por sensor, primero los crudos, después diarios y horarios
+    partes = sorted(
+        enumerate(zip(sensor_info_list, process_type_list)),
+        key=lambda p: (p[1][0].split('|')[2], _ORDEN_COLUMNA_TIEMPO[resampling.PROCESS_TYPES[p[1][1]]['columna']], p[0])
+    )
+    columnas = [c for c in REPORT_COLUMNS if c != 'ema_id']
+    if db_key == 'db_principal': columnas.insert(1, 'municipio')
+    yield ('\ufeff' + ','.join(columnas) + '\r\n').encode('utf-8')
+
+    hechos, total = 0, len(partes) * len(tramos)
+    for _, (sensor_info, process_type) in partes:
+        for desde, hasta_tramo in tramos:
+            # En streaming la petición puede cancelarse entre tramos (app/cancellation.py)
+            cancellation.verificar()
+            ultimo_dia = (datetime.strptime(hasta_tramo, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+            df = fetch_report_df(db_key, ema_id, desde, ultimo_dia, [sensor_info], [process_type])
+            if not df.empty:
+                df = agregar_municipio(df, db_key).reindex(columns=columnas)
+                df['valor'] = resampling.a_float64(df['valor'])
+                yield df.to_csv(index=False, header=False, lineterminator='\r\n').encode('utf-8')
+            hechos += 1
+            time_chunks.avisar_progreso(hechos, total, report_jobs.ETIQUETA_PARTES)
+
+
+def _args_reporte(form_data):
+    from . import resampling
+    ema_id, fecha_inicio, fecha_fin = form_data.get('ema_id'), form_data.get('fecha_inicio'), form_data.get('fecha_fin')
+    sensor_info_list, process_type_list = form_data.getlist('sensor_info'), form_data.getlist('process_type')
+    desconocidos = [pt for pt in process_type_list if pt not in resampling.PROCESS_TYPES]
+    if desconocidos:
+        raise ValueError(f"Tipo de procesamiento no soportado: {', '.join(desconocidos)}")
+    return ema_id, fecha_inicio, fecha_fin, sensor_info_list, process_type_list
+
+
+def generate_report_csv_service(db_key, form_data):
+    """Reporte grande para Excel: CSV en streaming. Devuelve (generador de bytes, nombre del archivo)."""
+    return _csv_reporte(db_key, *_args_reporte(form_data)), _nombre_reporte(form_data, 'csv')
+
+
+def generate_report_job_service(db_key, form_data, usuario, filas_estimadas=None):
+    """Reporte muy grande: CSV comprimido generado en segundo plano (app/report_jobs.py)."""
+    from . import report_jobs
+    args = _args_reporte(form_data)
+    ema_id, fecha_inicio, fecha_fin, sensor_info_list, _ = args
+    descripcion = (
+        f"{get_db_display_name(db_key)} - EMA {ema_id} - {fecha_inicio} al {fecha_fin} "
+        f"({', '.join(sorted({s.split('|')[2] for s in sensor_info_list}))})"
+    )
+    return report_jobs.encolar(usuario, descripcion, _nombre_reporte(form_data, 'csv'), lambda: _csv_reporte(db_key, *args), filas_estimadas)
+
+
+def _procesos_para_sensor(sensor, process_type_list):
+    """Los acumulados (suma, lluvia móvil) solo tienen sentido en pluviómetros."""
+    from . import resampling
+    es_pluvio = 'pluvio' in f"{sensor.get('table_name', '')} {sensor.get('search_text', '')}".lower()
+    return [
+        pt for pt in process_type_list
+        if es_pluvio or not (resampling.PROCESS_TYPES[pt]['funcion'] == 'sum' or resampling.PROCESS_TYPES[pt].get('ventanas_moviles'))
+    ]
+
+
+def generate_report_bundle_service(db_key, form_data):
+    """
+    Paquete mensual: un Excel por estación dentro de un ZIP (app/report_bundle.py).
+    Cada estación lleva todos sus sensores con los procesamientos que le corresponden.
+    Devuelve (generador de bytes del ZIP, nombre del archivo).
+    """
+    from . import resampling, report_bundle
+    fecha_inicio = form_data.get('fecha_inicio')
+    fecha_fin = form_data.get('fecha_fin')
+    process_type_list = form_data.getlist('process_type')
+    if not fecha_inicio or not fecha_fin or not process_type_list:
+        raise ValueError("Faltan las fechas o los tipos de procesamiento.")
+    desconocidos = [pt for pt in process_type_list if pt not in resampling.PROCESS_TYPES]
+    if desconocidos:
+        raise ValueError(f"Tipo de procesamiento no soportado: {', '.join(desconocidos)}")
+
+    nombres = dict(get_repo_for_db(db_key).get_ema_list_repo(db_key))
+    pedidas = form_data.getlist('ema_id')
+    if not pedidas or 'todas' in pedidas:
+        ema_ids = sorted(int(e) for e in nombres)
+    else:
+        ema_ids = sorted({int(e) for e in pedidas})
+
+    estaciones = []
+    for ema_id in ema_ids:
+        sensor_info_list, procesos = [], []
+        for sensor in get_sensors_for_ema_service(db_key, ema_id):
+            for pt in _procesos_para_sensor(sensor, process_type_list):
+                sensor_info_list.append(f"{sensor['id']}|{sensor['table_name']}|{sensor['nombre']}")
+                procesos.append(pt)
+        estaciones.append((ema_id, nombres.get(ema_id, f"EMA {ema_id}"), sensor_info_list, procesos))
+
+    nombre = f"reportes_por_estacion_{fecha_inicio}_al_{fecha_fin}.zip"
+    return report_bundle.generar_zip(db_key, estaciones, fecha_inicio, fecha_fin), nombre
+
+
+def _generate_report_multi_db(db_keys, form_data):
+    import pandas as pd
+    from . import excel_export
+    resultados, errores = fan_out(
+        db_keys, lambda k: normalizar_reporte_df(_generate_report_df(k, FormularioPorDB(form_data, k)), k)
+    )
+    if not resultados:
+        raise Exception("Ninguna base de datos respondió: " + "; ".join(f"{k}: {v}" for k, v in errores.items()))
+
+    # Respetamos el orden pedido, no el orden de llegada
+    df = pd.concat([resultados[k] for k in db_keys if k in resultados], ignore_index=True)
+    errores_display = {get_db_display_name(k): v for k, v in errores.items()}
+    output_excel = excel_export.create_excel_from_dataframe(df, errores=errores_display)
+
+    fecha_i = form_data.get("fecha_inicio", "inicio")
+    fecha_f = form_data.get("fecha_fin", "fin")
+    nombre_archivo = f'reporte_multi_BD_{fecha_i}_al_{fecha_f}.xlsx'
+    return output_excel.getvalue(), nombre_archivo
+
 def get_sensors_for_ema_service(db_key, ema_id):
+    # Usuario restringido: sin sensores de batería
+    incluir_restringidos = not (current_user.is_authenticated and current_user.role == 'restricted')
+    return listar_sensores(db_key, ema_id, incluir_restringidos)
+
+def listar_sensores(db_key, ema_id, incluir_restringidos=True):
+    # Con el índice armado, la lista sale de memoria (sin ir a la BD)
+    indice = G_SENSOR_INDEX.get(db_key)
+    if indice is not None:
+        _completar_fechas(db_key, indice, ema_id)
+        return indice.listar(ema_id, incluir_restringidos)
+
     repo = get_repo_for_db(db_key)
     todos_los_sensores = repo.get_sensors_for_ema_repo(db_key, G_SENSOR_CACHE, ema_id)
-    
-    # === FILTRO DE BATERÍA PARA USUARIO RESTRINGIDO (MEJORADO) ===
-    if current_user.is_authenticated and current_user.role == 'restricted':
-        sensores_filtrados = []
-        
-        # Palabras que queremos ocultar
-        palabras_prohibidas = ['bateria', 'Bateria', '_Bateria', '_bateria']
-        
-        for s in todos_los_sensores:
-            # 1. Revisamos el nombre técnico de la tabla (ej: 'medicion_bateria')
-            nombre_tabla = s.get('table_name', '').lower()
-            
-            # 2. Revisamos el texto visible (ej: 'Sensor de Tensión 12V')
-            texto_busqueda = s.get('search_text', '').lower()
-            
-            es_bateria = False
-            
-            # Si la tabla contiene 'bateria', es batería seguro -> Ocultar
-            if 'bateria' in nombre_tabla:
-                es_bateria = True
-            
-            # Si el nombre visible tiene alguna palabra prohibida -> Ocultar
-            if any(palabra in texto_busqueda for palabra in palabras_prohibidas):
-                es_bateria = True
-            
-            # Solo lo agregamos a la lista si NO es batería
-            if not es_bateria:
-                sensores_filtrados.append(s)
-                
-        return sensores_filtrados
-    # =============================================================
-    
-    return todos_los_sensores
+    if incluir_restringidos:
+        return todos_los_sensores
+    return [s for s in todos_los_sensores if not es_sensor_restringido(s.get('table_name', ''), s.get('search_text', ''))]
+
+def _completar_fechas(db_key, indice, ema_id):
+    """
+    Primeras fechas que el índice dejó pendientes: se consultan la primera vez que se pide
+    la EMA (una vez por proceso) y quedan guardadas. Si falla, se muestra "N/A".
+    """
+    if ema_id == 'todas': return
+    try:
+        pendientes = indice.fechas_pendientes(ema_id)
+    except ValueError:
+        return
+    if not pendientes: return
+    repo = get_repo_for_db(db_key)
+    try:
+        fechas = single_flight.ejecutar(
+            ('primeras_fechas', db_key, int(ema_id)),
+            lambda: repo.primeras_fechas_repo(db_key, int(ema_id), pendientes),
+        )
+    except Exception as e:
+        print(f"⚠️ Primeras fechas de la EMA {ema_id} ({db_key}): {e}")
+        return
+    indice.poner_fechas(ema_id, fechas)
+
 
 def get_ema_list_service(db_key):
     """
@@ -138,9 +652,188 @@ def get_ema_list_service(db_key):
         
     return emas_display_list
 
+def _por_db(valor, db_key):
+    """En fan-out, ema_id / sensor_info_list pueden venir como dict por db_key."""
+    return valor.get(db_key) if isinstance(valor, dict) else valor
+
+
+def _instante(label):
+    """Etiqueta del eje X ('YYYY-MM-DD' o 'YYYY-MM-DD HH:MM') como datetime para ordenar."""
+    try:
+        return datetime.fromisoformat(label)
+    except (TypeError, ValueError):
+        return None
+
+
+def _unir_graficos_por_db(db_keys, charts_por_db):
+    """
+    Une los gráficos del mismo sensor y procesamiento de cada BD en uno solo: eje X común
+    (unión de etiquetas, ordenadas como fechas) y un dataset por BD. Un gráfico que solo
+    existe en una BD queda tal cual (con su única fuente).
+    """
+    grupos = {}   # (sensor, procesamiento) -> [(db_key, chart)], en orden de aparición
+    for db_key in db_keys:
+        for i, chart in enumerate(charts_por_db.get(db_key, [])):
+            clave = (str(chart.get('sensor', '')).lower(), chart.get('process_type')) if 'sensor' in chart else ('#', i)
+            grupos.setdefault(clave, []).append((db_key, chart))
+
+    unidos = []
+    for grupo in grupos.values():
+        # Misma fecha con distinto texto en cada BD cuenta una sola vez
+        por_instante = {}
+        for _, chart in grupo:
+            for l in chart['labels']:
+                por_instante.setdefault(_instante(l) or l, l)
+        if all(isinstance(k, datetime) for k in por_instante):
+            labels = [por_instante[k] for k in sorted(por_instante)]
+        else:
+            labels = sorted(set(por_instante.values()))
+        base = dict(grupo[0][1])
+        datasets = []
+        for n, (db_key, chart) in enumerate(grupo):
+            color = FAN_OUT_COLORS[n % len(FAN_OUT_COLORS)]
+            for ds in chart['datasets']:
+                valores = {por_instante[_instante(l) or l]: v for l, v in zip(chart['labels'], ds['data'])}
+                ds = dict(ds, label=f"[{get_db_display_name(db_key)}] {ds['label']}", data=[valores.get(l) for l in labels])
+                if color:
+                    ds['backgroundColor'] = color['bg']; ds['borderColor'] = color['border']
+                datasets.append(ds)
+        base.update(labels=labels, datasets=datasets, sources=[k for k, _ in grupo])
+        unidos.append(base)
+    return unidos
+
+
+def _tipo_de_grafico(sensor_info_str):
+    """(tipo de procesamiento, tipo de gráfico, etiqueta) según el sensor."""
+    search_text = sensor_info_str.lower()
+    if 'pluvio' in search_text:
+        return 'pluvio_sum', 'bar', 'Lluvia Acumulada Diaria (mm)'
+    elif 'limni' in search_text or 'freati' in search_text:
+        return 'nivel_max', 'line', 'Nivel Máximo Diario (m)'
+    elif 'anemo' in search_text or 'temp' in search_text:
+        return 'avg_hourly', 'line', 'Promedio por Hora'
+    elif 'bateria' in search_text:
+        return 'raw', 'line', 'Voltaje Batería (V)'
+    elif 'presion' in search_text:
+        return 'raw', 'line', 'Presión (hPa)'
+    return 'avg_hourly', 'line', 'Promedio por Hora'
+
+
+# --- Comparación de varias EMAs en un mismo gráfico ---
+COMPARACION_COLORS = [
+    {'bg': 'rgba(54, 162, 235, 0.6)', 'border': 'rgba(54, 162, 235, 1)'},
+    {'bg': 'rgba(255, 99, 132, 0.6)', 'border': 'rgba(255, 99, 132, 1)'},
+    {'bg': 'rgba(75, 192, 192, 0.6)', 'border': 'rgba(75, 192, 192, 1)'},
+    {'bg': 'rgba(255, 159, 64, 0.6)', 'border': 'rgba(255, 159, 64, 1)'},
+    {'bg': 'rgba(153, 102, 255, 0.6)', 'border': 'rgba(153, 102, 255, 1)'},
+    {'bg': 'rgba(201, 203, 207, 0.6)', 'border': 'rgba(201, 203, 207, 1)'},
+    {'bg': 'rgba(255, 205, 86, 0.6)', 'border': 'rgba(255, 205, 86, 1)'},
+]
+_FRECUENCIA_PANDAS = {'1D': 'D', '1h': 'h'}
+
+
+def _ids_por_ema(db_key, ema_ids, sensor_info_str):
+    """
+    Resuelve el sensor en cada EMA por nombre (índice de sensores ∩ sensores activos de la EMA).
+    Sin índice, se usa el mismo id para todas (en SQL Server el id es el tipo de sensor).
+    """
+    sensor_id, _, sensor_name = sensor_info_str.split('|')
+    indice = G_SENSOR_INDEX.get(db_key)
+    db_cache = G_SENSOR_CACHE.get(db_key) or {}
+    if indice is None:
+        return {ema: [int(sensor_id)] for ema in ema_ids}
+    ids_nombre = indice.ids_para_nombre(sensor_name)
+    resueltos = {ema: sorted(ids_nombre.intersection(db_cache.get(ema, []))) for ema in ema_ids}
+    return {ema: ids for ema, ids in resueltos.items() if ids}
+
+
+def get_multi_station_chart_service(db_key, ema_ids, sensor_info_list, fecha_inicio, fecha_fin):
+    """
+    Un gráfico por sensor con un dataset por EMA.
+    UNA consulta por sensor para todas las EMAs; la agregación y la alineación
+    (eje X común) se hacen con pandas sobre todas las estaciones a la vez.
+    """
+    import pandas as pd
+    from . import resampling
+    repo = get_repo_for_db(db_key)
+    ema_ids = [int(e) for e in ema_ids]
+    charts = []
+    for sensor_info_str in sensor_info_list:
+        process_type, chart_type, label_base = _tipo_de_grafico(sensor_info_str)
+        sensor_name = sensor_info_str.split('|')[2]
+        ids_por_ema = _ids_por_ema(db_key, ema_ids, sensor_info_str)
+        if not ids_por_ema: continue
+        datos = repo.fetch_multi_station_series_repo(db_key, ids_por_ema, sensor_info_str, fecha_inicio, fecha_fin)
+
+        df = pd.DataFrame(datos['filas'], columns=['ema_id', 'tiempo', 'valor'])
+        df['valor'] = pd.to_numeric(df['valor'], errors='coerce')
+        df['tiempo'] = pd.to_datetime(df['tiempo'])
+        df = df.dropna()
+        if df.empty: continue
+
+        tipo = resampling.PROCESS_TYPES[process_type]
+        if tipo['ancho'] is None:
+            # Crudo: cada EMA en su tiempo (si hay repetidos, el último)
+            tabla = df.drop_duplicates(['ema_id', 'tiempo'], keep='last').pivot(index='tiempo', columns='ema_id', values='valor')
+        else:
+            frecuencia = _FRECUENCIA_PANDAS[tipo['ancho']]
+            df['bucket'] = df['tiempo'].dt.floor(frecuencia)
+            funcion = tipo['funcion']
+            agrupado = df.groupby(['ema_id', 'bucket'])['valor'].agg(sorted({funcion, 'max'}))
+            valores = agrupado[funcion]
+            if funcion == 'sum':
+                # Regla Areco: en los contadores acumulados el total del bucket es el máximo
+                contadores = [e for e, info in datos['estaciones'].items() if info.get('contador_acumulado')]
+                es_contador = agrupado.index.get_level_values('ema_id').isin(contadores)
+                valores = valores.where(~es_contador, agrupado['max'])
+            tabla = valores.unstack('ema_id')
+            # Eje común: todos los buckets del rango, aunque alguna EMA no tenga datos
+            tabla = tabla.reindex(pd.date_range(tabla.index.min(), tabla.index.max(), freq=frecuencia))
+            if funcion == 'mean': tabla = tabla.round(3)
+
+        formato = '%Y-%m-%d' if tipo['columna'] == 'dia' else '%Y-%m-%d %H:%M'
+        tabla = tabla.astype(object).where(tabla.notnull(), None)
+        datasets = []
+        for n, ema in enumerate(e for e in ema_ids if e in tabla.columns):
+            color = COMPARACION_COLORS[n % len(COMPARACION_COLORS)]
+            nombre_ema = datos['estaciones'].get(ema, {}).get('nombre_ema') or f"EMA {ema}"
+            datasets.append({
+                'label': f"{nombre_ema} - {sensor_name}", 'data': tabla[ema].tolist(), 'ema_id': ema,
+                'backgroundColor': color['bg'], 'borderColor': color['border'], 'borderWidth': 1, 'spanGaps': True
+            })
+        charts.append({
+            'chart_type': chart_type, 'labels': tabla.index.strftime(formato).tolist(), 'datasets': datasets,
+            'sensor': sensor_name, 'process_type': process_type,
+            'options': {
+                'responsive': True, 'maintainAspectRatio': False,
+                'scales': {'x': {'title': {'display': True, 'text': 'Fecha'}}, 'y': {'title': {'display': True, 'text': label_base}, 'beginAtZero': chart_type == 'bar'}},
+                'plugins': {'tooltip': {'mode': 'index', 'intersect': False}, 'title': {'display': True, 'text': f"{sensor_name} - {label_base} ({len(datasets)} EMAs)"}}
+            }
+        })
+    return charts
+
+
 def get_chart_data_service(db_key, ema_id, sensor_info_list, fecha_inicio, fecha_fin, combine=False):
+    import pandas as pd
     
-    repo = get_repo_for_db(db_key)
+    from . import resampling
+    if isinstance(db_key, (list, tuple)):
+        db_keys = list(db_key)
+        charts_por_db, errores = fan_out(db_keys, lambda k: get_chart_data_service(
+            k, _por_db(ema_id, k), _por_db(sensor_info_list, k), fecha_inicio, fecha_fin, combine
+        ))
+        if not charts_por_db:
+            raise Exception("Ninguna base de datos respondió: " + "; ".join(f"{k}: {v}" for k, v in errores.items()))
+        # Las BDs caídas se informan como entradas con 'error' (el front las muestra como aviso)
+        return _unir_graficos_por_db(db_keys, charts_por_db) + [
+            {'source': k, 'error': f"{get_db_display_name(k)} no disponible: {v}"} for k, v in errores.items()
+        ]
+
+    # Varias EMAs: un gráfico comparativo por sensor
+    if isinstance(ema_id, (list, tuple)):
+        if len(ema_id) > 1:
+            return get_multi_station_chart_service(db_key, ema_id, sensor_info_list, fecha_inicio, fecha_fin)
+        ema_id = ema_id[0]
 
     is_valid_combination = False
     if combine:
@@ -175,14 +868,7 @@ def get_chart_data_service(db_key, ema_id, sensor_info_list, fecha_inicio, fecha
                 chart_type = 'line'
                 label = f"{sensor_name} (m)"
 
-            df = repo.generate_report_repo(
-                db_key=db_key, 
-                ema_id_form=ema_id,
-                fecha_inicio_str=fecha_inicio,
-                fecha_fin_str=fecha_fin,
-                sensor_info_list=[sensor_info_str],
-                process_type_list=[process_type]
-            )
+            df = fetch_report_df(db_key, ema_id, fecha_inicio, fecha_fin, [sensor_info_str], [process_type])
             
             if not df.empty and 'valor' in df.columns:
                 df.rename(columns={'valor': sensor_name}, inplace=True)
@@ -227,6 +913,7 @@ def get_chart_data_service(db_key, ema_id, sensor_info_list, fecha_inicio, fecha
             final_chart_type = 'bar' 
             return [{
                 'chart_type': final_chart_type, 'labels': labels, 'datasets': final_datasets,
+                'sensor': 'combinado', 'process_type': 'pluvio_sum+nivel_max',
                 'options': { 
                     'responsive': True, 'maintainAspectRatio': False, 'scales': final_scales, 
                     'plugins': {
@@ -240,31 +927,7 @@ def get_chart_data_service(db_key, ema_id, sensor_info_list, fecha_inicio, fecha
         print(f"Generando gráficos separados para {db_key}...")
         all_charts_data = []
         for sensor_info_str in sensor_info_list:
-            process_type = 'avg_hourly'
-            chart_type = 'line' 
-            label_base = 'Promedio por Hora'
-            
-            search_text = sensor_info_str.lower()
-            if 'pluvio' in search_text:
-                process_type = 'pluvio_sum' 
-                chart_type = 'bar'
-                label_base = 'Lluvia Acumulada Diaria (mm)'
-            elif 'limni' in search_text or 'freati' in search_text:
-                process_type = 'nivel_max' 
-                chart_type = 'line'
-                label_base = 'Nivel Máximo Diario (m)'
-            elif 'anemo' in search_text or 'temp' in search_text:
-                process_type = 'avg_hourly' 
-                chart_type = 'line'
-                label_base = 'Promedio por Hora'
-            elif 'bateria' in search_text:
-                process_type = 'raw' 
-                chart_type = 'line'
-                label_base = 'Voltaje Batería (V)'
-            elif 'presion' in search_text:
-                process_type = 'raw' 
-                chart_type = 'line'
-                label_base = 'Presión (hPa)'
+            process_type, chart_type, label_base = _tipo_de_grafico(sensor_info_str)
 
             try:
                 sensor_name = sensor_info_str.split('|')[2]
@@ -272,39 +935,177 @@ def get_chart_data_service(db_key, ema_id, sensor_info_list, fecha_inicio, fecha
             except:
                 label = label_base
             
-            df = repo.generate_report_repo(
-                db_key=db_key, 
-                ema_id_form=ema_id,
-                fecha_inicio_str=fecha_inicio,
-                fecha_fin_str=fecha_fin,
-                sensor_info_list=[sensor_info_str],
-                process_type_list=[process_type]
-            )
+            df = fetch_report_df(db_key, ema_id, fecha_inicio, fecha_fin, [sensor_info_str], [process_type])
             labels = []
             data = []
             if process_type == 'pluvio_sum' or process_type == 'nivel_max':
                 if not df.empty and 'dia' in df.columns:
                     labels = pd.to_datetime(df['dia']).dt.strftime('%Y-%m-%d').tolist()
-                    data = df['valor'].tolist()
+                    data = resampling.a_float64(df['valor']).tolist()
             else: 
                 if not df.empty and ('hora' in df.columns and df['hora'].notnull().any()):
                     labels = pd.to_datetime(df['hora']).dt.strftime('%Y-%m-%d %H:%M').tolist()
-                    data = df['valor'].tolist()
+                    data = resampling.a_float64(df['valor']).tolist()
                 elif not df.empty and 'tiempo_de_medicion' in df.columns:
                      labels = pd.to_datetime(df['tiempo_de_medicion']).dt.strftime('%Y-%m-%d %H:%M').tolist()
-                     data = df['valor'].tolist()
+                     data = resampling.a_float64(df['valor']).tolist()
 
             bg_color = 'rgba(54, 162, 235, 0.6)' if chart_type == 'bar' else 'rgba(255, 99, 132, 0.6)'
             border_color = 'rgba(54, 162, 235, 1)' if chart_type == 'bar' else 'rgba(255, 99, 132, 1)'
-            all_charts_data.append({
+            chart = {
                 'chart_type': chart_type, 'labels': labels,
+                'sensor': sensor_info_str.split('|')[-1], 'process_type': process_type,
                 'datasets': [{'label': label, 'data': data,
                     'backgroundColor': bg_color, 'borderColor': border_color, 'borderWidth': 1
                 }]
-            })
+            }
+            # Una EMA puntual: el front puede hacer zoom pidiendo tramos a /api/chart-tiles
+            if ema_id != 'todas':
+                chart['zoom'] = {'db_key': db_key, 'ema_id': ema_id, 'sensor_info': sensor_info_str}
+            all_charts_data.append(chart)
         return all_charts_data
 
 
+def _etiquetas(tiempos, columna):
+    """datetime64 -> etiquetas del eje X, con el mismo formato que get_chart_data_service."""
+    import numpy as np
+    unidad = 'D' if columna == 'dia' else 'm'
+    return [t.replace('T', ' ') for t in np.datetime_as_string(tiempos, unit=unidad)]
+
+
+def get_chart_updates_service(db_key, ema_id, sensor_info_list, since_list, fecha_fin):
+    """
+    Refresco incremental de los gráficos separados de una EMA ('since' en /api/get-chart-data).
+    'since_list' trae, por sensor, la última etiqueta que tiene el cliente. Solo se vuelve a
+    agregar desde el bucket de esa etiqueta (el día en pluvio_sum, la hora en avg_hourly):
+    el cliente reemplaza sus puntos desde 'desde' y agrega los que siguen.
+    """
+    import numpy as np
+    from . import resampling
+    repo = get_repo_for_db(db_key)
+    fin = np.datetime64(fecha_fin, 'D') + np.timedelta64(1, 'D')
+    charts = []
+    for sensor_info_str, since in zip(sensor_info_list, since_list):
+        process_type, _, _ = _tipo_de_grafico(sensor_info_str)
+        tipo = resampling.PROCESS_TYPES[process_type]
+        desde = resampling.inicio_de_bucket(np.datetime64(since.strip().replace(' ', 'T')), tipo['ancho'])
+        tiempos, valores = np.array([], dtype='datetime64[ns]'), np.array([], dtype='float64')
+        if desde < fin:
+            # Sin caché de resultados (importa justo lo que acaba de llegar), pero las pestañas
+            # abiertas piden lo mismo cada minuto: una sola consulta para todas
+            dia_desde = str(desde.astype('datetime64[D]'))
+            serie = single_flight.ejecutar(
+                ('serie_reciente', db_key, int(ema_id), sensor_info_str, dia_desde, fecha_fin),
+                lambda: repo.fetch_raw_series_repo(db_key, ema_id, sensor_info_str, dia_desde, fecha_fin),
+            )
+            timestamps, vals = _arrays_de_serie(serie)
+            nuevos = timestamps >= desde
+            tiempos, valores = timestamps[nuevos], vals[nuevos]
+            if tipo['ancho'] is not None:
+                spec = _spec_resampling(process_type, serie)
+                tiempos, valores = resampling.resample(tiempos, valores, {spec})[spec]
+                if spec[1] == 'mean': valores = np.round(valores, 3)
+        labels = _etiquetas(tiempos, tipo['columna'])
+        charts.append({
+            'desde': _etiquetas(np.array([desde]), tipo['columna'])[0],
+            'labels': labels, 'data': valores.tolist(),
+            'cursor': labels[-1] if labels else since,
+        })
+    return {'incremental': True, 'charts': charts}
+
+
+# --- Gráficos con zoom (pirámides min/max, app/chart_pyramid.py) ---
+# Sin fecha de inicio en el índice, la historia de la pirámide arranca este tanto atrás
+PIRAMIDE_HISTORIA_DIAS = getattr(config, 'PIRAMIDE_HISTORIA_DIAS', 365)
+
+
+def _fecha_inicio_historia(db_key, ema_id, sensor_info):
+    sensor_id = sensor_info.split('|')[0]
+    indice = G_SENSOR_INDEX.get(db_key)
+    if indice is not None:
+        _completar_fechas(db_key, indice, ema_id)
+        for sensor in indice.por_ema.get(int(ema_id), []):
+            if str(sensor['id']) == sensor_id and sensor['fecha_inicio'] not in (None, "N/A"):
+                return sensor['fecha_inicio']
+    return (datetime.now() - timedelta(days=PIRAMIDE_HISTORIA_DIAS)).strftime('%Y-%m-%d')
+
+
+def get_chart_tile_service(db_key, ema_id, sensor_info, desde_ms, hasta_ms, ancho_px):
+    """
+    Tramo de gráfico para el zoom: min/max/promedio del nivel de la pirámide que
+    entra en 'ancho_px' puntos para el rango [desde_ms, hasta_ms] (epoch en ms).
+    """
+    import numpy as np
+    from . import chart_pyramid
+    repo = get_repo_for_db(db_key)
+
+    def fetch_serie(fecha_inicio, fecha_fin):
+        return _arrays_de_serie(repo.fetch_raw_series_repo(db_key, ema_id, sensor_info, fecha_inicio, fecha_fin))
+
+    piramide = chart_pyramid.obtener(
+        (db_key, int(ema_id), sensor_info), _fecha_inicio_historia(db_key, ema_id, sensor_info), fetch_serie
+    )
+    desde = np.datetime64(int(desde_ms), 'ms').astype('datetime64[ns]')
+    hasta = np.datetime64(int(hasta_ms), 'ms').astype('datetime64[ns]')
+    with piramide.lock:
+        nombre, nivel, i0, i1 = piramide.ventana(desde, hasta, max(int(ancho_px), 1))
+        crudo = piramide.niveles['crudo'].t
+        historia = chart_pyramid.a_milisegundos(crudo[[0, -1]]) if len(crudo) else []
+        promedio = np.round(nivel.suma[i0:i1] / nivel.cantidad[i0:i1], 3)
+        return {
+            'nivel': nombre,
+            'x': chart_pyramid.a_milisegundos(nivel.t[i0:i1]),
+            'min': nivel.min[i0:i1].tolist(),
+            'max': nivel.max[i0:i1].tolist(),
+            'mean': promedio.tolist(),
+            'sum': nivel.suma[i0:i1].tolist(),
+            'historia': historia,
+        }
+
+
+# --- Analítica de lluvia (ventanas móviles, app/rainfall.py) ---
+def get_rainfall_analytics_service(db_key, ema_ids, fecha_inicio, fecha_fin):
+    """
+    Acumulados máximos en ventanas móviles (1h/3h/6h/24h/72h) e intensidad máxima,
+    para todas las estaciones pedidas (o todas si 'ema_ids' está vacío) en una sola pasada.
+    Los períodos ya cerrados (fecha_fin anterior a hoy) quedan cacheados.
+    """
+    import numpy as np
+    from . import rainfall
+    ema_ids = sorted({int(e) for e in ema_ids or []})
+    cerrado = fecha_fin < datetime.now().strftime('%Y-%m-%d')
+
+    def calcular():
+        repo = get_repo_for_db(db_key)
+        margen = (datetime.strptime(fecha_inicio, '%Y-%m-%d') - timedelta(seconds=rainfall.MARGEN_SEGUNDOS)).strftime('%Y-%m-%d')
+        datos = repo.fetch_rain_series_repo(db_key, ema_ids or None, margen, fecha_fin)
+        if not datos['filas']: return []
+
+        emas, sensores, tiempos, valores = zip(*datos['filas'])
+        emas = np.array(emas, dtype='int64'); sensores = np.array(sensores, dtype='int64')
+        tiempos = np.array(tiempos, dtype='datetime64[ns]')
+        valores = np.array([np.nan if v is None else float(v) for v in valores], dtype='float64')
+        validos = ~np.isnat(tiempos) & ~np.isnan(valores)
+        emas, sensores, tiempos, valores = emas[validos], sensores[validos], tiempos[validos], valores[validos]
+        if not len(tiempos): return []
+
+        # Un grupo por (ema, sensor): las filas ya vienen ordenadas por (ema, sensor, tiempo)
+        nuevo = np.r_[True, (emas[1:] != emas[:-1]) | (sensores[1:] != sensores[:-1])]
+        grupos = np.cumsum(nuevo) - 1
+        inicios = np.flatnonzero(nuevo)
+        estaciones = datos['estaciones']
+        contador = [estaciones.get(int(emas[i]), {}).get('contador_acumulado', False) for i in inicios]
+
+        resumen = rainfall.analizar_lote(grupos, tiempos, valores, contador, np.datetime64(fecha_inicio, 'ns'))
+        return [
+            dict(r, ema_id=int(emas[i]), sensor_id=int(sensores[i]),
+                 nombre_ema=estaciones.get(int(emas[i]), {}).get('nombre_ema'), contador_acumulado=bool(contador[g]))
+            for g, (i, r) in enumerate(zip(inicios, resumen))
+        ]
+
+    return rainfall.obtener_cacheado((db_key, tuple(ema_ids), fecha_inicio, fecha_fin), calcular, cerrado)
+
+
 def get_ema_locations_service(db_key):
     """
     Servicio para buscar las locaciones de las EMAs.
@@ -337,10 +1138,11 @@ def get_ema_live_summary_service(db_key, ema_id):
 
     return formatted_data
 
-def get_dashboard_data_service(db_key, ema_id):
-    repo = get_repo_for_db(db_key)
-    raw_data = repo.get_dashboard_data_repo(db_key, ema_id)
-    
+def format_dashboard_data(raw_data, incluir_bateria):
+    """
+    Formatea los datos crudos del dashboard.
+    'incluir_bateria' es False para el rol 'restricted'.
+    """
     formatted_data = {}
     
     def format_timestamp(ts):
@@ -370,7 +1172,7 @@ def get_dashboard_data_service(db_key, ema_id):
 
     # === FILTRO DE BATERÍA (DASHBOARD) ===
     # Solo agregamos la batería al diccionario si NO es restringido
-    if current_user.is_authenticated and current_user.role != 'restricted':
+    if incluir_bateria:
         if raw_data.get('bateria'):
             v = raw_data['bateria']['valor']
             formatted_data['bateria'] = {
@@ -382,24 +1184,138 @@ def get_dashboard_data_service(db_key, ema_id):
 
     return formatted_data
 
+def _puede_ver_bateria():
+    return current_user.is_authenticated and current_user.role != 'restricted'
+
+def get_dashboard_data_service(db_key, ema_id):
+    raw_data = fetch_dashboard_raw(db_key, ema_id)
+    return format_dashboard_data(raw_data, _puede_ver_bateria())
+
+
+def stream_dashboard_service(db_key, ema_id):
+    """
+    Generador de eventos SSE para el dashboard de una EMA.
+    Todas las pestañas de la misma (db_key, ema_id) comparten un único poller
+    (app/live_stream.py); acá solo se formatea según el rol de ESTE usuario.
+    """
+    from . import live_stream
+    repo = get_repo_for_db(db_key)
+    incluir_bateria = _puede_ver_bateria()
+    cola = live_stream.suscribir(db_key, ema_id, repo.get_latest_measurement_ts_repo, repo.get_dashboard_data_repo)
+
+    def eventos():
+        try:
+            yield "retry: 10000\n\n"
+            while True:
+                try:
+                    raw_data = cola.get(timeout=LIVE_HEARTBEAT_SECONDS)
+                except Empty:
+                    # Comentario SSE: mantiene viva la conexión y detecta clientes que se fueron
+                    yield ": ping\n\n"
+                    continue
+                payload = format_dashboard_data(raw_data, incluir_bateria)
+                # Mismo JSON que jsonify en /api/dashboard-data (Decimal de numeric/decimal incluido);
+                # el contexto de la app lo mantiene stream_with_context
+                yield f"data: {current_app.json.dumps(payload)}\n\n"
+        finally:
+            live_stream.desuscribir(db_key, ema_id, cola)
+
+    return eventos()
+
 
 def build_global_cache():
     """
     Construye un caché global de sensores para CADA base de datos.
     """
     print("Inicializando caché global (build_global_cache)...")
-    global G_SENSOR_CACHE
-    G_SENSOR_CACHE = {}  # Reinicia el caché en memoria
+    global G_SENSOR_CACHE, G_SENSOR_INDEX
+    # Se arma aparte y se instala al final: un refresco no deja ver un caché a medias
+    sensor_cache, sensor_index = {}, {}
 
     for db_key, db_conf in config.DATABASE_CONNECTIONS.items():
         try:
             repo = get_repo_for_db(db_key)
-            sensor_cache_para_db = repo.build_active_sensor_cache(db_key)
-            G_SENSOR_CACHE[db_key] = sensor_cache_para_db
-            print(f"✅ Caché de sensores cargado para {db_key} ({len(sensor_cache_para_db)} EMAs con sensores)")
+            indice = repo.build_sensor_index_repo(db_key)
+            sensor_index[db_key] = indice
+            sensor_cache[db_key] = indice.sensores_por_ema
+            print(f"✅ Caché de sensores cargado para {db_key} ({len(indice.sensores_por_ema)} EMAs con sensores, {len(indice.sensores)} sensores indexados)")
         
         except Exception as e:
             print(f"⚠️ Error al cargar caché de sensores para {db_key}: {e}")
-            G_SENSOR_CACHE[db_key] = {} 
-            
-    return G_SENSOR_CACHE
\ No newline at end of file
+            sensor_cache[db_key] = {} 
+
+    G_SENSOR_INDEX, G_SENSOR_CACHE = sensor_index, sensor_cache
+    return G_SENSOR_CACHE
+
+
+def _instalar_caches(datos):
+    """Instala un caché ya armado (propio o de otro worker). Reemplaza las referencias, no muta."""
+    global G_SENSOR_CACHE, G_SENSOR_INDEX
+    G_SENSOR_INDEX = datos['sensor_index']
+    G_SENSOR_CACHE = datos['sensor_cache']
+
+
+def _construir_caches():
+    build_global_cache()
+    return {'sensor_cache': G_SENSOR_CACHE, 'sensor_index': G_SENSOR_INDEX}
+
+
+def init_global_cache():
+    """
+    Arranque: con snapshot compartido (app/shared_cache.py) el caché se arma una sola vez
+    por despliegue y el resto de los workers lo cargan; sin él, cada proceso arma el suyo.
+    """
+    if not shared_cache.habilitado():
+        return build_global_cache()
+    try:
+        _instalar_caches(shared_cache.obtener_o_construir(_construir_caches))
+    except OSError as e:
+        print(f"⚠️ Snapshot de caché no disponible ({e}), se usa el caché local")
+        if not G_SENSOR_INDEX: build_global_cache()
+    return G_SENSOR_CACHE
+
+
+def sincronizar_cache_compartido():
+    """Antes de cada petición: si otro proceso publicó una versión nueva, se toma (chequeo barato)."""
+    if not shared_cache.habilitado(): return
+    try:
+        datos = shared_cache.version_nueva()
+    except OSError:
+        return
+    if datos is not None:
+        _instalar_caches(datos)
+
+
+def refresh_global_cache_service():
+    """Vuelve a escanear las BDs y publica la versión nueva para todos los workers."""
+    if not shared_cache.habilitado():
+        build_global_cache()
+        return None
+    version, datos = shared_cache.reconstruir(_construir_caches)
+    _instalar_caches(datos)
+    return version
+
+
+def get_metrics_service():
+    """
+    Métricas internas para /api/metrics (solo administradores).
+    """
+    from . import report_bundle, report_jobs, live_stream, chart_pyramid, rainfall
+    return {
+        'sentencias_preparadas': db_pool.get_statement_stats(),
+        'pool_conexiones': db_pool.get_stats(),
+        'dashboard_en_vivo': live_stream.get_stream_stats(),
+        'admision': admission.control_pesados.get_stats(),
+        'cancelaciones': cancellation.get_stats(),
+        'replicas': db_routing.get_stats(),
+        'piramides': chart_pyramid.get_stats(),
+        'lluvia': rainfall.get_stats(),
+        'cache_compartido': shared_cache.get_stats(),
+        'paquetes_reportes': report_bundle.get_stats(),
+        'cache_resultados': result_cache.get_stats(),
+        'consultas_compartidas': single_flight.get_stats(),
+        'precalentamiento': warmup.get_stats(),
+        'tramos': time_chunks.get_stats(),
+        'reportes_en_segundo_plano': report_jobs.get_stats(),
+        'disyuntores': circuit_breaker.get_stats(),
+    }
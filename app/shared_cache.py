@@ -0,0 +1,292 @@
+# app/shared_cache.py
+# Caché de sensores compartido entre workers (gunicorn con N procesos).
+#
+# build_global_cache escanea todas las BDs. Con N workers cada uno lo hacía por su cuenta,
+# y después de un refresco cada worker quedaba con una versión distinta. Ahora:
+#   - Un solo proceso construye el caché (el master con 'gunicorn --preload', o el primer
+#     worker que toma el lock) y lo publica en un archivo snapshot: cabecera + pickle.
+#   - La cabecera lleva una versión (time_ns de la publicación). Publicar es atómico:
+#     se escribe a un temporal en el mismo directorio y se reemplaza con os.replace,
+#     nadie llega a leer un snapshot a medio escribir.
+#   - Cada SENSOR_CACHE_CHECK_SECONDS los workers comparan la versión de la cabecera:
+#     si cambió, cargan la nueva y la instalan de una vez. Ningún worker vuelve a escanear
+#     las BDs. Lo que se comparte es el trabajo de construirlo, no la memoria: cada worker
+#     deserializa su propia copia completa (mmap solo evita copiar el archivo antes).
+# Seguridad: pickle ejecuta código al cargar, así que el payload va firmado con un HMAC
+# (clave: config.SECRET_KEY) y se descarta sin deserializar si la firma no coincide.
+# Por defecto el snapshot vive en instance/ del proyecto (directorio propio, 0700),
+# no en el /tmp compartido con otros usuarios.
+# Despliegue: cada arranque genera un token (uuid) que va en la cabecera; al arrancar solo se
+# reusa un snapshot con el token propio, uno de una ejecución anterior se reconstruye.
+#   - El master de --preload (o run.py) lo genera y lo pasa a sus hijos por la variable de
+#     entorno EMAS_CACHE_DESPLIEGUE.
+#   - Sin --preload lo genera el primer worker que toma el lock y lo anota en el archivo de
+#     lock junto con su padre (el master de gunicorn); los hermanos lo toman de ahí mientras
+#     quede vivo algún proceso de ese despliegue (pid + instante de arranque, no solo el pid).
+# SENSOR_CACHE_SNAPSHOT_PATH = None desactiva todo (cada proceso arma su propio caché).
+
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows (servidor de desarrollo): sin lock entre procesos
+    fcntl = None
+
+# Directorio propio de la app para archivos locales (snapshot, reportes en segundo plano)
+DIRECTORIO_PROPIO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance')
+SENSOR_CACHE_SNAPSHOT_PATH = getattr(
+    config, 'SENSOR_CACHE_SNAPSHOT_PATH', os.path.join(DIRECTORIO_PROPIO, 'emas_sensor_cache.snapshot')
+)
+SENSOR_CACHE_CHECK_SECONDS = getattr(config, 'SENSOR_CACHE_CHECK_SECONDS', 5)
+
+# magic, versión, largo del payload, token del despliegue, HMAC-SHA256
+# de (versión, largo, token, payload)
+_CABECERA = struct.Struct('<8sqq32s32s')
+_MAGIC = b'EMASNAP3'
+_DESPLIEGUE_ENV = 'EMAS_CACHE_DESPLIEGUE'
+
+_estado = {'version': None, 'ultimo_chequeo': 0.0, 'despliegue': None}
+_estado_lock = threading.Lock()
+_stats = {'construcciones': 0, 'cargas': 0, 'publicaciones': 0}
+
+
+def habilitado():
+    return bool(SENSOR_CACHE_SNAPSHOT_PATH)
+
+
+def preparar_directorio_privado(directorio):
+    """
+    Crea 'directorio' (0700). Dentro del propio (instance/) además se fuerza 0700 por si ya
+    existía más abierto. Si lo creó otro usuario (p. ej. adelantándose en un directorio
+    compartido) no se usa: PermissionError.
+    """
+    directorio = os.path.abspath(directorio)
+    os.makedirs(directorio, mode=0o700, exist_ok=True)
+    if directorio == DIRECTORIO_PROPIO or directorio.startswith(DIRECTORIO_PROPIO + os.sep):
+        os.chmod(DIRECTORIO_PROPIO, 0o700)
+        os.chmod(directorio, 0o700)
+    if hasattr(os, 'getuid') and os.stat(directorio).st_uid != os.getuid():
+        raise PermissionError(f"El directorio {directorio} pertenece a otro usuario")
+    return directorio
+
+
+def _preparar_directorio():
+    return preparar_directorio_privado(os.path.dirname(os.path.abspath(SENSOR_CACHE_SNAPSHOT_PATH)))
+
+
+def _firma(version, largo, token, payload):
+    mac = hmac.new(config.SECRET_KEY.encode(), struct.pack('<qq32s', version, largo, token), hashlib.sha256)
+    mac.update(payload)
+    return mac.digest()
+
+
+def _leer_cabecera(archivo):
+    datos = archivo.read(_CABECERA.size)
+    if len(datos) < _CABECERA.size: return None
+    magic, version, largo, token, firma = _CABECERA.unpack(datos)
+    if magic != _MAGIC: return None
+    return version, largo, token, firma
+
+
+def leer_version():
+    """Versión del snapshot publicado (solo lee la cabecera), o None si no hay."""
+    try:
+        with open(SENSOR_CACHE_SNAPSHOT_PATH, 'rb') as archivo:
+            cabecera = _leer_cabecera(archivo)
+    except OSError:
+        return None
+    return cabecera[0] if cabecera else None
+
+
+def cargar():
+    """(version, datos, token del despliegue) del snapshot publicado, o None si no hay uno válido."""
+    try:
+        with open(SENSOR_CACHE_SNAPSHOT_PATH, 'rb') as archivo:
+            cabecera = _leer_cabecera(archivo)
+            if cabecera is None: return None
+            version, largo, token, firma = cabecera
+            with mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                if len(mapa) < _CABECERA.size + largo: return None
+                vista = memoryview(mapa)[_CABECERA.size:_CABECERA.size + largo]
+                try:
+                    # Nada se deserializa sin antes verificar que lo firmó este despliegue
+                    if not hmac.compare_digest(firma, _firma(version, largo, token, vista)):
+                        print(f"⚠️ Snapshot de caché con firma inválida, se ignora ({SENSOR_CACHE_SNAPSHOT_PATH})")
+                        return None
+                    datos = pickle.loads(vista)
+                finally:
+                    vista.release()
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+        print(f"⚠️ Snapshot de caché ilegible ({SENSOR_CACHE_SNAPSHOT_PATH}): {e}")
+        return None
+    with _estado_lock: _stats['cargas'] += 1
+    return version, datos, token
+
+
+def publicar(datos):
+    """Escribe un snapshot nuevo y lo reemplaza atómicamente. Devuelve su versión."""
+    payload = pickle.dumps(datos, protocol=pickle.HIGHEST_PROTOCOL)
+    version = time.time_ns()
+    token = _estado['despliegue'] or b''
+    firma = _firma(version, len(payload), token, payload)
+    # mkstemp crea el archivo con permisos 0600
+    fd, temporal = tempfile.mkstemp(dir=_preparar_directorio(), prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as archivo:
+            archivo.write(_CABECERA.pack(_MAGIC, version, len(payload), token, firma))
+            archivo.write(payload)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, SENSOR_CACHE_SNAPSHOT_PATH)
+    except BaseException:
+        try: os.unlink(temporal)
+        except OSError: pass
+        raise
+    with _estado_lock: _stats['publicaciones'] += 1
+    return version
+
+
+@contextmanager
+def lock_construccion():
+    """
+    Un solo proceso construye a la vez; los demás esperan y cargan lo que quedó publicado.
+    Entrega el archivo de lock abierto (None sin fcntl), donde se anota el despliegue.
+    """
+    if fcntl is None:
+        yield None
+        return
+    _preparar_directorio()
+    fd = os.open(SENSOR_CACHE_SNAPSHOT_PATH + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, 'r+') as archivo:
+        fcntl.flock(archivo.fileno(), fcntl.LOCK_EX)
+        try:
+            yield archivo
+        finally:
+            fcntl.flock(archivo.fileno(), fcntl.LOCK_UN)
+
+
+def _proceso(pid):
+    """'pid:arranque' (arranque según /proc): distingue un proceso de otro que reusó el pid."""
+    try:
+        with open(f'/proc/{pid}/stat') as archivo:
+            return f"{pid}:{archivo.read().rsplit(')', 1)[1].split()[19]}"
+    except (OSError, IndexError):
+        return str(pid)
+
+
+def _vivo(proceso):
+    pid = int(proceso.split(':')[0])
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return _proceso(pid) == proceso
+
+
+def _resolver_despliegue(archivo_lock):
+    """Token del despliegue de este proceso (ver el comentario de arriba). Se llama con el lock tomado."""
+    if _estado['despliegue'] is not None: return _estado['despliegue']
+    token = os.environ.get(_DESPLIEGUE_ENV)
+    if not token and archivo_lock is not None:
+        yo, padre = _proceso(os.getpid()), _proceso(os.getppid())
+        archivo_lock.seek(0)
+        try:
+            registro = json.loads(archivo_lock.read() or '{}')
+        except ValueError:
+            registro = {}
+        vivos = [p for p in registro.get('procesos', []) if p != yo and _vivo(p)]
+        if registro.get('padre') == padre and vivos:
+            token = registro['token']
+        else:
+            token, vivos = uuid.uuid4().hex, []
+        archivo_lock.seek(0)
+        archivo_lock.truncate()
+        json.dump({'padre': padre, 'token': token, 'procesos': vivos + [yo]}, archivo_lock)
+        archivo_lock.flush()
+    token = token or uuid.uuid4().hex
+    # Los hijos (workers de --preload, el reloader de run.py) heredan el mismo despliegue
+    os.environ[_DESPLIEGUE_ENV] = token
+    _estado['despliegue'] = token.encode()[:32].ljust(32, b'\0')
+    return _estado['despliegue']
+
+
+def _de_este_despliegue(token):
+    """Uno que quedó de una ejecución anterior no se reusa: al arrancar se reconstruye."""
+    return _estado['despliegue'] is not None and hmac.compare_digest(token, _estado['despliegue'])
+
+
+def _marcar(version):
+    with _estado_lock:
+        _estado['version'] = version
+        _estado['ultimo_chequeo'] = time.monotonic()
+
+
+def obtener_o_construir(construir):
+    """
+    Arranque: carga el snapshot de este despliegue si ya existe; si no, lo construye
+    ('construir()' devuelve los datos) y lo publica. Devuelve los datos a instalar.
+    """
+    with lock_construccion() as archivo_lock:
+        _resolver_despliegue(archivo_lock)
+        publicado = cargar()
+        if publicado and _de_este_despliegue(publicado[2]):
+            version, datos, _ = publicado
+            print(f"✅ Caché de sensores cargado del snapshot compartido (versión {version})")
+        else:
+            datos = construir()
+            with _estado_lock: _stats['construcciones'] += 1
+            version = publicar(datos)
+            print(f"✅ Caché de sensores publicado en {SENSOR_CACHE_SNAPSHOT_PATH} (versión {version})")
+    _marcar(version)
+    return datos
+
+
+def reconstruir(construir):
+    """Refresco: construye y publica una versión nueva; los demás workers la toman solos."""
+    with lock_construccion() as archivo_lock:
+        _resolver_despliegue(archivo_lock)
+        datos = construir()
+        with _estado_lock: _stats['construcciones'] += 1
+        version = publicar(datos)
+    _marcar(version)
+    return version, datos
+
+
+def version_nueva():
+    """
+    Datos de una versión publicada más nueva que la instalada, o None.
+    Como mucho una lectura de cabecera cada SENSOR_CACHE_CHECK_SECONDS por proceso.
+    """
+    with _estado_lock:
+        ahora = time.monotonic()
+        if ahora - _estado['ultimo_chequeo'] < SENSOR_CACHE_CHECK_SECONDS: return None
+        _estado['ultimo_chequeo'] = ahora
+        instalada = _estado['version']
+    version = leer_version()
+    if version is None or version == instalada: return None
+    publicado = cargar()
+    # Igual que al arrancar: solo se toma lo que publicó este despliegue
+    if publicado is None or not _de_este_despliegue(publicado[2]): return None
+    _marcar(publicado[0])
+    return publicado[1]
+
+
+def get_stats():
+    with _estado_lock:
+        return dict(_stats, version=_estado['version'], ruta=SENSOR_CACHE_SNAPSHOT_PATH if habilitado() else None)
@@ -0,0 +1,91 @@
+# app/single_flight.py
+# "Single-flight": consultas idénticas al mismo tiempo se ejecutan UNA vez.
+#
+# En una tormenta decenas de usuarios piden el mismo dashboard o el mismo rango de un
+# gráfico en el mismo segundo. El caché de resultados (app/result_cache.py) no alcanza:
+# mientras la primera consulta no termina, todas las demás son un fallo y van a la BD.
+# Acá el primero que llega con una clave (el "líder") calcula; los que llegan mientras
+# tanto esperan ese mismo cálculo y se llevan su resultado.
+#
+# - Si el líder falla, todos reciben el mismo error. Excepción: si lo que falló fue que
+#   cancelaron la petición del líder, los que esperan no tienen la culpa: reintentan
+#   (uno de ellos pasa a ser el nuevo líder).
+# - Quien espera lo hace a lo sumo SINGLE_FLIGHT_TIMEOUT_SECONDS (EsperaAgotada) y deja
+#   de esperar si cancelan su propia petición.
+# - La clave no debe depender del usuario: lo que depende del rol se arma después.
+#   El resultado es compartido, no se modifica.
+
+import threading
+import time
+import config
+from . import cancellation
+
+SINGLE_FLIGHT_TIMEOUT_SECONDS = getattr(config, 'SINGLE_FLIGHT_TIMEOUT_SECONDS', 60)
+# Cada cuánto el que espera revisa si cancelaron su petición
+_INTERVALO_VERIFICACION = 0.5
+
+_en_vuelo = {}   # clave -> _Vuelo
+_lock = threading.Lock()
+_stats = {'ejecuciones': 0, 'ahorradas': 0, 'errores_compartidos': 0, 'esperas_agotadas': 0, 'reintentos': 0}
+
+
+class EsperaAgotada(TimeoutError):
+    """La consulta idéntica en curso no terminó a tiempo."""
+
+
+class _Vuelo:
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+def _esperar(vuelo, timeout):
+    limite = time.monotonic() + timeout
+    while not vuelo.listo.wait(min(_INTERVALO_VERIFICACION, max(0.0, limite - time.monotonic()))):
+        cancellation.verificar()
+        if time.monotonic() >= limite:
+            return False
+    return True
+
+
+def ejecutar(clave, calcular, timeout=None):
+    """Devuelve calcular(), compartiendo la ejecución con quienes pidan la misma clave a la vez."""
+    timeout = SINGLE_FLIGHT_TIMEOUT_SECONDS if timeout is None else timeout
+    while True:
+        with _lock:
+            vuelo = _en_vuelo.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = _en_vuelo[clave] = _Vuelo()
+                _stats['ejecuciones'] += 1
+
+        if lider:
+            try:
+                vuelo.resultado = calcular()
+                return vuelo.resultado
+            except BaseException as e:
+                vuelo.error = e
+                raise
+            finally:
+                with _lock:
+                    _en_vuelo.pop(clave, None)
+                vuelo.listo.set()
+
+        if not _esperar(vuelo, timeout):
+            with _lock: _stats['esperas_agotadas'] += 1
+            raise EsperaAgotada(f"La consulta tardó más de {timeout} s.")
+        if isinstance(vuelo.error, cancellation.ConsultaCancelada):
+            with _lock: _stats['reintentos'] += 1
+            continue
+        with _lock:
+            _stats['ahorradas'] += 1
+            if vuelo.error is not None: _stats['errores_compartidos'] += 1
+        if vuelo.error is not None:
+            raise vuelo.error
+        return vuelo.resultado
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats, en_vuelo=len(_en_vuelo))
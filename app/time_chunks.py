@@ -0,0 +1,160 @@
+# app/time_chunks.py
+# Consultas de rango largo partidas en tramos de tiempo.
+#
+# Un año crudo de dbo.DatosUTR o master.medicion_* como UNA sentencia usa un solo núcleo
+# de la BD y no devuelve nada hasta terminar. Acá el rango [desde, hasta) se parte en
+# tramos (por mes, por semana o cada N días) que se consultan en paralelo, cada uno con
+# su conexión del pool. Cada tramo ya viene ordenado por tiempo y los tramos no se pisan:
+# juntarlos en orden da el resultado ordenado, sin re-ordenar filas.
+#
+# Cada tramo terminado se avisa a quien esté escuchando (reportar_progreso): exportaciones
+# en streaming y trabajos en segundo plano pueden mostrar el avance.
+#
+# Todas las consultas en paralelo del proceso (tramos, estaciones de 'todas') corren en UN
+# ejecutor compartido de CONSULTAS_MAX_WORKERS hilos (en_paralelo), no en uno nuevo por
+# llamada: los paralelismos anidados no multiplican hilos. Cada llamada sigue limitada a
+# su propio máximo de tareas en vuelo.
+
+import contextvars
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import config
+from . import cancellation
+
+# 'mes', 'semana' o una cantidad de días
+REPORT_TRAMO = getattr(config, 'REPORT_TRAMO', 'mes')
+# Rangos de hasta estos días van en una sola consulta (partir no compensa)
+REPORT_TRAMO_MIN_DIAS = getattr(config, 'REPORT_TRAMO_MIN_DIAS', 62)
+REPORT_TRAMO_MAX_WORKERS = getattr(config, 'REPORT_TRAMO_MAX_WORKERS', 4)
+# Hilos del ejecutor compartido por todas las consultas en paralelo del proceso
+CONSULTAS_MAX_WORKERS = getattr(config, 'CONSULTAS_MAX_WORKERS', 16)
+
+_escucha_progreso = contextvars.ContextVar('escucha_progreso', default=None)
+_stats = {'consultas': 0, 'consultas_partidas': 0, 'tramos': 0}
+_stats_lock = threading.Lock()
+
+_ejecutor = None
+_ejecutor_lock = threading.Lock()
+_hilo = threading.local()   # marca los hilos del ejecutor compartido
+
+
+def _siguiente(fecha, tramo):
+    if tramo == 'mes':
+        return (fecha.replace(day=1) + timedelta(days=32)).replace(day=1)
+    if tramo == 'semana':
+        return fecha + timedelta(days=7)
+    return fecha + timedelta(days=max(1, int(tramo)))
+
+
+def partir(desde, hasta, tramo=None):
+    """[desde, hasta) ('YYYY-MM-DD', 'hasta' exclusivo) -> lista de (desde, hasta) consecutivos."""
+    tramo = tramo or REPORT_TRAMO
+    inicio = datetime.strptime(desde, '%Y-%m-%d').date()
+    fin = datetime.strptime(hasta, '%Y-%m-%d').date()
+    if (fin - inicio).days <= REPORT_TRAMO_MIN_DIAS:
+        return [(desde, hasta)]
+    tramos = []
+    while inicio < fin:
+        corte = min(_siguiente(inicio, tramo), fin)
+        tramos.append((inicio.isoformat(), corte.isoformat()))
+        inicio = corte
+    return tramos
+
+
+@contextmanager
+def reportar_progreso(callback):
+    """callback(hechos, total, etiqueta) por cada tramo terminado dentro del bloque."""
+    marca = _escucha_progreso.set(callback)
+    try:
+        yield
+    finally:
+        _escucha_progreso.reset(marca)
+
+
+def avisar_progreso(hechos, total, etiqueta=None):
+    callback = _escucha_progreso.get()
+    if callback is None: return
+    try:
+        callback(hechos, total, etiqueta)
+    except Exception as e:
+        print(f"⚠️ Aviso de progreso: {e}")
+
+
+def _get_ejecutor():
+    global _ejecutor
+    with _ejecutor_lock:
+        if _ejecutor is None:
+            _ejecutor = ThreadPoolExecutor(max_workers=max(1, CONSULTAS_MAX_WORKERS), thread_name_prefix='consulta')
+        return _ejecutor
+
+
+def _en_hilo_compartido(fn):
+    def correr(*args):
+        _hilo.compartido = True
+        try:
+            return fn(*args)
+        finally:
+            _hilo.compartido = False
+    return correr
+
+
+def en_paralelo(funcion, argumentos, max_en_vuelo, etiqueta=None):
+    """
+    funcion(*args) para cada tupla de 'argumentos', en el ejecutor compartido y con a lo sumo
+    'max_en_vuelo' tareas a la vez. Devuelve los resultados en el orden de 'argumentos'.
+    Llamada desde una tarea del mismo ejecutor corre en serie (esperar al propio
+    ejecutor podría trabarlo).
+    """
+    total = len(argumentos)
+    resultados = [None] * total
+    if getattr(_hilo, 'compartido', False):
+        for i, args in enumerate(argumentos):
+            resultados[i] = funcion(*args)
+            avisar_progreso(i + 1, total, etiqueta)
+        return resultados
+
+    ejecutor = _get_ejecutor()
+    tarea = _en_hilo_compartido(cancellation.en_contexto(funcion))
+    en_vuelo = {}
+    siguiente = hechos = 0
+    try:
+        while hechos < total:
+            while siguiente < total and len(en_vuelo) < max(1, max_en_vuelo):
+                en_vuelo[ejecutor.submit(tarea, *argumentos[siguiente])] = siguiente
+                siguiente += 1
+            listos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                resultados[en_vuelo.pop(futuro)] = futuro.result()
+                hechos += 1
+                avisar_progreso(hechos, total, etiqueta)
+    except BaseException:
+        # Si una tarea falla (o se cancela la petición), las que no empezaron no se lanzan
+        for futuro in en_vuelo: futuro.cancel()
+        raise
+    return resultados
+
+
+def ejecutar(desde, hasta, consultar, etiqueta=None, tramo=None):
+    """
+    Corre consultar(desde_tramo, hasta_tramo) para cada tramo de [desde, hasta), en paralelo.
+    Devuelve los resultados en el orden de los tramos (el primero es el más viejo).
+    """
+    tramos = partir(desde, hasta, tramo)
+    with _stats_lock:
+        _stats['consultas'] += 1
+        _stats['tramos'] += len(tramos)
+        if len(tramos) > 1: _stats['consultas_partidas'] += 1
+
+    if len(tramos) == 1:
+        resultado = consultar(*tramos[0])
+        avisar_progreso(1, 1, etiqueta)
+        return [resultado]
+
+    return en_paralelo(consultar, tramos, REPORT_TRAMO_MAX_WORKERS, etiqueta)
+
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats, tramo=REPORT_TRAMO, min_dias=REPORT_TRAMO_MIN_DIAS, hilos_compartidos=CONSULTAS_MAX_WORKERS)
@@ -0,0 +1,305 @@
+# app/warmup.py
+# Precalentamiento programado: llena el caché de resultados (app/result_cache.py) antes
+# de que llegue la gente. Todas las mañanas se abren las mismas cosas (dashboard de la
+# EMA 1, lluvia del mes, niveles de la última semana) y todas pagaban la consulta en frío
+# al mismo tiempo.
+#
+# Cada trabajo de WARMUP_JOBS corre:
+#   - 'horas': ['06:30', ...]   todos los días a esa hora,
+#   - 'cada_minutos': N          cada N minutos,
+#   - 'al_llegar_datos': True    cuando la marca de agua de la EMA avanza (datos nuevos);
+#                                antes se invalida lo abierto de esa EMA.
+# Tipos:
+#   - 'dashboard': datos del dashboard de 'ema_id'.
+#   - 'grafico':   get_chart_data_service con los sensores que matchean 'sensores' (regex).
+#   - 'reporte':   fetch_report_df con esos sensores y los 'procesos' pedidos.
+#   - 'populares': repite las 'cantidad' consultas más pedidas por los usuarios.
+# 'ema_id' puede ser un id, una lista o '*' (todas las EMAs con sensores). 'rango':
+# 'hoy', 'mes_actual' o 'ultimos_N_dias'. 'db_key' por defecto: 'db_principal'.
+#
+# Cada worker corre su propio programador (arranca con el primer pedido, asegurar_iniciado,
+# así también funciona con 'gunicorn --preload') y sigue la marca de agua para invalidar su
+# propio caché. Pero cada turno (la corrida de las 06:30, cada N minutos, o los datos nuevos
+# de una EMA) lo corre UN solo proceso del despliegue: el primero que lo anota en el archivo
+# de turnos (WARMUP_TURNOS_PATH, con flock como app/shared_cache.py). Con N workers la BD
+# recibe una tanda, no N a la vez; los demás workers toman esos resultados con la BD ya en
+# caliente.
+
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+import config
+from . import shared_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows (servidor de desarrollo): un solo proceso, sin archivo de turnos
+    fcntl = None
+
+WARMUP_HABILITADO = getattr(config, 'WARMUP_HABILITADO', True)
+WARMUP_JOBS = getattr(config, 'WARMUP_JOBS', [
+    {'nombre': 'dashboard_ema_1', 'tipo': 'dashboard', 'ema_id': 1, 'horas': ['06:30'], 'al_llegar_datos': True},
+    {'nombre': 'lluvia_del_mes', 'tipo': 'reporte', 'ema_id': '*', 'sensores': 'pluvio',
+     'procesos': ['pluvio_sum'], 'rango': 'mes_actual', 'horas': ['06:30']},
+    {'nombre': 'niveles_7_dias', 'tipo': 'grafico', 'ema_id': '*', 'sensores': 'limni|freati',
+     'rango': 'ultimos_7_dias', 'horas': ['06:30']},
+    {'nombre': 'populares', 'tipo': 'populares', 'cantidad': 30, 'horas': ['06:35'], 'cada_minutos': 60},
+])
+WARMUP_TICK_SECONDS = getattr(config, 'WARMUP_TICK_SECONDS', 30)
+WARMUP_CHEQUEO_DATOS_SEGUNDOS = getattr(config, 'WARMUP_CHEQUEO_DATOS_SEGUNDOS', 60)
+WARMUP_TURNOS_PATH = getattr(
+    config, 'WARMUP_TURNOS_PATH', os.path.join(shared_cache.DIRECTORIO_PROPIO, 'precalentamiento.turnos')
+)
+
+_programador = None
+_programador_lock = threading.Lock()
+_stats = {}   # nombre del trabajo -> {'corridas', 'errores', 'ultima', 'segundos', 'ultimo_error'}
+_stats_lock = threading.Lock()
+
+
+def _rango(nombre, hoy):
+    if nombre == 'hoy':
+        return hoy, hoy
+    if nombre == 'mes_actual':
+        return hoy.replace(day=1), hoy
+    match = re.fullmatch(r'ultimos_(\d+)_dias', nombre or '')
+    if not match:
+        raise ValueError(f"Rango de precalentamiento no soportado: {nombre}")
+    return hoy - timedelta(days=int(match.group(1)) - 1), hoy
+
+
+def _emas_del_trabajo(trabajo, db_key):
+    from . import services
+    ema_id = trabajo.get('ema_id', '*')
+    if ema_id == '*':
+        return sorted(services.G_SENSOR_CACHE.get(db_key) or {})
+    return [int(e) for e in (ema_id if isinstance(ema_id, (list, tuple)) else [ema_id])]
+
+
+def _sensores(db_key, ema_id, patron):
+    from . import services
+    regex = re.compile(patron or '.', re.IGNORECASE)
+    return [
+        f"{s['id']}|{s['table_name']}|{s['nombre']}"
+        for s in services.listar_sensores(db_key, ema_id)
+        if regex.search(f"{s['table_name']} {s['nombre']} {s.get('search_text', '')}")
+    ]
+
+
+def _repetir_receta(receta, hoy):
+    from . import services
+    tipo, db_key, ema_id = receta[:3]
+    if tipo == 'dashboard':
+        services.fetch_dashboard_raw(db_key, ema_id)
+    elif tipo == 'serie':
+        sensor_info, dias_inicio, dias_fin = receta[3:]
+        services.fetch_raw_series(
+            db_key, ema_id, sensor_info,
+            (hoy - timedelta(days=dias_inicio)).isoformat(), (hoy - timedelta(days=dias_fin)).isoformat()
+        )
+
+
+def ejecutar(trabajo, emas=None):
+    """Corre un trabajo (opcionalmente solo para algunas EMAs). Devuelve cuántas consultas precalentó."""
+    from . import services
+    tipo = trabajo['tipo']
+    db_key = trabajo.get('db_key', 'db_principal')
+    hoy = datetime.now().date()
+    hechas = 0
+    with services.result_cache.precalentando():
+        if tipo == 'populares':
+            for receta in services.result_cache.populares(trabajo.get('cantidad', 30)):
+                _repetir_receta(receta, hoy)
+                hechas += 1
+            return hechas
+
+        if db_key not in config.DATABASE_CONNECTIONS: return 0
+        for ema_id in emas if emas is not None else _emas_del_trabajo(trabajo, db_key):
+            if tipo == 'dashboard':
+                services.fetch_dashboard_raw(db_key, ema_id)
+                hechas += 1
+                continue
+            sensores = _sensores(db_key, ema_id, trabajo.get('sensores'))
+            if not sensores: continue
+            fecha_inicio, fecha_fin = (d.isoformat() for d in _rango(trabajo.get('rango', 'hoy'), hoy))
+            if tipo == 'grafico':
+                services.get_chart_data_service(db_key, ema_id, sensores, fecha_inicio, fecha_fin)
+            elif tipo == 'reporte':
+                procesos = trabajo.get('procesos', ['raw'])
+                services.fetch_report_df(
+                    db_key, ema_id, fecha_inicio, fecha_fin,
+                    [s for s in sensores for _ in procesos], [p for _ in sensores for p in procesos]
+                )
+            else:
+                raise ValueError(f"Tipo de precalentamiento no soportado: {tipo}")
+            hechas += len(sensores)
+    return hechas
+
+
+def _nombre(trabajo, i):
+    return trabajo.get('nombre') or f"{trabajo['tipo']}_{i}"
+
+
+def _correr_y_anotar(nombre, trabajo, emas=None):
+    inicio = time.perf_counter()
+    try:
+        hechas = ejecutar(trabajo, emas)
+        error = None
+    except Exception as e:
+        hechas, error = 0, str(e)
+        print(f"⚠️ Precalentamiento '{nombre}': {e}")
+    with _stats_lock:
+        stats = _stats.setdefault(nombre, {'corridas': 0, 'errores': 0, 'consultas': 0})
+        stats['corridas'] += 1
+        stats['consultas'] += hechas
+        stats['ultima'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        stats['segundos'] = round(time.perf_counter() - inicio, 2)
+        if error:
+            stats['errores'] += 1
+            stats['ultimo_error'] = error
+
+
+def _tomar_turno(clave, tomar):
+    """
+    Anota un turno en el archivo compartido. 'tomar(anterior)' recibe lo último anotado para
+    'clave' (por cualquier proceso) y devuelve lo que se anota, o None si el turno ya lo
+    corrió otro. True si le toca a este proceso.
+    """
+    if fcntl is None or not WARMUP_TURNOS_PATH:
+        return tomar(None) is not None
+    shared_cache.preparar_directorio_privado(os.path.dirname(os.path.abspath(WARMUP_TURNOS_PATH)))
+    fd = os.open(WARMUP_TURNOS_PATH, os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, 'r+') as archivo:
+        fcntl.flock(archivo.fileno(), fcntl.LOCK_EX)
+        try:
+            try:
+                turnos = json.loads(archivo.read() or '{}')
+            except ValueError:
+                turnos = {}
+            valor = tomar(turnos.get(clave))
+            if valor is None: return False
+            turnos[clave] = valor
+            archivo.seek(0)
+            archivo.truncate()
+            json.dump(turnos, archivo)
+            archivo.flush()
+            return True
+        finally:
+            fcntl.flock(archivo.fileno(), fcntl.LOCK_UN)
+
+
+class Programador(threading.Thread):
+    """Hilo que revisa los trabajos cada WARMUP_TICK_SECONDS y corre los que tocan."""
+
+    def __init__(self, trabajos):
+        super().__init__(name='precalentamiento', daemon=True)
+        self.trabajos = [(_nombre(t, i), t) for i, t in enumerate(trabajos)]
+        arranque = datetime.now()
+        # Las horas que ya pasaron antes de arrancar no se corren (un reinicio no precalienta todo)
+        self.ultima = {nombre: arranque for nombre, _ in self.trabajos}
+        self.marcas = {}            # (nombre, ema_id) -> última marca de agua vista
+        self.ultimo_chequeo = {}    # nombre -> monotonic
+
+    @staticmethod
+    def _toca(trabajo, ultima, ahora):
+        for hora in trabajo.get('horas', []):
+            h, m = (int(x) for x in hora.split(':'))
+            turno = ahora.replace(hour=h, minute=m, second=0, microsecond=0)
+            if ultima < turno <= ahora: return True
+        minutos = trabajo.get('cada_minutos')
+        return bool(minutos) and ahora - ultima >= timedelta(minutes=minutos)
+
+    def _emas_con_datos_nuevos(self, nombre, trabajo):
+        from . import services
+        ahora = time.monotonic()
+        if ahora - self.ultimo_chequeo.get(nombre, 0) < WARMUP_CHEQUEO_DATOS_SEGUNDOS: return []
+        self.ultimo_chequeo[nombre] = ahora
+        db_key = trabajo.get('db_key', 'db_principal')
+        if db_key not in config.DATABASE_CONNECTIONS: return []
+        repo = services.get_repo_for_db(db_key)
+        nuevas = []
+        for ema_id in _emas_del_trabajo(trabajo, db_key):
+            marca = repo.get_latest_measurement_ts_repo(db_key, ema_id)
+            visto = (nombre, ema_id) in self.marcas
+            anterior = self.marcas.get((nombre, ema_id))
+            self.marcas[(nombre, ema_id)] = marca
+            # La primera vez solo se toma la marca
+            if visto and marca != anterior:
+                services.result_cache.invalidar_ema(db_key, ema_id)
+                nuevas.append(ema_id)
+        return nuevas
+
+    def _turno_propio(self, nombre, trabajo, ahora):
+        """El turno que le toca a este proceso es suyo si ningún otro lo corrió ya."""
+        def tomar(anterior):
+            if anterior and not self._toca(trabajo, datetime.fromisoformat(anterior), ahora): return None
+            return ahora.isoformat()
+        return _tomar_turno(nombre, tomar)
+
+    def _emas_propias(self, nombre, emas):
+        """De las EMAs con datos nuevos, las que ningún otro proceso precalentó con esa marca."""
+        propias = []
+        for ema_id in emas:
+            marca = str(self.marcas[(nombre, ema_id)])
+            if _tomar_turno(f"{nombre}@{ema_id}", lambda anterior: None if anterior == marca else marca):
+                propias.append(ema_id)
+        return propias
+
+    def revisar(self):
+        """Una pasada por los trabajos: corre los que tocan."""
+        for nombre, trabajo in self.trabajos:
+            ahora = datetime.now()
+            try:
+                if self._toca(trabajo, self.ultima[nombre], ahora):
+                    self.ultima[nombre] = ahora
+                    if self._turno_propio(nombre, trabajo, ahora):
+                        _correr_y_anotar(nombre, trabajo)
+                elif trabajo.get('al_llegar_datos'):
+                    # La invalidación es de cada proceso; el precalentamiento, de uno solo
+                    nuevas = self._emas_propias(nombre, self._emas_con_datos_nuevos(nombre, trabajo))
+                    if nuevas: _correr_y_anotar(nombre, trabajo, nuevas)
+            except Exception as e:
+                print(f"⚠️ Precalentamiento '{nombre}': {e}")
+
+    def run(self):
+        while True:
+            self.revisar()
+            time.sleep(WARMUP_TICK_SECONDS)
+
+
+def asegurar_iniciado():
+    """Arranca el programador de este proceso si todavía no corre (barato: se llama en cada pedido)."""
+    global _programador
+    if not WARMUP_HABILITADO or not WARMUP_JOBS: return
+    programador = _programador
+    if programador is not None and programador.pid == os.getpid(): return
+    with _programador_lock:
+        if _programador is None or _programador.pid != os.getpid():
+            # Después de un fork el hilo del padre no existe en el hijo: se arranca otro
+            _programador = Programador(WARMUP_JOBS)
+            _programador.pid = os.getpid()
+            _programador.start()
+            print(f"✅ Precalentamiento programado: {', '.join(n for n, _ in _programador.trabajos)}")
+
+
+def ejecutar_ahora(nombre=None):
+    """Corre ya (en segundo plano) un trabajo o todos. Devuelve los nombres lanzados."""
+    trabajos = [(_nombre(t, i), t) for i, t in enumerate(WARMUP_JOBS)]
+    elegidos = [(n, t) for n, t in trabajos if nombre in (None, n)]
+
+    def correr():
+        for n, t in elegidos:
+            _correr_y_anotar(n, t)
+
+    if elegidos:
+        threading.Thread(target=correr, name='precalentamiento-manual', daemon=True).start()
+    return [n for n, _ in elegidos]
+
+
+def get_stats():
+    with _stats_lock:
+        trabajos = {nombre: dict(stats) for nombre, stats in _stats.items()}
+    return {'habilitado': bool(WARMUP_HABILITADO and WARMUP_JOBS), 'trabajos': trabajos}
@@ -0,0 +1,2 @@
+# loadtest/
+# Pruebas de carga: backend sintético (servidor.py) y sesiones de usuario simuladas (run.py).
@@ -0,0 +1,98 @@
+# loadtest/metricas.py
+# Registro de latencias por endpoint, resumen (p50/p95/p99, errores, throughput)
+# y comparación contra una línea de base guardada.
+
+import json
+import threading
+import time
+from collections import Counter
+import numpy as np
+
+
+class Registro:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._muestras = {}   # endpoint -> [(ms, ok, etapa)]
+        self._estados = {}    # endpoint -> Counter(estado HTTP o tipo de error)
+        self.inicio = time.monotonic()
+
+    def anotar(self, endpoint, ms, estado, etapa=None):
+        ok = isinstance(estado, int) and estado < 400
+        with self._lock:
+            self._muestras.setdefault(endpoint, []).append((ms, ok, etapa))
+            self._estados.setdefault(endpoint, Counter())[estado] += 1
+
+    def resumen(self, duracion=None, etapa=None):
+        """{endpoint: {pedidos, errores, tasa_error, rps, p50, p95, p99, max}} (+ 'TOTAL')."""
+        duracion = duracion or (time.monotonic() - self.inicio)
+        with self._lock:
+            muestras = {k: [m for m in v if etapa is None or m[2] == etapa] for k, v in self._muestras.items()}
+            estados = {k: dict(v) for k, v in self._estados.items()}
+        resultado = {}
+        todas = []
+        for endpoint, filas in sorted(muestras.items()):
+            if not filas: continue
+            todas.extend(filas)
+            resultado[endpoint] = _estadisticas(filas, duracion)
+            if etapa is None:
+                resultado[endpoint]['estados'] = {str(k): v for k, v in estados[endpoint].items()}
+        if todas:
+            resultado['TOTAL'] = _estadisticas(todas, duracion)
+        return resultado
+
+
+def _estadisticas(filas, duracion):
+    ms = np.array([f[0] for f in filas], dtype='float64')
+    errores = sum(1 for f in filas if not f[1])
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'pedidos': len(filas), 'errores': errores, 'tasa_error': round(errores / len(filas), 4),
+        'rps': round(len(filas) / duracion, 2) if duracion > 0 else 0.0,
+        'p50': round(float(p50), 1), 'p95': round(float(p95), 1), 'p99': round(float(p99), 1),
+        'max': round(float(ms.max()), 1),
+    }
+
+
+def imprimir(resumen, titulo="Resultados"):
+    print(f"\n=== {titulo} ===")
+    print(f"{'endpoint':<34}{'pedidos':>9}{'err %':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for endpoint, e in resumen.items():
+        print(f"{endpoint:<34}{e['pedidos']:>9}{e['tasa_error'] * 100:>7.1f}%{e['rps']:>8}{e['p50']:>9}{e['p95']:>9}{e['p99']:>9}{e['max']:>9}")
+        raros = {k: v for k, v in e.get('estados', {}).items() if not (k.isdigit() and int(k) < 400)}
+        if raros:
+            print(f"{'':<34}errores: " + ", ".join(f"{k} x{v}" for k, v in sorted(raros.items())))
+
+
+def guardar_baseline(ruta, resumen, parametros):
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump({'parametros': parametros, 'fecha': time.strftime('%Y-%m-%d %H:%M:%S'), 'resumen': resumen}, archivo, indent=2, ensure_ascii=False)
+    print(f"\nLínea de base guardada en {ruta}")
+
+
+def comparar(resumen, ruta_baseline, tolerancia=0.2):
+    """
+    Compara p95/p99/tasa de error contra la línea de base.
+    Devuelve las regresiones (empeoró más que 'tolerancia', relativa) para poder cortar un CI.
+    """
+    with open(ruta_baseline, encoding='utf-8') as archivo:
+        base = json.load(archivo)
+    print(f"\n=== Comparación contra {ruta_baseline} ({base.get('fecha', '?')}) ===")
+    print(f"{'endpoint':<34}{'p95 base':>10}{'p95 hoy':>10}{'Δ p95':>9}{'p99 base':>10}{'p99 hoy':>10}{'err base':>10}{'err hoy':>9}")
+    regresiones = []
+    for endpoint, actual in resumen.items():
+        anterior = base['resumen'].get(endpoint)
+        if not anterior:
+            print(f"{endpoint:<34}{'(nuevo)':>10}")
+            continue
+        delta = (actual['p95'] - anterior['p95']) / anterior['p95'] if anterior['p95'] else 0.0
+        print(f"{endpoint:<34}{anterior['p95']:>10}{actual['p95']:>10}{delta * 100:>8.0f}%{anterior['p99']:>10}{actual['p99']:>10}"
+              f"{anterior['tasa_error'] * 100:>9.1f}%{actual['tasa_error'] * 100:>8.1f}%")
+        for metrica in ('p95', 'p99'):
+            if anterior[metrica] and actual[metrica] > anterior[metrica] * (1 + tolerancia):
+                regresiones.append(f"{endpoint}: {metrica} {anterior[metrica]} -> {actual[metrica]} ms")
+        if actual['tasa_error'] > anterior['tasa_error'] + 0.01:
+            regresiones.append(f"{endpoint}: errores {anterior['tasa_error']:.1%} -> {actual['tasa_error']:.1%}")
+    for r in regresiones:
+        print(f"⚠️ Regresión: {r}")
+    return regresiones
@@ -0,0 +1,264 @@
+# loadtest/repositorio_sintetico.py
+# Repositorio con datos sintéticos para las pruebas de carga (driver 'sintetico').
+#
+# Implementa las mismas funciones que app/repositories_postgres.py, pero las series se
+# generan en el momento con NumPy: son deterministas (el valor depende solo de la estación,
+# el sensor y el instante), así que dos pedidos del mismo rango devuelven lo mismo.
+# Cada "consulta" espera SINTETICO_LATENCIA_MS + SINTETICO_MS_POR_MIL_FILAS por cada mil
+# filas, para que el servidor se comporte como si esperara a una BD real.
+
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import config
+from app import resampling
+from app.sensor_index import IndiceSensores
+
+SINTETICO_EMAS = getattr(config, 'SINTETICO_EMAS', 15)
+SINTETICO_MINUTOS = getattr(config, 'SINTETICO_MINUTOS', 10)
+SINTETICO_HISTORIA_DESDE = getattr(config, 'SINTETICO_HISTORIA_DESDE', '2019-01-01')
+SINTETICO_LATENCIA_MS = getattr(config, 'SINTETICO_LATENCIA_MS', 5)
+SINTETICO_MS_POR_MIL_FILAS = getattr(config, 'SINTETICO_MS_POR_MIL_FILAS', 2)
+# Probabilidad de que una hora cualquiera sea de tormenta; las últimas 72 h siempre lo son
+SINTETICO_PROB_TORMENTA = getattr(config, 'SINTETICO_PROB_TORMENTA', 0.03)
+
+PROCESS_TYPE_TRANSLATION = {
+    'raw': 'Dato Crudo',
+    'pluvio_sum': 'Acumulado Diario',
+    'nivel_max': 'Maximo Diario',
+    'avg_hourly': 'Promedio por Hora',
+    'sum_hourly': 'Acumulado por Hora',
+    'max_hourly': 'Maximo por Hora'
+}
+
+# id -> (nombre, descripción, tabla)
+SENSORES = {
+    1: ('Pluviometro', 'lluvia', 'medicion_pluviometrica'),
+    2: ('Limnigrafo', 'nivel del curso', 'medicion_limnigrafica'),
+    3: ('Temperatura', 'temperatura atmosferica', 'medicion_temperatura_atmosferica'),
+    4: ('Anemometro', 'velocidad del viento', 'medicion_anemometrica'),
+    5: ('Veleta', 'direccion del viento', 'medicion_direccion_viento'),
+    6: ('Barometro', 'presion atmosferica', 'medicion_barometrica'),
+    7: ('Bateria', 'tension de bateria', 'medicion_bateria'),
+}
+
+_PASO = np.timedelta64(SINTETICO_MINUTOS, 'm')
+_indice = None
+
+
+def _esperar(filas=0):
+    time.sleep((SINTETICO_LATENCIA_MS + SINTETICO_MS_POR_MIL_FILAS * filas / 1000.0) / 1000.0)
+
+
+def _sensores_de(ema_id):
+    # Una de cada cinco estaciones no tiene limnígrafo (como pasa en las reales)
+    return [s for s in SENSORES if not (s == 2 and ema_id % 5 == 0)]
+
+
+def _estacion(ema_id):
+    ema_id = int(ema_id)
+    return (ema_id, f"EMA Sintética {ema_id}", f"Estación de prueba {ema_id}",
+            -34.45 - 0.04 * (ema_id % 7), -58.55 - 0.05 * (ema_id // 7))
+
+
+def _azar(minutos, semilla):
+    """Pseudoaleatorio en [0, 1) que depende solo del instante y la semilla (vectorizado)."""
+    x = (minutos.astype('uint64') * np.uint64(2654435761) + np.uint64(semilla * 40503 + 12345)) % np.uint64(2 ** 32)
+    x = (x ^ (x >> np.uint64(13))) * np.uint64(1274126177) % np.uint64(2 ** 32)
+    return x.astype('float64') / 2 ** 32
+
+
+def _valores(ema_id, sensor_id, timestamps):
+    minutos = timestamps.astype('datetime64[m]').astype('int64')
+    horas = minutos / 60.0
+    ruido = _azar(minutos, ema_id * 100 + sensor_id) - 0.5
+    if sensor_id == 1:
+        hora = minutos // 60
+        tormenta = (_azar(hora, ema_id) < SINTETICO_PROB_TORMENTA) | (timestamps >= np.datetime64(datetime.now() - timedelta(hours=72)))
+        return np.where(tormenta, np.round(np.maximum(ruido + 0.3, 0) * 4, 1), 0.0)
+    if sensor_id == 2:
+        # Marea del delta (12,42 h) más un poco de ruido
+        return np.round(1.2 + 0.4 * np.sin(2 * np.pi * horas / 12.42 + ema_id) + 0.05 * ruido, 3)
+    if sensor_id == 3:
+        return np.round(17 + 7 * np.sin(2 * np.pi * (horas / 24 - 0.375)) + 6 * np.cos(2 * np.pi * horas / 8766) + ruido, 2)
+    if sensor_id == 4:
+        return np.round(np.abs(12 + 10 * np.sin(2 * np.pi * horas / 30) + 8 * ruido), 1)
+    if sensor_id == 5:
+        return np.round((180 + 170 * np.sin(2 * np.pi * horas / 50) + 20 * ruido) % 360, 0)
+    if sensor_id == 6:
+        return np.round(1013 + 8 * np.sin(2 * np.pi * horas / 120) + ruido, 1)
+    return np.round(12.6 + 0.3 * np.sin(2 * np.pi * horas / 24) + 0.05 * ruido, 2)
+
+
+def _serie(ema_id, sensor_id, fecha_inicio_str, fecha_fin_str):
+    """Serie de [fecha_inicio, fecha_fin] inclusive, cortada en el presente."""
+    desde = max(np.datetime64(fecha_inicio_str, 'm'), np.datetime64(SINTETICO_HISTORIA_DESDE, 'm'))
+    hasta = min(np.datetime64(fecha_fin_str, 'm') + np.timedelta64(1, 'D'), np.datetime64(datetime.now(), 'm'))
+    desde = desde + (-desde.astype('int64')) % SINTETICO_MINUTOS * np.timedelta64(1, 'm')
+    if hasta <= desde:
+        return np.array([], dtype='datetime64[ns]'), np.array([], dtype='float64')
+    timestamps = np.arange(desde, hasta, _PASO).astype('datetime64[ns]')
+    return timestamps, _valores(int(ema_id), int(sensor_id), timestamps)
+
+
+def _ultimo_instante():
+    ahora = np.datetime64(datetime.now(), 'm')
+    return ahora - ahora.astype('int64') % SINTETICO_MINUTOS * np.timedelta64(1, 'm')
+
+
+def _ultimo_valor(ema_id, sensor_id):
+    t = np.array([_ultimo_instante()], dtype='datetime64[ns]')
+    return float(_valores(int(ema_id), sensor_id, t)[0]), t[0].astype('datetime64[us]').item()
+
+
+def _sensor_id(sensor_info):
+    return int(sensor_info.split('|')[0])
+
+
+# ==============================================================================
+# === MISMA INTERFAZ QUE LOS REPOSITORIOS REALES ===============================
+# ==============================================================================
+def build_sensor_index_repo(db_key):
+    global _indice
+    _esperar()
+    indice = IndiceSensores()
+    for sensor_id, (nombre, descripcion, tabla) in SENSORES.items():
+        indice.agregar_sensor(sensor_id, nombre, tabla, f"{nombre} {descripcion}".lower())
+    for ema_id in range(1, SINTETICO_EMAS + 1):
+        ids = _sensores_de(ema_id)
+        indice.sensores_por_ema[ema_id] = ids
+        indice.por_ema[ema_id] = [dict(indice.sensores[s], fecha_inicio=SINTETICO_HISTORIA_DESDE) for s in ids]
+    indice.todas = [dict(indice.sensores[s], id=0, fecha_inicio="N/A") for s in SENSORES]
+    _indice = indice
+    return indice
+
+
+def build_active_sensor_cache(db_key):
+    return build_sensor_index_repo(db_key).sensores_por_ema
+
+
+def get_sensors_for_ema_repo(db_key, G_SENSOR_CACHE, ema_id):
+    _esperar()
+    indice = _indice or build_sensor_index_repo(db_key)
+    return indice.listar(ema_id)
+
+
+def get_ema_list_repo(db_key):
+    _esperar()
+    return [(ema_id, _estacion(ema_id)[1]) for ema_id in range(1, SINTETICO_EMAS + 1)]
+
+
+def get_ema_locations_repo(db_key):
+    _esperar()
+    return [
+        {'id': e[0], 'nombre': e[1], 'descripcion': e[2], 'lat': e[3], 'lon': e[4]}
+        for e in (_estacion(ema_id) for ema_id in range(1, SINTETICO_EMAS + 1))
+    ]
+
+
+def get_ema_live_summary_repo(db_key, ema_id):
+    datos = get_dashboard_data_repo(db_key, ema_id)
+    return {clave: (datos[clave] or {}).get('valor') for clave in ('temperatura', 'nivel_max_hoy', 'pluvio_sum_hoy')}
+
+
+def get_dashboard_data_repo(db_key, ema_id):
+    _esperar()
+    ema_id = int(ema_id)
+    hoy = datetime.now().strftime('%Y-%m-%d')
+    data = {'temperatura': None, 'nivel_max_hoy': None, 'pluvio_sum_hoy': None, 'viento_vel': None, 'viento_dir': None,
+            'presion': None, 'bateria': None}
+    sensores = _sensores_de(ema_id)
+    for clave, sensor_id in (('temperatura', 3), ('viento_vel', 4), ('viento_dir', 5), ('presion', 6), ('bateria', 7)):
+        valor, ts = _ultimo_valor(ema_id, sensor_id)
+        data[clave] = {'valor': valor, 'timestamp': ts}
+    data['pluvio_sum_hoy'] = {'valor': float(_serie(ema_id, 1, hoy, hoy)[1].sum())}
+    if 2 in sensores:
+        niveles = _serie(ema_id, 2, hoy, hoy)[1]
+        if len(niveles): data['nivel_max_hoy'] = {'valor': float(niveles.max())}
+    return data
+
+
+def get_latest_measurement_ts_repo(db_key, ema_id):
+    _esperar()
+    return _ultimo_instante().astype('datetime64[us]').item()
+
+
+def estimar_filas_repo(db_key, ema_id, sensor_info, fecha_inicio_str, fecha_fin_str):
+    # Acá la estimación es exacta: una medición cada SINTETICO_MINUTOS desde el inicio de la historia
+    desde = max(np.datetime64(fecha_inicio_str), np.datetime64(SINTETICO_HISTORIA_DESDE))
+    hasta = min(np.datetime64(fecha_fin_str) + np.timedelta64(1, 'D'), _ultimo_instante())
+    por_ema = max(0, int((hasta - desde) // _PASO))
+    sensor_id = _sensor_id(sensor_info)
+    emas = range(1, SINTETICO_EMAS + 1) if ema_id == 'todas' else [_estacion(ema_id)[0]]
+    _esperar()
+    return por_ema * sum(1 for e in emas if sensor_id in _sensores_de(e))
+
+
+def fetch_raw_series_repo(db_key, ema_id, sensor_info, fecha_inicio_str, fecha_fin_str):
+    ema = _estacion(ema_id)
+    sensor_id = _sensor_id(sensor_info)
+    if sensor_id in _sensores_de(ema[0]):
+        timestamps, valores = _serie(ema[0], sensor_id, fecha_inicio_str, fecha_fin_str)
+    else:
+        timestamps, valores = np.array([], dtype='datetime64[ns]'), np.array([], dtype='float64')
+    _esperar(len(timestamps))
+    return {
+        'ema_id': ema[0], 'nombre_ema': ema[1], 'descripcion_ema': ema[2],
+        'latitud': ema[3], 'longitud': ema[4], 'sensor_nombre': sensor_info.split('|')[2],
+        'contador_acumulado': False,
+        'timestamps': timestamps, 'valores': valores,
+    }
+
+
+def fetch_multi_station_series_repo(db_key, ids_por_ema, sensor_info, fecha_inicio_str, fecha_fin_str):
+    filas, estaciones = [], {}
+    for ema_id, ids in sorted(ids_por_ema.items()):
+        ema = _estacion(ema_id)
+        estaciones[ema[0]] = {'nombre_ema': ema[1], 'contador_acumulado': False}
+        for sensor_id in ids:
+            timestamps, valores = _serie(ema[0], sensor_id, fecha_inicio_str, fecha_fin_str)
+            filas.extend(zip([ema[0]] * len(timestamps), timestamps.astype('datetime64[us]').tolist(), valores.tolist()))
+    _esperar(len(filas))
+    return {'estaciones': estaciones, 'filas': filas}
+
+
+def fetch_rain_series_repo(db_key, ema_ids, fecha_inicio_str, fecha_fin_str):
+    filas, estaciones = [], {}
+    for ema_id in sorted(ema_ids or range(1, SINTETICO_EMAS + 1)):
+        ema = _estacion(ema_id)
+        estaciones[ema[0]] = {'nombre_ema': ema[1], 'contador_acumulado': False}
+        timestamps, valores = _serie(ema[0], 1, fecha_inicio_str, fecha_fin_str)
+        filas.extend(zip([ema[0]] * len(timestamps), [1] * len(timestamps), timestamps.astype('datetime64[us]').tolist(), valores.tolist()))
+    _esperar(len(filas))
+    return {'estaciones': estaciones, 'filas': filas}
+
+
+def generate_report_repo(db_key, ema_id_form, fecha_inicio_str, fecha_fin_str, sensor_info_list, process_type_list, G_SENSOR_CACHE=None, G_SENSOR_INDEX=None):
+    """Camino 'todas': el mismo sensor (por id) en cada estación, agregado con app/resampling.py."""
+    import pandas as pd
+    emas = range(1, SINTETICO_EMAS + 1) if ema_id_form == 'todas' else [int(ema_id_form)]
+    bloques = []
+    for sensor_info, process_type in zip(sensor_info_list, process_type_list):
+        _, _, sensor_name = sensor_info.split('|')
+        sensor_ids = [s for s, (nombre, _, _) in SENSORES.items() if nombre.lower() == sensor_name.lower()] or [_sensor_id(sensor_info)]
+        tipo = resampling.PROCESS_TYPES[process_type]
+        for ema_id in emas:
+            for sensor_id in sensor_ids:
+                if sensor_id not in _sensores_de(ema_id): continue
+                timestamps, valores = _serie(ema_id, sensor_id, fecha_inicio_str, fecha_fin_str)
+                _esperar(len(timestamps))
+                if tipo['ancho'] is not None:
+                    spec = (tipo['ancho'], tipo['funcion'])
+                    timestamps, valores = resampling.resample(timestamps, valores, [spec])[spec]
+                ema = _estacion(ema_id)
+                bloques.append(pd.DataFrame({
+                    'ema_id': ema[0], 'nombre_ema': ema[1], 'descripcion_ema': ema[2],
+                    'latitud': ema[3], 'longitud': ema[4], 'sensor_nombre': sensor_name,
+                    'tiempo_de_medicion': timestamps if tipo['columna'] == 'tiempo_de_medicion' else None,
+                    'dia': timestamps if tipo['columna'] == 'dia' else None,
+                    'hora': timestamps if tipo['columna'] == 'hora' else None,
+                    'valor': valores,
+                    'tipo_procesamiento': PROCESS_TYPE_TRANSLATION.get(process_type, tipo['etiqueta']),
+                }))
+    if not bloques: return pd.DataFrame()
+    return pd.concat(bloques, ignore_index=True)
@@ -0,0 +1,162 @@
+# loadtest/run.py
+# Prueba de carga con sesiones de usuario realistas (ver loadtest/sesiones.py).
+#
+# 1) Levantar la app contra el backend sintético:
+#       python -m loadtest.servidor --puerto 5055
+# 2) Correr la carga (otra terminal):
+#       python -m loadtest.run --usuarios 200 --duracion 300 --perfil tormenta --guardar loadtest/base.json
+# 3) Después de un cambio, comparar contra la línea de base (sale con código 1 si hay regresiones):
+#       python -m loadtest.run --usuarios 200 --duracion 300 --perfil tormenta --comparar loadtest/base.json
+#
+# Reporta p50/p95/p99, tasa de error y throughput por endpoint (total y por etapa del perfil).
+
+import argparse
+import random
+import sys
+import threading
+import time
+from . import metricas
+from . import sesiones
+
+
+# --- Perfiles de carga: lista de (segundo de inicio, usuarios activos) ---
+def _constante(usuarios, duracion):
+    return [(0, usuarios)]
+
+
+def _rampa(usuarios, duracion):
+    # Sube en 10 escalones durante el 60% del tiempo y se mantiene
+    pasos = 10
+    return [(duracion * 0.6 * i / pasos, max(1, round(usuarios * (i + 1) / pasos))) for i in range(pasos)]
+
+
+def _escalones(usuarios, duracion):
+    return [(duracion * i / 4, max(1, round(usuarios * (i + 1) / 4))) for i in range(4)]
+
+
+def _tormenta(usuarios, duracion):
+    # Uso normal, pico de golpe cuando empieza a llover (todos abren el mapa) y después baja
+    return [(0, max(1, usuarios // 5)), (duracion * 0.3, usuarios), (duracion * 0.7, max(1, usuarios // 2))]
+
+
+PERFILES_CARGA = {
+    'constante': _constante,
+    'rampa': _rampa,
+    'escalones': _escalones,
+    'tormenta': _tormenta,
+}
+
+
+def _objetivo(etapas, transcurrido):
+    actual = etapas[0]
+    for etapa in etapas:
+        if transcurrido >= etapa[0]: actual = etapa
+    return actual
+
+
+def _parsear_mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(','):
+        nombre, _, peso = parte.partition('=')
+        if nombre.strip() not in sesiones.SESIONES:
+            raise argparse.ArgumentTypeError(f"Sesión desconocida: {nombre} (hay: {', '.join(sesiones.SESIONES)})")
+        mezcla[nombre.strip()] = float(peso or 1)
+    return mezcla
+
+
+def correr(args):
+    registro = metricas.Registro()
+    etapas = PERFILES_CARGA[args.perfil](args.usuarios, args.duracion)
+    etiquetas = {inicio: f"{n} usuarios (desde {inicio:.0f}s)" for inicio, n in etapas}
+    estado = {'etapa': etiquetas[etapas[0][0]]}
+    emas = list(range(1, args.emas + 1))
+    semillas = random.Random(args.semilla)
+
+    activos = []   # [(hilo, evento detener)]
+    numero = 0
+    inicio = time.monotonic()
+    print(f"Perfil '{args.perfil}' contra {args.url}: " + " -> ".join(f"{n}@{t:.0f}s" for t, n in etapas))
+    try:
+        while True:
+            transcurrido = time.monotonic() - inicio
+            if transcurrido >= args.duracion: break
+            etapa_inicio, objetivo = _objetivo(etapas, transcurrido)
+            estado['etapa'] = etiquetas[etapa_inicio]
+            activos = [(h, d) for h, d in activos if h.is_alive()]
+            en_uso = [(h, d) for h, d in activos if not d.is_set()]
+            while len(en_uso) < objetivo:
+                detener = threading.Event()
+                cliente = sesiones.Cliente(
+                    args.url, registro, lambda: estado['etapa'], detener,
+                    pausa_factor=args.pausa_factor, rnd=random.Random(semillas.random())
+                )
+                numero += 1
+                usuario = f"{args.usuario}_{(numero - 1) % args.cuentas + 1}" if args.cuentas else args.usuario
+                hilo = threading.Thread(
+                    target=sesiones.usuario_virtual, args=(cliente, usuario, args.clave, emas, args.mezcla), daemon=True
+                )
+                hilo.start()
+                activos.append((hilo, detener))
+                en_uso.append((hilo, detener))
+            # Si el perfil baja, los que sobran terminan su pedido en curso y se van
+            for _, detener in en_uso[objetivo:]:
+                detener.set()
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("\nInterrumpido: resumen parcial")
+    finally:
+        for _, detener in activos:
+            detener.set()
+        duracion = time.monotonic() - inicio
+        # Los pedidos en curso terminan (o vencen) solos; no esperamos más que unos segundos
+        limite = time.monotonic() + 10
+        for hilo, _ in activos:
+            hilo.join(max(0.0, limite - time.monotonic()))
+    return registro, etiquetas, duracion
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones de usuario simuladas.")
+    parser.add_argument('--url', default='http://127.0.0.1:5055')
+    parser.add_argument('--usuarios', type=int, default=200, help="usuarios simultáneos en el pico")
+    parser.add_argument('--duracion', type=float, default=120, help="segundos")
+    parser.add_argument('--perfil', choices=sorted(PERFILES_CARGA), default='tormenta')
+    parser.add_argument('--mezcla', type=_parsear_mezcla, default=dict(sesiones.MEZCLA_SESIONES),
+                        help="pesos por sesión, p. ej. 'mapa=3,dashboard=3,graficos=3,reporte=1'")
+    parser.add_argument('--usuario', default='carga')
+    parser.add_argument('--cuentas', type=int, default=500,
+                        help="cada usuario virtual entra como '<usuario>_<n>' (n = 1..cuentas); 0 = todos con --usuario")
+    parser.add_argument('--clave', default='carga')
+    parser.add_argument('--emas', type=int, default=15, help="las EMAs van de 1 a N")
+    parser.add_argument('--pausa-factor', type=float, default=1.0, help="escala los tiempos de lectura (0 = sin pausas)")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--guardar', help="guarda el resultado como línea de base (JSON)")
+    parser.add_argument('--comparar', help="compara contra una línea de base guardada")
+    parser.add_argument('--tolerancia', type=float, default=0.2, help="empeoramiento relativo de p95/p99 tolerado")
+    args = parser.parse_args(argv)
+
+    registro, etiquetas, duracion = correr(args)
+    resumen = registro.resumen(duracion)
+    if not resumen:
+        print("No se registró ningún pedido (¿la app está levantada?)")
+        return 1
+    if set(resumen) <= {'POST /login', 'TOTAL'}:
+        print(f"⚠️ Solo hubo logins: revisar usuario/clave ('{args.usuario}')")
+
+    if len(etiquetas) > 1:
+        inicios = sorted(etiquetas) + [duracion]
+        for desde, hasta in zip(inicios, inicios[1:]):
+            por_etapa = registro.resumen(max(min(hasta, duracion) - desde, 1e-9), etapa=etiquetas[desde])
+            if por_etapa: metricas.imprimir(por_etapa, f"Etapa: {etiquetas[desde]}")
+    metricas.imprimir(resumen, f"Total ({duracion:.0f}s, perfil '{args.perfil}', pico {args.usuarios} usuarios)")
+
+    parametros = {k: v for k, v in vars(args).items() if k not in ('guardar', 'comparar', 'clave')}
+    if args.guardar:
+        metricas.guardar_baseline(args.guardar, resumen, parametros)
+    if args.comparar:
+        return 1 if metricas.comparar(resumen, args.comparar, args.tolerancia) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,32 @@
+# loadtest/servidor.py
+# Levanta la app contra el backend sintético, sin ninguna BD real.
+#
+#   python -m loadtest.servidor --puerto 5055
+#   gunicorn -w 4 --threads 8 -b 127.0.0.1:5055 'loadtest.servidor:crear_app()'
+#
+# Hay que correrlo desde la raíz del repo (donde está run.py).
+
+import argparse
+import os
+import sys
+
+
+def crear_app():
+    # La app lee 'config' como módulo de nivel superior: el de loadtest/sintetico/ va primero
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sintetico'))
+    from app import services
+    services.REPOSITORIES_MAP['sintetico'] = 'loadtest.repositorio_sintetico'
+    from app import create_app
+    return create_app()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="App de EMAs con datos sintéticos (para pruebas de carga).")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=5055)
+    args = parser.parse_args()
+    crear_app().run(host=args.host, port=args.puerto, threaded=True, debug=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+# loadtest/sesiones.py
+# Usuarios virtuales: cada uno tiene su sesión (cookies) y recorre la app como una persona
+# mirando la tormenta: mapa con popups, dashboard que se refresca, gráficos con rangos
+# variados y, de vez en cuando, un reporte Excel.
+
+import json
+import random
+import time
+import uuid
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime, timedelta
+from http.cookiejar import CookieJar
+
+# Rangos de los gráficos: (días, peso). La mayoría mira el último día o la última semana.
+RANGOS_DIAS = [(1, 45), (7, 30), (31, 17), (365, 8)]
+
+# Peso de cada tipo de sesión (se puede cambiar con --mezcla)
+MEZCLA_SESIONES = {'mapa': 3, 'dashboard': 3, 'graficos': 3, 'reporte': 1}
+
+
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    # Cada pedido se mide solo: el redirect (p. ej. después del login) no se sigue
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Cliente:
+
+    def __init__(self, base_url, registro, etapa, detener, pausa_factor=1.0, rnd=None):
+        self.base_url = base_url.rstrip('/')
+        self.registro = registro
+        self.etapa = etapa            # callable: etapa de carga actual (para el resumen)
+        self.detener = detener        # threading.Event de este usuario
+        self.pausa_factor = pausa_factor
+        self.rnd = rnd or random.Random()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _SinRedirecciones())
+        self.sensores = {}            # ema_id -> [sensor_info]
+
+    def pausa(self, minimo, maximo):
+        """Tiempo de lectura del usuario. Devuelve False si hay que terminar."""
+        return not self.detener.wait(self.rnd.uniform(minimo, maximo) * self.pausa_factor)
+
+    def pedir(self, endpoint, ruta, params=None, datos=None, timeout=120):
+        """Hace el pedido y lo anota en el registro. Devuelve (estado, cuerpo) o (estado, None)."""
+        url = self.base_url + ruta
+        if params: url += '?' + urllib.parse.urlencode(params, doseq=True)
+        cuerpo = urllib.parse.urlencode(datos, doseq=True).encode() if datos is not None else None
+        inicio = time.perf_counter()
+        try:
+            with self.opener.open(urllib.request.Request(url, data=cuerpo), timeout=timeout) as respuesta:
+                contenido = respuesta.read()
+                estado = respuesta.status
+        except urllib.error.HTTPError as e:
+            contenido, estado = None, e.code
+            e.close()
+        except (urllib.error.URLError, OSError) as e:
+            contenido, estado = None, type(getattr(e, 'reason', e)).__name__
+        self.registro.anotar(endpoint, (time.perf_counter() - inicio) * 1000, estado, self.etapa())
+        return estado, contenido
+
+    def pedir_json(self, endpoint, ruta, params=None, timeout=120):
+        estado, contenido = self.pedir(endpoint, ruta, params=params, timeout=timeout)
+        if not (isinstance(estado, int) and estado < 400) or not contenido: return None
+        try:
+            return json.loads(contenido)
+        except ValueError:
+            return None
+
+    def primer_evento_sse(self, endpoint, ruta, timeout=45):
+        """Abre el stream SSE, mide hasta el primer 'data:' y lo cierra."""
+        inicio = time.perf_counter()
+        estado = 'sin_evento'
+        try:
+            with self.opener.open(self.base_url + ruta, timeout=timeout) as respuesta:
+                for linea in respuesta:
+                    if linea.startswith(b'data:'):
+                        estado = respuesta.status
+                        break
+                    if self.detener.is_set(): return
+        except urllib.error.HTTPError as e:
+            estado = e.code
+            e.close()
+        except (urllib.error.URLError, OSError) as e:
+            estado = type(getattr(e, 'reason', e)).__name__
+        self.registro.anotar(endpoint, (time.perf_counter() - inicio) * 1000, estado, self.etapa())
+
+    # --- helpers de datos ---
+    def rango(self):
+        dias = self.rnd.choices([d for d, _ in RANGOS_DIAS], weights=[p for _, p in RANGOS_DIAS])[0]
+        fin = date.today()
+        return (fin - timedelta(days=dias - 1)).isoformat(), fin.isoformat()
+
+    def sensores_de(self, ema_id):
+        if ema_id not in self.sensores:
+            lista = self.pedir_json('/get-sensors/<ema>', f'/get-sensors/{ema_id}') or []
+            self.sensores[ema_id] = [f"{s['id']}|{s['table_name']}|{s['nombre']}" for s in lista if isinstance(s, dict)]
+        return self.sensores[ema_id]
+
+
+# ==============================================================================
+# === SESIONES =================================================================
+# ==============================================================================
+def login(cliente, usuario, clave):
+    estado, _ = cliente.pedir('POST /login', '/login', datos={'username': usuario, 'password': clave})
+    # Login correcto = redirect al inicio
+    return estado in (302, 303)
+
+
+def sesion_mapa(cliente, emas):
+    """Abre el mapa y clickea algunas estaciones (popup con el resumen)."""
+    cliente.pedir('/', '/')
+    for _ in range(cliente.rnd.randint(1, 5)):
+        if not cliente.pausa(1, 4): return
+        cliente.pedir('/api/dashboard-data/<ema>', f'/api/dashboard-data/{cliente.rnd.choice(emas)}')
+
+
+def sesion_dashboard(cliente, emas):
+    """Dashboard de una estación: stream en vivo o, como los navegadores viejos, polling."""
+    cliente.pedir('/graficos', '/graficos')
+    ema_id = cliente.rnd.choice(emas)
+    if cliente.rnd.random() < 0.3:
+        cliente.primer_evento_sse('/api/dashboard-stream (1er evento)', f'/api/dashboard-stream/{ema_id}')
+        return
+    for _ in range(cliente.rnd.randint(3, 8)):
+        cliente.pedir('/api/dashboard-data/<ema>', f'/api/dashboard-data/{ema_id}')
+        if not cliente.pausa(5, 15): return
+        if cliente.rnd.random() < 0.2: ema_id = cliente.rnd.choice(emas)
+
+
+def sesion_graficos(cliente, emas):
+    """Gráficos personalizados con rangos mezclados; a veces compara estaciones o hace zoom."""
+    cliente.pedir('/graficos-personalizados', '/graficos-personalizados')
+    for _ in range(cliente.rnd.randint(1, 3)):
+        ema_id = cliente.rnd.choice(emas)
+        sensores = cliente.sensores_de(ema_id)
+        if not sensores or not cliente.pausa(2, 6): return
+        elegidos = cliente.rnd.sample(sensores, min(len(sensores), cliente.rnd.randint(1, 2)))
+        fecha_inicio, fecha_fin = cliente.rango()
+        params = {'ema_id': [ema_id], 'sensor_info': elegidos, 'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin,
+                  'request_token': uuid.uuid4().hex, 'chart_key': 'loadtest'}
+        if cliente.rnd.random() < 0.15:
+            params['ema_id'] += cliente.rnd.sample([e for e in emas if e != ema_id], min(2, len(emas) - 1))
+            cliente.pedir('/api/get-chart-data (comparar)', '/api/get-chart-data', params=params)
+        else:
+            cliente.pedir('/api/get-chart-data', '/api/get-chart-data', params=params)
+
+        if cliente.rnd.random() < 0.3 and cliente.pausa(1, 3):
+            # Zoom sobre un tramo del rango
+            hasta = datetime.combine(date.fromisoformat(fecha_fin), datetime.max.time())
+            desde = hasta - timedelta(hours=cliente.rnd.choice([6, 24, 72]))
+            cliente.pedir('/api/chart-tiles', '/api/chart-tiles', params={
+                'ema_id': ema_id, 'sensor_info': elegidos[0], 'ancho_px': 800,
+                'desde': int(desde.timestamp() * 1000), 'hasta': int(hasta.timestamp() * 1000),
+            })
+    if cliente.rnd.random() < 0.1:
+        fecha_inicio, fecha_fin = cliente.rango()
+        cliente.pedir('/api/rainfall-analytics', '/api/rainfall-analytics', params={'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin})
+
+
+def sesion_reporte(cliente, emas):
+    """Página de reportes y la descarga de un Excel (rango de una semana a un mes)."""
+    cliente.pedir('/reportes', '/reportes')
+    ema_id = cliente.rnd.choice(emas)
+    sensores = cliente.sensores_de(ema_id)
+    if not sensores or not cliente.pausa(3, 10): return
+    elegidos = cliente.rnd.sample(sensores, min(len(sensores), cliente.rnd.randint(1, 3)))
+    fin = date.today()
+    inicio = fin - timedelta(days=cliente.rnd.choice([7, 14, 31]) - 1)
+    cliente.pedir('POST /download-report', '/download-report', datos={
+        'ema_id': ema_id, 'fecha_inicio': inicio.isoformat(), 'fecha_fin': fin.isoformat(),
+        'sensor_info': elegidos,
+        'process_type': ['pluvio_sum' if 'pluvio' in s.lower() else 'avg_hourly' for s in elegidos],
+        'request_token': uuid.uuid4().hex,
+    }, timeout=300)
+
+
+SESIONES = {
+    'mapa': sesion_mapa,
+    'dashboard': sesion_dashboard,
+    'graficos': sesion_graficos,
+    'reporte': sesion_reporte,
+}
+
+
+def usuario_virtual(cliente, usuario, clave, emas, mezcla):
+    """Loop de un usuario: login y sesiones al azar (según la mezcla) hasta que lo detengan."""
+    if not cliente.pausa(0, 2): return
+    if not login(cliente, usuario, clave): return
+    nombres = list(mezcla)
+    pesos = [mezcla[n] for n in nombres]
+    while not cliente.detener.is_set():
+        SESIONES[cliente.rnd.choices(nombres, weights=pesos)[0]](cliente, emas)
+        if not cliente.pausa(2, 8): return
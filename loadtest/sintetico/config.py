@@ -0,0 +1,45 @@
+# loadtest/sintetico/config.py
+# Reemplaza a config.py cuando la app corre contra el backend sintético (loadtest/servidor.py
+# pone este directorio primero en sys.path; los procesos hijos heredan el mismo sys.path).
+# Tiene los mismos nombres que config.py; los valores de carga se pueden pisar por variables de entorno.
+
+import os
+from werkzeug.security import generate_password_hash
+
+SECRET_KEY = os.environ.get('LOADTEST_SECRET_KEY', 'prueba-de-carga')
+OWM_API_KEY = ''
+
+DATABASE_CONNECTIONS = {
+    'db_principal': {'driver': 'sintetico', 'display_name': 'Sintética (prueba de carga)'},
+}
+
+TABLE_KEYWORD_MAP = {
+    'medicion_pluviometrica': ['pluvio', 'lluvia'],
+    'medicion_limnigrafica': ['limni', 'nivel'],
+    'medicion_temperatura_atmosferica': ['temperatura'],
+    'medicion_anemometrica': ['anemo', 'velocidad'],
+    'medicion_direccion_viento': ['veleta', 'direccion'],
+    'medicion_barometrica': ['barometro', 'presion'],
+    'medicion_bateria': ['bateria'],
+}
+
+# Usuarios de la prueba (la contraseña es la misma para todos)
+LOADTEST_PASSWORD = os.environ.get('LOADTEST_PASSWORD', 'carga')
+_hash = generate_password_hash(LOADTEST_PASSWORD)
+# Una cuenta por usuario virtual ('carga_1'...'carga_N'): el control de admisión limita por usuario
+LOADTEST_CUENTAS = int(os.environ.get('LOADTEST_CUENTAS', 500))
+APP_USERS = {
+    '1': {'username': 'carga', 'email': 'carga@localhost', 'password_hash': _hash, 'role': 'admin'},
+    '2': {'username': 'carga_restringido', 'email': 'restringido@localhost', 'password_hash': _hash, 'role': 'restricted'},
+}
+for _n in range(1, LOADTEST_CUENTAS + 1):
+    APP_USERS[str(_n + 2)] = {'username': f'carga_{_n}', 'email': f'carga_{_n}@localhost', 'password_hash': _hash, 'role': 'admin'}
+
+# Cada proceso arma su caché (el backend sintético no escanea nada)
+SENSOR_CACHE_SNAPSHOT_PATH = None
+
+# --- Backend sintético (loadtest/repositorio_sintetico.py) ---
+SINTETICO_EMAS = int(os.environ.get('SINTETICO_EMAS', 15))
+SINTETICO_MINUTOS = int(os.environ.get('SINTETICO_MINUTOS', 10))
+SINTETICO_LATENCIA_MS = float(os.environ.get('SINTETICO_LATENCIA_MS', 5))
+SINTETICO_MS_POR_MIL_FILAS = float(os.environ.get('SINTETICO_MS_POR_MIL_FILAS', 2))
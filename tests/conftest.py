@@ -0,0 +1,8 @@
+# tests/conftest.py
+# Los tests usan la configuración sintética (loadtest/sintetico/config.py): no hace falta
+# el config.py real ni una BD.
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(RAIZ, 'loadtest', 'sintetico'), RAIZ]
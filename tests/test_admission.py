@@ -0,0 +1,84 @@
+# tests/test_admission.py
+# Control de admisión (app/admission.py): topes global y por usuario, y cola de espera.
+import threading
+import time
+
+import pytest
+
+from app.admission import ControlDeAdmision, Rechazado
+
+
+def _esperar(condicion):
+    for _ in range(500):
+        if condicion(): return
+        time.sleep(0.01)
+    raise AssertionError('no se cumplió a tiempo')
+
+
+class Pedido:
+    """Una petición en otro hilo que, una vez admitida, sigue activa hasta soltar()."""
+    def __init__(self, control, usuario):
+        self.admitido, self.terminar = threading.Event(), threading.Event()
+        self.error = None
+        self.hilo = threading.Thread(target=self._correr, args=(control, usuario))
+        self.hilo.start()
+
+    def _correr(self, control, usuario):
+        try:
+            with control.admitir(usuario):
+                self.admitido.set()
+                self.terminar.wait(5)
+        except Rechazado as r:
+            self.error = r
+
+    def soltar(self):
+        self.terminar.set()
+        self.hilo.join(5)
+
+
+def test_los_que_esperan_cuentan_para_el_tope_por_usuario():
+    control = ControlDeAdmision(max_global=1, max_por_usuario=2, max_en_espera=16, espera_max_segundos=5)
+    activo = Pedido(control, 'a')
+    assert activo.admitido.wait(5)
+    esperando = Pedido(control, 'a')
+    _esperar(lambda: control.en_espera == 1)
+
+    # Una activa y una en cola: la tercera del mismo usuario no llega a encolarse
+    with pytest.raises(Rechazado) as rechazo:
+        with control.admitir('a'): pass
+    assert rechazo.value.status == 429
+    assert control.en_espera == 1
+
+    # Otro usuario sí puede esperar
+    otro = Pedido(control, 'b')
+    _esperar(lambda: control.en_espera == 2)
+    for pedido in (activo, esperando, otro):
+        pedido.soltar()
+    assert esperando.error is None and otro.error is None
+    assert control.por_usuario == {} and control.activos == 0
+
+
+def test_espera_vencida_libera_el_cupo_del_usuario():
+    control = ControlDeAdmision(max_global=1, max_por_usuario=1, max_en_espera=16, espera_max_segundos=0.05)
+    activo = Pedido(control, 'a')
+    assert activo.admitido.wait(5)
+    with pytest.raises(Rechazado) as rechazo:
+        with control.admitir('b'): pass
+    assert rechazo.value.status == 503
+    assert control.por_usuario == {'a': 1}
+    activo.soltar()
+    with control.admitir('b'):
+        assert control.por_usuario == {'b': 1}
+
+
+def test_cola_llena():
+    control = ControlDeAdmision(max_global=1, max_por_usuario=5, max_en_espera=1, espera_max_segundos=5)
+    activo = Pedido(control, 'a')
+    assert activo.admitido.wait(5)
+    esperando = Pedido(control, 'b')
+    _esperar(lambda: control.en_espera == 1)
+    with pytest.raises(Rechazado) as rechazo:
+        with control.admitir('c'): pass
+    assert rechazo.value.status == 503 and 'c' not in control.por_usuario
+    activo.soltar(); esperando.soltar()
+    assert control.get_stats()['admitidos'] == 2
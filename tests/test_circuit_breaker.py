@@ -0,0 +1,122 @@
+# tests/test_circuit_breaker.py
+# Disyuntor por BD (app/circuit_breaker.py): qué errores cuentan y el ciclo
+# cerrado -> abierto -> (prueba de fondo) -> cerrado.
+import time
+
+import pytest
+
+from app import circuit_breaker
+from app.circuit_breaker import BaseDatosNoDisponible
+
+
+# Mismos nombres de clase que los drivers (la clasificación es por nombre)
+class OperationalError(Exception):
+    pass
+
+
+class ProgrammingError(Exception):
+    pass
+
+
+class QueryCanceledError(OperationalError):
+    pass
+
+
+class PgOperationalError(OperationalError):
+    def __init__(self, mensaje, pgcode=None):
+        super().__init__(mensaje)
+        self.pgcode = pgcode
+
+
+@pytest.fixture(autouse=True)
+def circuitos(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, '_circuitos', {})
+    monkeypatch.setattr(circuit_breaker, 'CIRCUIT_SEGUNDOS_ABIERTO', 0.05)
+
+
+@pytest.mark.parametrize('error, esperado', [
+    (BaseDatosNoDisponible('x'), True),
+    (PgOperationalError('server closed the connection unexpectedly'), True),
+    (PgOperationalError('the database system is shutting down', '57P01'), True),
+    (PgOperationalError('canceling statement due to statement timeout', '57014'), False),
+    (QueryCanceledError('canceling statement due to user request'), False),
+    (OperationalError('08S01', '[08S01] Communication link failure'), True),
+    (OperationalError('HYT01', '[HYT01] Connection timeout expired'), True),
+    (OperationalError('28000', "[28000] Login failed for user 'x'"), True),
+    (OperationalError('HYT00', '[HYT00] Query timeout expired'), False),
+    (OperationalError('HY008', '[HY008] Operation canceled'), False),
+    (ProgrammingError('42P01', 'relation does not exist'), False),
+    (ValueError('otra cosa'), False),
+])
+def test_es_falla_de_conexion(error, esperado):
+    assert circuit_breaker.es_falla_de_conexion(error) is esperado
+
+
+def _caida():
+    raise OperationalError('08001', '[08001] Unable to connect')
+
+
+class _Conexion:
+    def close(self):
+        pass
+
+
+def _esperar_estado(db_key, estado, limite=2.0):
+    fin = time.monotonic() + limite
+    while circuit_breaker._circuito(db_key, None).estado != estado and time.monotonic() < fin:
+        time.sleep(0.01)
+    return circuit_breaker._circuito(db_key, None).estado
+
+
+def test_abre_tras_fallas_seguidas_y_cierra_cuando_vuelve():
+    for _ in range(circuit_breaker.CIRCUIT_FALLOS_PARA_ABRIR - 1):
+        with pytest.raises(BaseDatosNoDisponible):
+            circuit_breaker.conectar('bd', None, _caida)
+    assert circuit_breaker._circuito('bd', None).estado == 'cerrado'
+
+    # La falla que completa el umbral abre el circuito, pero la prueba de fondo sigue fallando
+    with pytest.raises(BaseDatosNoDisponible):
+        circuit_breaker.conectar('bd', None, _caida)
+    assert circuit_breaker.get_stats()['bd']['aperturas'] == 1
+    time.sleep(0.15)
+    assert circuit_breaker._circuito('bd', None).estado in ('abierto', 'semiabierto')
+
+    # Abierto: se rechaza sin intentar conectar
+    intentos = []
+    with pytest.raises(BaseDatosNoDisponible):
+        circuit_breaker.conectar('bd', None, lambda: intentos.append(1) or _Conexion())
+    assert intentos == []
+
+    # El servidor vuelve: la prueba de fondo cierra el circuito
+    circuit_breaker._circuito('bd', None).abrir_conexion = _Conexion
+    assert _esperar_estado('bd', 'cerrado') == 'cerrado'
+    assert isinstance(circuit_breaker.conectar('bd', None, _Conexion), _Conexion)
+    assert circuit_breaker.get_stats()['bd']['fallos_seguidos'] == 0
+
+
+def test_un_exito_resetea_las_fallas():
+    for _ in range(circuit_breaker.CIRCUIT_FALLOS_PARA_ABRIR - 1):
+        with pytest.raises(BaseDatosNoDisponible):
+            circuit_breaker.conectar('bd', None, _caida)
+    circuit_breaker.conectar('bd', None, _Conexion)
+    with pytest.raises(BaseDatosNoDisponible):
+        circuit_breaker.conectar('bd', None, _caida)
+    assert circuit_breaker._circuito('bd', None).estado == 'cerrado'
+
+
+def test_errores_de_sql_no_cuentan():
+    def sql_invalido():
+        raise ProgrammingError('42601', 'syntax error')
+    for _ in range(circuit_breaker.CIRCUIT_FALLOS_PARA_ABRIR + 1):
+        with pytest.raises(ProgrammingError):
+            circuit_breaker.conectar('bd', None, sql_invalido)
+        assert circuit_breaker.anotar_error('bd', None, ProgrammingError('42601', 'x')) is False
+    assert circuit_breaker._circuito('bd', None).estado == 'cerrado'
+
+
+def test_cada_replica_tiene_su_disyuntor():
+    for _ in range(circuit_breaker.CIRCUIT_FALLOS_PARA_ABRIR):
+        assert circuit_breaker.anotar_error('bd', 0, OperationalError('08S01', 'link'))
+    with pytest.raises(BaseDatosNoDisponible):
+        circuit_breaker.verificar('bd', 0)
+    circuit_breaker.verificar('bd')
@@ -0,0 +1,45 @@
+# tests/test_dashboard_stream.py
+# SSE del dashboard (services.stream_dashboard_service): los valores de columnas
+# numeric/decimal llegan como Decimal y se serializan igual que en /api/dashboard-data.
+import json
+from datetime import datetime
+from decimal import Decimal
+from queue import Queue
+from types import SimpleNamespace
+
+from flask import Flask
+
+from app import live_stream, services
+
+RAW = {
+    'pluvio_sum_hoy': {'valor': Decimal('3.40'), 'timestamp': None},
+    'presion': {'valor': Decimal('1013.27'), 'timestamp': datetime(2024, 1, 1, 10, 5)},
+    'bateria': {'valor': Decimal('12.634'), 'timestamp': datetime(2024, 1, 1, 10, 0)},
+    'temperatura': {'valor': 21.46, 'timestamp': datetime(2024, 1, 1, 10, 5)},
+}
+
+
+def test_evento_con_decimales(monkeypatch):
+    cola = Queue()
+    cola.put(RAW)
+    monkeypatch.setattr(live_stream, 'suscribir', lambda *args: cola)
+    monkeypatch.setattr(live_stream, 'desuscribir', lambda *args: None)
+    monkeypatch.setattr(services, 'get_repo_for_db', lambda db_key: SimpleNamespace(
+        get_latest_measurement_ts_repo=None, get_dashboard_data_repo=None,
+    ))
+    monkeypatch.setattr(services, '_puede_ver_bateria', lambda: True)
+
+    app = Flask(__name__)
+    with app.app_context():
+        eventos = services.stream_dashboard_service('db_principal', 1)
+        assert next(eventos) == "retry: 10000\n\n"
+        evento = next(eventos)
+        eventos.close()
+        esperado = json.loads(app.json.dumps(services.format_dashboard_data(RAW, True)))
+
+    # Un solo renglón 'data:' por evento
+    assert evento.startswith("data: ") and evento.endswith("\n\n") and "\n" not in evento[:-2]
+    datos = json.loads(evento[len("data: "):])
+    assert datos == esperado
+    assert float(datos['presion']['valor_num']) == 1013.3
+    assert datos['bateria']['valor_str'] == "12.63 V"
@@ -0,0 +1,120 @@
+# tests/test_estimar_reporte.py
+# Preflight de reportes (services.estimar_reporte_service): cada forma de entrega, con un
+# estimar_filas_repo de mentira por motor (db_principal = PostgreSQL, db_sql = SQL Server).
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from app import services
+from app.circuit_breaker import BaseDatosNoDisponible
+
+SENSOR = '1|medicion_pluviometrica|Pluviometro'
+
+
+class RepoFalso:
+    """Siempre estima las mismas filas crudas (o lanza 'filas' si es una excepción)."""
+    def __init__(self):
+        self.filas = 0
+        self.llamadas = []
+
+    def estimar_filas_repo(self, db_key, ema_id, sensor_info, fecha_inicio, fecha_fin):
+        self.llamadas.append((db_key, ema_id, sensor_info, fecha_inicio, fecha_fin))
+        if isinstance(self.filas, Exception): raise self.filas
+        return self.filas
+
+
+@pytest.fixture
+def repos(monkeypatch):
+    repos = {'db_principal': RepoFalso(), 'db_sql': RepoFalso()}
+    monkeypatch.setattr(services, 'get_repo_for_db', lambda db_key: repos[db_key])
+    return repos
+
+
+@pytest.fixture(params=['db_principal', 'db_sql'])
+def db_key(request):
+    return request.param
+
+
+def _form(*pares, process_type='raw', **extra):
+    campos = [('ema_id', '1'), ('fecha_inicio', '2024-01-01'), ('fecha_fin', '2024-01-10'),
+              ('sensor_info', SENSOR), ('process_type', process_type)]
+    return MultiDict(campos + list(pares) + list(extra.items()))
+
+
+@pytest.mark.parametrize('filas, entrega', [
+    (0, 'excel'),
+    (services.REPORT_INLINE_MAX_FILAS, 'excel'),
+    (services.REPORT_INLINE_MAX_FILAS + 1, 'csv'),
+    (services.REPORT_CSV_MAX_FILAS, 'csv'),
+    (services.REPORT_CSV_MAX_FILAS + 1, 'trabajo'),
+    (services.REPORT_JOB_MAX_FILAS, 'trabajo'),
+    (services.REPORT_JOB_MAX_FILAS + 1, 'rechazar'),
+])
+def test_entrega_segun_filas(repos, db_key, filas, entrega):
+    repos[db_key].filas = filas
+    resultado = services.estimar_reporte_service(db_key, _form())
+    assert resultado['entrega'] == entrega
+    assert resultado['filas'] == filas
+    assert resultado['megabytes'] == round(filas * services.REPORT_BYTES_POR_FILA / 1e6, 1)
+    assert repos[db_key].llamadas == [(db_key, '1', SENSOR, '2024-01-01', '2024-01-10')]
+
+
+def test_rechazo_informa_las_filas(repos):
+    repos['db_principal'].filas = 45000000
+    resultado = services.estimar_reporte_service('db_principal', _form())
+    assert resultado['entrega'] == 'rechazar'
+    assert '45.000.000' in resultado['mensaje']
+
+
+def test_procesamiento_agregado_cuenta_buckets(repos, db_key):
+    # 10 días de acumulado diario: a lo sumo 10 filas, por más crudas que haya
+    repos[db_key].filas = 10000000
+    resultado = services.estimar_reporte_service(db_key, _form(process_type='pluvio_sum'))
+    assert (resultado['entrega'], resultado['filas']) == ('excel', 10)
+
+
+def test_sensor_repetido_se_estima_una_vez(repos, db_key):
+    repos[db_key].filas = 200000
+    resultado = services.estimar_reporte_service(db_key, _form(('sensor_info', SENSOR), ('process_type', 'raw')))
+    assert (resultado['entrega'], resultado['filas']) == ('csv', 400000)
+    assert len(repos[db_key].llamadas) == 1
+
+
+def test_varias_bases_suman(repos):
+    repos['db_principal'].filas = repos['db_sql'].filas = 100000
+    form = _form(**{'ema_id@db_sql': '7'})
+    resultado = services.estimar_reporte_service(['db_principal', 'db_sql'], form)
+    assert (resultado['entrega'], resultado['filas']) == ('excel', 200000)
+    # Cada BD se estima con sus propios campos (FormularioPorDB)
+    assert repos['db_principal'].llamadas[0][1] == '1'
+    assert repos['db_sql'].llamadas[0][1] == '7'
+
+
+@pytest.mark.parametrize('filas', [services.REPORT_INLINE_MAX_FILAS, services.REPORT_CSV_MAX_FILAS])
+def test_varias_bases_sobre_el_limite_se_rechazan(repos, filas):
+    # Combinar bases solo se hace en Excel: nada de CSV ni trabajos en segundo plano
+    repos['db_principal'].filas = repos['db_sql'].filas = filas
+    resultado = services.estimar_reporte_service(('db_principal', 'db_sql'), _form())
+    assert resultado['entrega'] == 'rechazar'
+    assert 'varias bases de datos' in resultado['mensaje']
+
+
+def test_si_la_estimacion_falla_sigue_como_excel(repos, db_key):
+    repos[db_key].filas = RuntimeError('EXPLAIN falló')
+    resultado = services.estimar_reporte_service(db_key, _form())
+    assert resultado == {
+        'filas': None, 'megabytes': None, 'entrega': 'excel',
+        'mensaje': "No se pudo estimar el tamaño del reporte.",
+    }
+
+
+def test_falla_de_una_de_varias_bases_sigue_como_excel(repos):
+    repos['db_principal'].filas = services.REPORT_JOB_MAX_FILAS
+    repos['db_sql'].filas = ValueError('sin muestra')
+    resultado = services.estimar_reporte_service(['db_principal', 'db_sql'], _form())
+    assert (resultado['entrega'], resultado['filas']) == ('excel', None)
+
+
+def test_base_caida_no_se_disimula(repos, db_key):
+    repos[db_key].filas = BaseDatosNoDisponible("caída")
+    with pytest.raises(BaseDatosNoDisponible):
+        services.estimar_reporte_service(db_key, _form())
@@ -0,0 +1,72 @@
+# tests/test_rainfall.py
+# Incrementos (regla Areco) y acumulados en ventanas móviles de app/rainfall.py.
+import numpy as np
+import pytest
+
+from app import rainfall
+
+
+def test_incrementos_de_pluviometro_comun():
+    grupos = np.array([0, 0, 0])
+    valores = np.array([0.2, 0.0, 1.4])
+    np.testing.assert_array_equal(rainfall.incrementos(grupos, valores, [False]), valores)
+
+
+def test_incrementos_de_contador_con_reinicio():
+    # Contador tipo Areco: diferencia con la anterior; si baja, se reinició y vale lo leído
+    grupos = np.zeros(6, dtype=int)
+    valores = np.array([5.0, 5.2, 5.7, 5.7, 0.3, 0.8])
+    np.testing.assert_allclose(rainfall.incrementos(grupos, valores, [True]), [0.0, 0.2, 0.5, 0.0, 0.3, 0.5])
+
+
+def test_incrementos_no_cruzan_de_grupo():
+    grupos = np.array([0, 0, 1, 1, 2, 2])
+    valores = np.array([1.0, 2.0, 10.0, 10.5, 0.4, 0.1])
+    inc = rainfall.incrementos(grupos, valores, [False, True, True])
+    # La primera medición de cada contador no aporta (ni se resta de la del grupo anterior)
+    np.testing.assert_allclose(inc, [1.0, 2.0, 0.0, 0.5, 0.0, 0.1])
+
+
+def _fuerza_bruta(grupos, timestamps, inc, w):
+    segundos = timestamps.astype('datetime64[s]').astype('int64')
+    return np.array([
+        inc[(grupos == grupos[i]) & (segundos > segundos[i] - w) & (segundos <= segundos[i])].sum()
+        for i in range(len(inc))
+    ])
+
+
+def test_totales_moviles_contra_fuerza_bruta():
+    rng = np.random.default_rng(3)
+    partes = []
+    for g in range(3):
+        saltos = rng.integers(60, 3 * 3600, size=400).astype('timedelta64[s]')
+        partes.append(np.datetime64('2024-02-01T00:00:00', 's') + np.cumsum(saltos))
+    grupos = np.repeat(np.arange(3), 400)
+    timestamps = np.concatenate(partes).astype('datetime64[ns]')
+    inc = rng.exponential(0.5, size=len(timestamps))
+
+    totales = rainfall.totales_moviles(grupos, timestamps, inc)
+    assert set(totales) == set(rainfall.VENTANAS)
+    for nombre, w in rainfall.VENTANAS.items():
+        np.testing.assert_allclose(totales[nombre], _fuerza_bruta(grupos, timestamps, inc, w), atol=1e-9)
+
+
+def test_ventana_abierta_a_izquierda():
+    # (t - 1h, t]: la medición de exactamente una hora antes no entra
+    timestamps = np.array(['2024-01-01T00:00', '2024-01-01T00:30', '2024-01-01T01:00'], dtype='datetime64[ns]')
+    totales = rainfall.totales_moviles(np.zeros(3, dtype=int), timestamps, np.ones(3), {'1h': 3600})
+    np.testing.assert_array_equal(totales['1h'], [1.0, 2.0, 2.0])
+
+
+def test_contador_reiniciado_en_ventanas():
+    timestamps = np.array(['2024-01-01T00:00', '2024-01-01T00:10', '2024-01-01T00:20', '2024-01-01T00:30'], dtype='datetime64[ns]')
+    grupos = np.zeros(4, dtype=int)
+    inc = rainfall.incrementos(grupos, np.array([120.0, 121.0, 0.5, 1.0]), [True])
+    totales = rainfall.totales_moviles(grupos, timestamps, inc, {'1h': 3600})
+    # Sin la regla el reinicio restaría ~120 mm
+    np.testing.assert_allclose(totales['1h'], [0.0, 1.0, 1.5, 2.0])
+
+
+def test_totales_moviles_vacio():
+    vacio = rainfall.totales_moviles(np.array([], dtype=int), np.array([], dtype='datetime64[ns]'), np.array([]))
+    assert all(len(v) == 0 for v in vacio.values())
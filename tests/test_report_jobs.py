@@ -0,0 +1,57 @@
+# tests/test_report_jobs.py
+# Reportes en segundo plano (app/report_jobs.py): el directorio y los archivos solo los
+# puede leer el usuario de la app.
+import os
+import stat
+import time
+import zipfile
+
+import pytest
+
+from app import report_jobs
+
+
+@pytest.fixture
+def directorio(tmp_path, monkeypatch):
+    ruta = tmp_path / 'reportes'
+    monkeypatch.setattr(report_jobs, 'REPORT_JOBS_DIR', str(ruta))
+    # Un umask abierto no debe filtrarse a los archivos
+    umask = os.umask(0o022)
+    yield ruta
+    os.umask(umask)
+
+
+def _esperar(trabajo_id):
+    for _ in range(500):
+        estado = report_jobs.obtener(trabajo_id)
+        if estado['estado'] in ('listo', 'error'): return estado
+        time.sleep(0.01)
+    raise AssertionError('el trabajo no terminó')
+
+
+def _permisos(ruta):
+    return stat.S_IMODE(os.stat(ruta).st_mode)
+
+
+def test_archivos_privados(directorio):
+    def generar():
+        yield b'tiempo,valor\r\n'
+        yield b'2024-01-01 00:00:00,1.5\r\n'
+    estado = report_jobs.encolar('carga', 'prueba', 'reporte.csv', generar, filas_estimadas=1)
+    estado = _esperar(estado['id'])
+    assert estado['estado'] == 'listo'
+
+    assert _permisos(directorio) == 0o700
+    assert sorted(os.listdir(directorio)) == [f"{estado['id']}.json", f"{estado['id']}.zip"]
+    for nombre in os.listdir(directorio):
+        assert _permisos(directorio / nombre) == 0o600
+    with zipfile.ZipFile(report_jobs.ruta_archivo(estado)) as zf:
+        assert zf.read('reporte.csv') == b'tiempo,valor\r\n2024-01-01 00:00:00,1.5\r\n'
+
+
+@pytest.mark.skipif(not hasattr(os, 'geteuid') or os.geteuid() != 0, reason='chown requiere root')
+def test_directorio_de_otro_usuario(directorio):
+    directorio.mkdir(mode=0o777)
+    os.chown(directorio, 65534, 65534)
+    with pytest.raises(PermissionError):
+        report_jobs.encolar('carga', 'prueba', 'reporte.csv', lambda: iter([b'x']))
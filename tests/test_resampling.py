@@ -0,0 +1,66 @@
+# tests/test_resampling.py
+# El motor vectorizado (app/resampling.py) contra pandas.resample sobre una serie irregular.
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import resampling
+
+# ancho de resampling -> (frecuencia, origen) equivalentes en pandas
+ANCHOS = {
+    '15min': ('15min', 'epoch'),
+    '1h': ('1h', 'epoch'),
+    '3h': ('3h', 'epoch'),
+    # En pandas 'D' es un día de calendario (no admite origin): se usan horas
+    '1D': ('24h', 'epoch'),
+    # Semanas de lunes a domingo
+    '1W': ('168h', pd.Timestamp('1970-01-05')),
+}
+
+
+@pytest.fixture(scope='module')
+def serie():
+    rng = np.random.default_rng(7)
+    # Mediciones cada 1 a 20 minutos durante ~3 semanas, con huecos de varias horas
+    saltos = rng.integers(60, 1200, size=3000).astype('timedelta64[s]')
+    saltos[rng.choice(3000, size=15, replace=False)] += np.timedelta64(6, 'h')
+    timestamps = (np.datetime64('2024-03-06T07:13:00', 'ns') + np.cumsum(saltos)).astype('datetime64[ns]')
+    valores = rng.gamma(2.0, 3.0, size=len(timestamps))
+    return timestamps, valores
+
+
+@pytest.mark.parametrize('ancho', ANCHOS)
+def test_igual_a_pandas(serie, ancho):
+    timestamps, valores = serie
+    resultados = resampling.resample(timestamps, valores, [(ancho, f) for f in resampling.FUNCIONES])
+
+    frecuencia, origen = ANCHOS[ancho]
+    grupos = pd.Series(valores, index=pd.DatetimeIndex(timestamps)).resample(frecuencia, origin=origen)
+    cantidad = grupos.count()
+    for funcion in resampling.FUNCIONES:
+        # pandas deja los buckets vacíos; resample solo devuelve los que tienen datos
+        esperado = getattr(grupos, funcion)()[cantidad > 0]
+        buckets, agregado = resultados[(ancho, funcion)]
+        np.testing.assert_array_equal(buckets, esperado.index.values.astype('datetime64[ns]'))
+        np.testing.assert_allclose(agregado, esperado.to_numpy(dtype='float64'), rtol=1e-12)
+
+
+def test_serie_vacia():
+    vacia = np.array([], dtype='datetime64[ns]')
+    buckets, agregado = resampling.resample(vacia, np.array([], dtype='float64'), [('1h', 'mean')])[('1h', 'mean')]
+    assert len(buckets) == len(agregado) == 0
+
+
+def test_funcion_desconocida():
+    with pytest.raises(ValueError):
+        resampling.resample(np.array(['2024-01-01'], dtype='datetime64[ns]'), np.array([1.0]), [('1h', 'median')])
+
+
+def test_filas_sin_nulos_y_ordenadas():
+    filas = [
+        (pd.Timestamp('2024-01-01 02:00'), 3), (pd.Timestamp('2024-01-01 00:00'), None),
+        (pd.Timestamp('2024-01-01 01:00'), 2.5),
+    ]
+    timestamps, valores = resampling.series_desde_filas(filas)
+    np.testing.assert_array_equal(timestamps, np.array(['2024-01-01T01:00', '2024-01-01T02:00'], dtype='datetime64[ns]'))
+    np.testing.assert_array_equal(valores, [2.5, 3.0])
@@ -0,0 +1,131 @@
+# tests/test_result_cache.py
+# Caché de resultados (app/result_cache.py): vencimiento, descarte LRU por cantidad y por
+# bytes, invalidación por EMA y precalentamiento.
+import numpy as np
+import pytest
+
+from app import result_cache
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def monotonic(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(result_cache, 'time', reloj)
+    monkeypatch.setattr(result_cache, '_cache', result_cache.OrderedDict())
+    monkeypatch.setattr(result_cache, '_bytes', 0)
+    monkeypatch.setattr(result_cache, '_usos', result_cache.Counter())
+    monkeypatch.setattr(result_cache, '_stats', dict.fromkeys(result_cache._stats, 0))
+    return reloj
+
+
+class Calculo:
+    def __init__(self, valor='v'):
+        self.valor = valor
+        self.veces = 0
+
+    def __call__(self):
+        self.veces += 1
+        return self.valor
+
+
+EMA = ('db_principal', 1)
+
+
+def test_abierta_vence_antes_que_cerrada(reloj):
+    abierta, cerrada = Calculo(), Calculo()
+    for _ in range(2):
+        result_cache.obtener('abierta', abierta, True, EMA)
+        result_cache.obtener('cerrada', cerrada, False, EMA)
+    assert (abierta.veces, cerrada.veces) == (1, 1)
+
+    reloj.ahora += result_cache.RESULT_CACHE_TTL_ABIERTO + 1
+    result_cache.obtener('abierta', abierta, True, EMA)
+    result_cache.obtener('cerrada', cerrada, False, EMA)
+    assert (abierta.veces, cerrada.veces) == (2, 1)
+
+    reloj.ahora += result_cache.RESULT_CACHE_TTL_CERRADO
+    result_cache.obtener('cerrada', cerrada, False, EMA)
+    assert cerrada.veces == 2
+    assert result_cache.get_stats()['aciertos'] == 3
+
+
+def test_ttl_propio(reloj):
+    calculo = Calculo()
+    result_cache.obtener('k', calculo, False, EMA, ttl=5)
+    reloj.ahora += 4
+    result_cache.obtener('k', calculo, False, EMA, ttl=5)
+    reloj.ahora += 2
+    result_cache.obtener('k', calculo, False, EMA, ttl=5)
+    assert calculo.veces == 2
+
+
+def test_descarta_la_menos_usada_por_cantidad(reloj, monkeypatch):
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_MAX_ENTRADAS', 2)
+    a, b, c = Calculo('a'), Calculo('b'), Calculo('c')
+    result_cache.obtener('a', a, False, EMA)
+    result_cache.obtener('b', b, False, EMA)
+    result_cache.obtener('a', a, False, EMA)   # 'a' pasa a ser la más reciente
+    result_cache.obtener('c', c, False, EMA)
+    assert list(result_cache._cache) == ['a', 'c']
+    assert result_cache.get_stats()['descartados'] == 1
+
+
+def test_descarta_por_bytes(reloj, monkeypatch):
+    arreglo = np.zeros(100)   # 800 bytes
+    monkeypatch.setattr(result_cache, 'RESULT_CACHE_MAX_BYTES', 2 * arreglo.nbytes + 100)
+    for clave in ('a', 'b', 'c'):
+        result_cache.obtener(clave, Calculo(arreglo.copy()), False, EMA)
+    assert list(result_cache._cache) == ['b', 'c']
+    assert result_cache.get_stats()['bytes'] == 2 * arreglo.nbytes
+
+    # Más grande que el tope: se devuelve pero no se guarda
+    grande = Calculo(np.zeros(1000))
+    assert result_cache.obtener('grande', grande, False, EMA) is grande.valor
+    assert 'grande' not in result_cache._cache
+    assert result_cache.get_stats()['bytes'] == 2 * arreglo.nbytes
+
+
+def test_reemplazo_no_duplica_bytes(reloj):
+    result_cache.obtener('k', Calculo(np.zeros(10)), True, EMA)
+    reloj.ahora += result_cache.RESULT_CACHE_TTL_ABIERTO + 1
+    result_cache.obtener('k', Calculo(np.zeros(20)), True, EMA)
+    assert result_cache.get_stats()['bytes'] == np.zeros(20).nbytes
+
+
+def test_tamano_recorre_contenedores():
+    valor = {'timestamps': np.zeros(10, dtype='datetime64[ns]'), 'valores': [np.zeros(5)]}
+    assert result_cache.tamano(valor) >= 80 + 40
+
+
+def test_cachear_si(reloj):
+    calculo = Calculo([1, 2, 3])
+    for _ in range(2):
+        result_cache.obtener('k', calculo, False, EMA, cachear_si=lambda v: len(v) < 3)
+    assert calculo.veces == 2
+
+
+def test_invalidar_ema_solo_borra_lo_abierto(reloj):
+    result_cache.obtener('abierta', Calculo(), True, EMA)
+    result_cache.obtener('cerrada', Calculo(), False, EMA)
+    result_cache.obtener('otra_ema', Calculo(), True, ('db_principal', 2))
+    assert result_cache.invalidar_ema('db_principal', '1') == 1
+    assert set(result_cache._cache) == {'cerrada', 'otra_ema'}
+
+
+def test_precalentando_recalcula_lo_abierto_y_no_cuenta_uso(reloj):
+    abierta, cerrada = Calculo(), Calculo()
+    result_cache.obtener('abierta', abierta, True, EMA, receta='r')
+    result_cache.obtener('cerrada', cerrada, False, EMA)
+    with result_cache.precalentando():
+        result_cache.obtener('abierta', abierta, True, EMA, receta='r')
+        result_cache.obtener('cerrada', cerrada, False, EMA)
+    assert (abierta.veces, cerrada.veces) == (2, 1)
+    assert result_cache._usos['r'] == 1
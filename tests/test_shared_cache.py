@@ -0,0 +1,92 @@
+# tests/test_shared_cache.py
+# Snapshot compartido (app/shared_cache.py): al arrancar solo se reusa el de este despliegue.
+import json
+import os
+
+import pytest
+
+from app import shared_cache
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch):
+    ruta = tmp_path / 'emas_sensor_cache.snapshot'
+    monkeypatch.setattr(shared_cache, 'SENSOR_CACHE_SNAPSHOT_PATH', str(ruta))
+    monkeypatch.setattr(shared_cache, '_estado', {'version': None, 'ultimo_chequeo': 0.0, 'despliegue': None})
+    # Registra la variable para que se restaure al terminar (_resolver_despliegue la escribe)
+    monkeypatch.setitem(os.environ, shared_cache._DESPLIEGUE_ENV, '')
+    monkeypatch.delitem(os.environ, shared_cache._DESPLIEGUE_ENV)
+    return ruta
+
+
+def _nuevo_arranque(monkeypatch, token=None):
+    """Este proceso pasa a ser uno recién arrancado (sin despliegue resuelto)."""
+    monkeypatch.setitem(shared_cache._estado, 'despliegue', None)
+    if token is None:
+        os.environ.pop(shared_cache._DESPLIEGUE_ENV, None)
+    else:
+        os.environ[shared_cache._DESPLIEGUE_ENV] = token
+
+
+def _construir(datos, llamadas):
+    def construir():
+        llamadas.append(1)
+        return datos
+    return construir
+
+
+def _anotar_lock(ruta, token, procesos):
+    with open(f"{ruta}.lock", 'w') as archivo:
+        json.dump({'padre': shared_cache._proceso(os.getppid()), 'token': token, 'procesos': procesos}, archivo)
+
+
+def test_snapshot_de_un_arranque_anterior_con_el_mismo_padre_se_reconstruye(snapshot, monkeypatch):
+    llamadas = []
+    shared_cache.obtener_o_construir(_construir({'v': 1}, llamadas))
+    # Mismo padre (systemd, la misma shell), pero ningún proceso de ese despliegue sigue vivo
+    registro = json.loads(open(f"{snapshot}.lock").read())
+    _anotar_lock(snapshot, registro['token'], ['999999999:1'])
+    _nuevo_arranque(monkeypatch)
+    assert shared_cache.obtener_o_construir(_construir({'v': 2}, llamadas)) == {'v': 2}
+    assert len(llamadas) == 2
+
+
+def test_worker_hermano_reusa_el_snapshot(snapshot, monkeypatch):
+    llamadas = []
+    shared_cache.obtener_o_construir(_construir({'v': 1}, llamadas))
+    registro = json.loads(open(f"{snapshot}.lock").read())
+    # Otro worker del mismo master sigue vivo (cualquier proceso vivo sirve para simularlo)
+    _anotar_lock(snapshot, registro['token'], [shared_cache._proceso(os.getppid())])
+    _nuevo_arranque(monkeypatch)
+    assert shared_cache.obtener_o_construir(_construir({'v': 2}, llamadas)) == {'v': 1}
+    assert len(llamadas) == 1
+
+
+def test_hijos_heredan_el_despliegue_por_entorno(snapshot, monkeypatch):
+    llamadas = []
+    shared_cache.obtener_o_construir(_construir({'v': 1}, llamadas))
+    token = os.environ[shared_cache._DESPLIEGUE_ENV]
+    os.remove(f"{snapshot}.lock")
+    _nuevo_arranque(monkeypatch, token)
+    assert shared_cache.obtener_o_construir(_construir({'v': 2}, llamadas)) == {'v': 1}
+    _nuevo_arranque(monkeypatch, 'f' * 32)
+    assert shared_cache.obtener_o_construir(_construir({'v': 3}, llamadas)) == {'v': 3}
+    assert len(llamadas) == 2
+
+
+def test_version_nueva_ignora_otro_despliegue(snapshot, monkeypatch):
+    shared_cache.obtener_o_construir(lambda: {'v': 1})
+    propio = shared_cache._estado['despliegue']
+    monkeypatch.setitem(shared_cache._estado, 'despliegue', b'x' * 32)
+    shared_cache.publicar({'v': 2})
+    monkeypatch.setitem(shared_cache._estado, 'despliegue', propio)
+    monkeypatch.setitem(shared_cache._estado, 'ultimo_chequeo', -1e9)
+    assert shared_cache.version_nueva() is None
+
+
+def test_firma_invalida(snapshot):
+    shared_cache.obtener_o_construir(lambda: {'v': 1})
+    datos = bytearray(snapshot.read_bytes())
+    datos[-1] ^= 1
+    snapshot.write_bytes(bytes(datos))
+    assert shared_cache.cargar() is None
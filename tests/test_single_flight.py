@@ -0,0 +1,96 @@
+# tests/test_single_flight.py
+# Consultas idénticas simultáneas (app/single_flight.py): se comparten el resultado y los
+# errores, salvo que cancelen la petición del líder.
+import threading
+
+import pytest
+
+from app import single_flight
+from app.cancellation import ConsultaCancelada
+
+
+def _en_hilo(fn):
+    salida = {}
+    def correr():
+        try:
+            salida['resultado'] = fn()
+        except BaseException as e:
+            salida['error'] = e
+    hilo = threading.Thread(target=correr)
+    hilo.start()
+    return hilo, salida
+
+
+@pytest.fixture
+def esperando(monkeypatch):
+    """esperando(n): bloquea hasta que n seguidores estén esperando al líder."""
+    cupos = threading.Semaphore(0)
+    esperar = single_flight._esperar
+    def _esperar(vuelo, timeout):
+        cupos.release()
+        return esperar(vuelo, timeout)
+    monkeypatch.setattr(single_flight, '_esperar', _esperar)
+    return lambda n=1: all(cupos.acquire(timeout=5) for _ in range(n))
+
+
+def test_los_que_esperan_comparten_el_resultado(esperando):
+    entro, soltar = threading.Event(), threading.Event()
+    llamadas = []
+    def calcular():
+        llamadas.append(1); entro.set(); soltar.wait(5)
+        return 42
+    lider, salida_lider = _en_hilo(lambda: single_flight.ejecutar('compartido', calcular))
+    entro.wait(5)
+    seguidores = [_en_hilo(lambda: single_flight.ejecutar('compartido', calcular)) for _ in range(3)]
+    assert esperando(3)
+    soltar.set()
+    for hilo, _ in [(lider, salida_lider)] + seguidores: hilo.join(5)
+    assert [s['resultado'] for _, s in seguidores] == [42, 42, 42]
+    assert salida_lider['resultado'] == 42 and len(llamadas) == 1
+
+
+def test_el_error_del_lider_se_comparte(esperando):
+    entro, soltar = threading.Event(), threading.Event()
+    def calcular():
+        entro.set(); soltar.wait(5)
+        raise RuntimeError('falló la consulta')
+    lider, salida_lider = _en_hilo(lambda: single_flight.ejecutar('error', calcular))
+    entro.wait(5)
+    seguidor, salida = _en_hilo(lambda: single_flight.ejecutar('error', lambda: 'no debería correr'))
+    assert esperando()
+    soltar.set()
+    lider.join(5); seguidor.join(5)
+    assert isinstance(salida_lider['error'], RuntimeError)
+    assert salida['error'] is salida_lider['error']
+
+
+def test_si_cancelan_al_lider_el_que_espera_reintenta(esperando):
+    entro, soltar = threading.Event(), threading.Event()
+    def calcular_lider():
+        entro.set(); soltar.wait(5)
+        raise ConsultaCancelada('Consulta cancelada (reemplazada).')
+    lider, salida_lider = _en_hilo(lambda: single_flight.ejecutar('cancelada', calcular_lider))
+    entro.wait(5)
+    reintentos = single_flight.get_stats()['reintentos']
+    seguidor, salida = _en_hilo(lambda: single_flight.ejecutar('cancelada', lambda: 'propio'))
+    assert esperando()
+    soltar.set()
+    lider.join(5); seguidor.join(5)
+    assert isinstance(salida_lider['error'], ConsultaCancelada)
+    # El seguidor pasó a ser líder y calculó lo suyo
+    assert salida == {'resultado': 'propio'}
+    assert single_flight.get_stats()['reintentos'] == reintentos + 1
+    assert 'cancelada' not in single_flight._en_vuelo
+
+
+def test_espera_agotada():
+    entro, soltar = threading.Event(), threading.Event()
+    def calcular():
+        entro.set(); soltar.wait(5)
+        return 1
+    lider, _ = _en_hilo(lambda: single_flight.ejecutar('lenta', calcular))
+    entro.wait(5)
+    with pytest.raises(single_flight.EsperaAgotada):
+        single_flight.ejecutar('lenta', calcular, timeout=0.1)
+    soltar.set()
+    lider.join(5)
@@ -0,0 +1,74 @@
+# tests/test_warmup.py
+# Precalentamiento (app/warmup.py): con varios procesos, cada turno lo corre uno solo.
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import warmup
+
+
+class Reloj(datetime):
+    actual = datetime(2026, 10, 19, 6, 0)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.actual
+
+
+@pytest.fixture
+def corridas(tmp_path, monkeypatch):
+    monkeypatch.setattr(warmup, 'WARMUP_TURNOS_PATH', str(tmp_path / 'precalentamiento.turnos'))
+    monkeypatch.setattr(warmup, 'datetime', Reloj)
+    monkeypatch.setattr(Reloj, 'actual', datetime(2026, 10, 19, 6, 0))
+    corridas = []
+    monkeypatch.setattr(warmup, '_correr_y_anotar', lambda nombre, trabajo, emas=None: corridas.append((nombre, emas)))
+    return corridas
+
+
+def _procesos(trabajo, cantidad=3):
+    """Un programador por worker (comparten solo el archivo de turnos)."""
+    return [warmup.Programador([trabajo]) for _ in range(cantidad)]
+
+
+def _a_las(fecha):
+    Reloj.actual = fecha
+
+
+def test_turno_horario_lo_corre_un_solo_proceso(corridas):
+    procesos = _procesos({'nombre': 'lluvia', 'tipo': 'reporte', 'horas': ['06:30']})
+    _a_las(datetime(2026, 10, 19, 6, 30, 5))
+    for p in procesos: p.revisar()
+    assert corridas == [('lluvia', None)]
+
+    # Al día siguiente otro proceso llega primero: igual corre una sola vez
+    _a_las(datetime(2026, 10, 20, 6, 30, 40))
+    for p in reversed(procesos): p.revisar()
+    assert corridas == [('lluvia', None)] * 2
+
+
+def test_cada_n_minutos(corridas):
+    procesos = _procesos({'nombre': 'populares', 'tipo': 'populares', 'cada_minutos': 10})
+    for minutos, esperadas in [(5, 0), (11, 1), (15, 1), (20, 1), (21, 2), (25, 2)]:
+        _a_las(datetime(2026, 10, 19, 6, 0) + timedelta(minutes=minutos))
+        for p in procesos: p.revisar()
+        assert len(corridas) == esperadas, minutos
+
+
+def test_datos_nuevos_se_precalientan_una_vez_por_marca(corridas):
+    procesos = _procesos({'nombre': 'dashboard', 'tipo': 'dashboard', 'ema_id': [1, 2], 'al_llegar_datos': True})
+    invalidadas = []
+
+    def con_datos_nuevos(p, marcas):
+        def emas(nombre, trabajo):
+            invalidadas.append(marcas)
+            p.marcas.update({(nombre, ema_id): marca for ema_id, marca in marcas.items()})
+            return list(marcas)
+        return emas
+
+    for marcas in ({1: 'm1'}, {1: 'm1'}, {1: 'm2', 2: 'm1'}):
+        for p in procesos:
+            p._emas_con_datos_nuevos = con_datos_nuevos(p, marcas)
+            p.revisar()
+    assert corridas == [('dashboard', [1]), ('dashboard', [1, 2])]
+    # Cada proceso revisó (e invalidó su caché) en cada pasada
+    assert len(invalidadas) == 9